@@ -0,0 +1,284 @@
+"""
+run_batch.py — Multi-site batch runner for PeatFire-System
+
+Runs every stage (SLC, GRD, canal detection, carbon accounting, maps) of
+many site configs from a persistent SQLite job queue:
+
+    python run_batch.py sites/*.yaml --workers 4 --limit gpt=2 --limit snaphu=1
+    python run_batch.py --status
+
+Rerunning the same command resumes the batch: finished jobs are skipped,
+jobs interrupted by a crash are requeued, failed ones retried up to
+--max-attempts. Editing a site config (new acquisitions) queues a new run of
+that site and supersedes the unfinished jobs of its previous version. GPT,
+SNAPHU and CPU-bound stages share per-resource limits across all sites;
+queue throughput and wait/run latency are reported at the end.
+
+A site is named after its config file, or after its folder for
+sites/<site>/config.yaml; two configs naming the same site are rejected.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from importlib.machinery import SourceFileLoader
+from pathlib import Path
+
+import yaml
+
+PIPELINE_DIR = Path(__file__).resolve().parent / "scripts" / "real_sentinel"
+sys.path.insert(0, str(PIPELINE_DIR))
+
+import async_runner  # noqa: E402
+from config_check import site_name, site_names  # noqa: E402
+from job_queue import JobQueue, ResourceLimits  # noqa: E402
+
+# stage → (resource held for the whole job, stages it waits for)
+# slc/grd take gpt/snaphu/cpu slots inside the processors instead
+STAGES = {
+    "slc": (None, ()),
+    "grd": (None, ()),
+    "canals": ("cpu", ("slc", "grd")),
+    "carbon": ("cpu", ("slc",)),
+    "maps": ("maps", ("slc", "grd", "canals")),  # pyplot is not thread-safe: limit 1
+}
+DEFAULT_LIMITS = {"gpt": 2, "snaphu": 1, "cpu": 2, "maps": 1}
+
+_modules = {}
+_modules_lock = threading.Lock()
+
+
+def pipeline_module(filename):
+    """Import one of the numbered pipeline scripts (once, from any thread)"""
+    with _modules_lock:
+        if filename not in _modules:
+            name = "pipeline_" + filename.split(".")[1]
+            loader = SourceFileLoader(name, str(PIPELINE_DIR / filename))
+            module = importlib.util.module_from_spec(importlib.util.spec_from_loader(name, loader))
+            loader.exec_module(module)
+            _modules[filename] = module
+        return _modules[filename]
+
+
+def load_config(config_path):
+    with open(config_path, 'r') as f:
+        return yaml.safe_load(f)
+
+
+def run_slc(config_path, limits):
+    module = pipeline_module("1.process_sentinel1.py")
+    if load_config(config_path)['sentinel1'].get('slc_stack'):
+        processor = module.SLC_StackProcessor(config_path)
+        processor.limits = limits
+        return processor.run_stack()
+    processor = module.SLC_Processor(config_path)
+    processor.limits = limits
+    return processor.run_full_pipeline()
+
+
+def run_grd(config_path, limits):
+    # incremental: only acquisitions not yet in the composite are processed
+    processor = pipeline_module("2.sentinel1_grd.py").GRD_Processor(config_path)
+    processor.limits = limits
+    return processor.update_composite()
+
+
+def run_canals(config_path, limits):
+    from canal_detection import CanalDetector
+    return CanalDetector.from_config(load_config(config_path)).run()
+
+
+def run_carbon(config_path, limits):
+    from carbon_accounting import CarbonAccounting
+    return CarbonAccounting.from_config(load_config(config_path)).run()
+
+
+def run_maps(config_path, limits):
+    viz = pipeline_module("3.generate_maps").ResultVisualizer(config_path)
+    viz.load_data()
+    viz.plot_subsidence_map()
+    tiles = viz.render_tiles()
+
+    from report_renderer import ReportRenderer
+    config = load_config(config_path)
+    ReportRenderer.from_config(config).run({site_name(config_path): config})
+    return tiles
+
+
+RUNNERS = {
+    "slc": run_slc,
+    "grd": run_grd,
+    "canals": run_canals,
+    "carbon": run_carbon,
+    "maps": run_maps,
+}
+
+
+def site_stages(config_path, stages):
+    """Stages that apply to a site (carbon needs parcels)"""
+    config = load_config(config_path)
+    return [s for s in stages if s != "carbon" or (config.get('carbon') or {}).get('parcels')]
+
+
+def enqueue_sites(queue, config_paths, stages):
+    """Queue each site's stage DAG; already-known runs are left untouched"""
+    for config_path, site in site_names(config_paths).items():
+        ids = {}
+        for stage in site_stages(config_path, stages):
+            resource, after = STAGES[stage]
+            deps = [ids[s] for s in after if s in ids]
+            ids[stage] = queue.enqueue(site, stage, Path(config_path).resolve(), resource, deps)
+
+
+class BatchRunner:
+    def __init__(self, queue, limits, workers=4, poll_s=1.0):
+        """Runs ready jobs on `workers` threads within the resource limits"""
+        self.queue = queue
+        self.limits = limits
+        self.workers = workers
+        self.poll_s = poll_s
+        self.interrupted = False
+
+    def execute(self, job):
+        label = f"{job['site']}/{job['stage']}"
+        print(f"\n▶ [{label}] attempt {job['attempts'] + 1}")
+        t0 = time.perf_counter()
+        try:
+            result = RUNNERS[job["stage"]](job["config"], self.limits)
+        except Exception as e:
+            if self.interrupted:
+                # left 'running': the next batch requeues it without using up an attempt
+                print(f"⚠ [{label}] cancelled")
+                return False
+            self.queue.fail(job["id"], f"{type(e).__name__}: {e}\n{traceback.format_exc()}")
+            print(f"❌ [{label}] failed: {e}")
+            return False
+        self.queue.complete(job["id"], result)
+        print(f"✓ [{label}] done ({(time.perf_counter() - t0) / 60:.1f} min)")
+        return True
+
+    def run(self):
+        """Run until no job is ready or running; returns the batch statistics"""
+        start = time.time()
+        recovered = self.queue.recover()
+        if recovered:
+            print(f"  ⚠ {recovered} job(s) interrupted by a previous run requeued")
+
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                for job in self.queue.ready():
+                    if len(running) >= self.workers:
+                        break
+                    if not self.limits.try_acquire(job["resource"]):
+                        continue  # e.g. all cpu slots busy: try the next ready job
+                    if not self.queue.claim(job["id"]):
+                        self.limits.release(job["resource"])
+                        continue
+                    running[pool.submit(self.execute, job)] = job
+
+                if not running:
+                    break  # nothing ready (done, failed or blocked)
+
+                try:
+                    done, _ = wait(running, timeout=self.poll_s, return_when=FIRST_COMPLETED)
+                except KeyboardInterrupt:
+                    print(f"\n⚠ Interrupted: cancelling {len(running)} running job(s)")
+                    self.interrupted = True
+                    async_runner.cancel_all()  # kills every site's GPT/SNAPHU trees
+                    raise
+                for future in done:
+                    self.limits.release(running.pop(future)["resource"])
+
+        return self.queue.stats(since=start)
+
+
+def duration(seconds):
+    if seconds < 120:
+        return f"{seconds:.0f}s"
+    return f"{seconds / 60:.1f}m" if seconds < 7200 else f"{seconds / 3600:.1f}h"
+
+
+def print_report(stats, limits=None):
+    counts = stats["counts"]
+    print("\n" + "=" * 50)
+    print("BATCH QUEUE")
+    print("=" * 50)
+    print("  " + ", ".join(f"{n} {s}" for s, n in counts.items() if n))
+    if stats["throughput_per_h"] is not None:
+        print(f"  Throughput: {stats['throughput_per_h']:.1f} jobs/h")
+    if stats["stages"]:
+        print(f"  {'stage':<10}{'done':>6}{'wait p50':>11}{'wait p95':>11}{'run p50':>11}{'run p95':>11}")
+        for stage, s in stats["stages"].items():
+            print(f"  {stage:<10}{s['done']:>6}"
+                  + "".join(f"{duration(s[k][q]):>11}" for k in ("wait_s", "run_s") for q in ("p50", "p95")))
+    if limits is not None and limits.wait_s:
+        print("  Slot waits: " + ", ".join(f"{r} {duration(w)}" for r, w in limits.wait_s.items()))
+
+
+def parse_limits(values):
+    limits = dict(DEFAULT_LIMITS)
+    for value in values or []:
+        name, _, n = value.partition("=")
+        limits[name] = int(n) if n and n.lower() != "none" else None
+    return limits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("configs", nargs="*", help="site config.yaml files")
+    parser.add_argument("--queue", default="data/batch/queue.sqlite", help="SQLite job queue")
+    parser.add_argument("--workers", type=int, default=4, help="jobs running at once")
+    parser.add_argument("--limit", action="append", metavar="RESOURCE=N",
+                        help=f"concurrent gpt/snaphu/cpu/maps slots (default {DEFAULT_LIMITS})")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma-separated stages to run")
+    parser.add_argument("--max-attempts", type=int, default=2)
+    parser.add_argument("--retry-failed", action="store_true", help="requeue failed and blocked jobs")
+    parser.add_argument("--status", action="store_true", help="report the queue and exit")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)} (use {', '.join(STAGES)})")
+
+    try:
+        site_names(args.configs)
+    except ValueError as e:
+        parser.error(str(e))
+
+    queue = JobQueue(args.queue, max_attempts=args.max_attempts)
+    try:
+        if args.status:
+            print_report(queue.stats())
+            return 0
+
+        if args.retry_failed:
+            print(f"  {queue.retry_failed()} failed/blocked job(s) requeued")
+        enqueue_sites(queue, args.configs, stages)
+
+        limits = ResourceLimits(parse_limits(args.limit))
+        print(f"PEATFIRE BATCH: {len(args.configs)} site(s), {args.workers} workers, "
+              f"limits {limits.limits}")
+        stats = BatchRunner(queue, limits, workers=args.workers).run()
+        print_report(stats, limits)
+
+        report = Path(args.queue).parent / f"batch_report_{datetime.now():%Y%m%d_%H%M%S}.json"
+        with open(report, 'w') as f:
+            json.dump({"stats": stats, "limits": limits.limits, "slot_wait_s": limits.wait_s,
+                       "workers": args.workers, "pid": os.getpid()}, f, indent=2)
+        print(f"\n✓ Report: {report}")
+        return 0 if stats["counts"]["failed"] == stats["counts"]["blocked"] == 0 else 1
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
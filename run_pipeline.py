@@ -1,32 +1,207 @@
 """
 run_pipeline.py — Main orchestrator for PeatFire-System
-Runs Module 1A (InSAR) → 1B (VV backscatter) → Visualization
+
+One subcommand per stage; each imports its heavy modules (rasterio, scipy,
+geopandas, matplotlib) only when it runs, and the config is validated for
+the requested stages before anything starts:
+
+    python run_pipeline.py all                   # 1A → 1B → canals → carbon → maps
+    python run_pipeline.py slc                   # Module 1A: InSAR (pair or stack)
+    python run_pipeline.py grd [--update]        # Module 1B: VV composite
+    python run_pipeline.py canals | carbon | maps | report
+    python run_pipeline.py plan [--stages slc,grd]   # GPT command lines, cache hits, sizes; runs nothing
+    python run_pipeline.py check [--stages ...]      # validate the config and exit
+
+Use -c/--config to pick a site config (default: scripts/real_sentinel/config.yaml).
 """
 
+import argparse
+import importlib.util
+import sys
+import time
+from importlib.machinery import SourceFileLoader
 from pathlib import Path
-from real_sentinel.process_sentinel1 import SLC_Processor
-from real_sentinel.sentinel1_grd import GRD_Processor
-from real_sentinel.generate_maps import ResultVisualizer
 
-def main():
-    config_path = Path("real_sentinel/config.yaml")
-  
-    print("PEATFIRE SYSTEM PIPELINE")
+import yaml
+
+PIPELINE_DIR = Path(__file__).resolve().parent / "scripts" / "real_sentinel"
+sys.path.insert(0, str(PIPELINE_DIR))
+
+from config_check import ConfigError, check_config, site_name  # noqa: E402
+
+ALL_STAGES = ("slc", "grd", "canals", "carbon", "maps")
+
+# outputs of the in-process stages, for plan
+STAGE_OUTPUTS = {
+    "canals": ["canal_risk_score.tif", "canal_classification.tif", "canal_confirmed.shp", "canal_potential.shp"],
+    "carbon": ["carbon_parcels.gpkg", "carbon_parcels.csv"],
+}
+
+
+def pipeline_module(filename):
+    """Import one of the numbered pipeline scripts"""
+    name = "pipeline_" + filename.split(".")[1]
+    if name not in sys.modules:
+        loader = SourceFileLoader(name, str(PIPELINE_DIR / filename))
+        module = importlib.util.module_from_spec(importlib.util.spec_from_loader(name, loader))
+        sys.modules[name] = module
+        loader.exec_module(module)
+    return sys.modules[name]
 
 
+def slc_processor(config_path, config, plan=None):
+    module = pipeline_module("1.process_sentinel1.py")
+    if config['sentinel1'].get('slc_stack'):
+        return module.SLC_StackProcessor(config_path, plan)
+    return module.SLC_Processor(config_path, plan)
+
+
+def run_slc(config_path, config, args):
     print("\n[1A] Processing Sentinel-1 SLC → InSAR displacement map...\n")
-    slc = SLC_Processor(config_path)
-    slc_outputs = slc.run_full_pipeline()
+    processor = slc_processor(config_path, config)
+    if config['sentinel1'].get('slc_stack'):
+        return processor.run_stack()
+    return processor.run_full_pipeline()
+
 
+def run_grd(config_path, config, args):
     print("\n[1B] Processing Sentinel-1 GRD → VV backscatter composite...\n")
-    grd = GRD_Processor(config_path)
-    vv_output = grd.run_full_pipeline()
+    processor = pipeline_module("2.sentinel1_grd.py").GRD_Processor(config_path)
+    if getattr(args, "update", False):
+        return processor.update_composite()
+    return processor.run_full_pipeline()
+
+
+def run_canals(config_path, config, args):
+    from canal_detection import CanalDetector
+    return CanalDetector.from_config(config).run()
+
 
+def run_carbon(config_path, config, args):
+    from carbon_accounting import CarbonAccounting
+    return CarbonAccounting.from_config(config).run()
+
+
+def run_maps(config_path, config, args):
     print("\n[MAP] Generating publication-quality maps...\n")
-    viz = ResultVisualizer(config_path)
+    viz = pipeline_module("3.generate_maps").ResultVisualizer(config_path)
     viz.load_data()
     viz.plot_subsidence_map()
+    viz.render_tiles()
+    return run_report(config_path, config, args)
+
+
+def run_report(config_path, config, args):
+    from report_renderer import ReportRenderer
+    return ReportRenderer.from_config(config).run({site_name(config_path): config})
+
+
+def run_all(config_path, config, args):
+    for stage in all_stages(config):
+        STAGES[stage](config_path, config, args)
     print("Results saved to your reports directory.\n")
 
+
+def run_plan(config_path, config, args):
+    """Resolve every step of the stages without running any of them"""
+    from execution_plan import ExecutionPlan
+    from step_cache import StepCache
+
+    plan = ExecutionPlan(StepCache.from_config(config))
+    products = Path(config['output']['products'])
+    for stage in args.stages:
+        if stage in ("slc", "grd"):
+            if stage == "slc":
+                processor = slc_processor(config_path, config, plan)
+            else:
+                processor = pipeline_module("2.sentinel1_grd.py").GRD_Processor(config_path, plan)
+            processor.profiler.enabled = False
+            if stage == "slc" and config['sentinel1'].get('slc_stack'):
+                processor.run_stack()
+            else:
+                processor.run_full_pipeline()
+        elif stage in STAGE_OUTPUTS:
+            plan.python(stage, [products / name for name in STAGE_OUTPUTS[stage]])
+        elif stage in ("maps", "report"):
+            plan.python(stage, [Path(config['output']['reports']) / "report.pdf"])
+    plan.report()
+    return plan
+
+
+STAGES = {
+    "slc": run_slc,
+    "grd": run_grd,
+    "canals": run_canals,
+    "carbon": run_carbon,
+    "maps": run_maps,
+    "report": run_report,
+}
+
+
+def all_stages(config):
+    """Stages `all` runs for a site (carbon needs parcels)"""
+    return [s for s in ALL_STAGES if s != "carbon" or (config.get('carbon') or {}).get('parcels')]
+
+
+def parse_stages(value, parser):
+    stages = [s.strip() for s in value.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)} (use {', '.join(STAGES)})")
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-c", "--config", default=str(PIPELINE_DIR / "config.yaml"), help="site config.yaml")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("all", help="run every stage in order")
+    commands.add_parser("slc", help="Module 1A: InSAR subsidence (pair, or stack if slc_stack is set)")
+    grd = commands.add_parser("grd", help="Module 1B: VV backscatter composite")
+    grd.add_argument("--update", action="store_true", help="fold new scenes into the composite state")
+    commands.add_parser("canals", help="Module 2: canal detection")
+    commands.add_parser("carbon", help="zonal carbon-loss accounting (carbon.parcels)")
+    commands.add_parser("maps", help="maps, web tiles and the PDF report")
+    commands.add_parser("report", help="PDF report only")
+    for name, text in (("plan", "print the execution plan without running anything"),
+                       ("check", "validate the config and exit")):
+        sub = commands.add_parser(name, help=text)
+        sub.add_argument("--stages", default=None, help="comma-separated stages (default: all)")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    try:
+        with open(args.config, 'r') as f:
+            config = yaml.safe_load(f)
+    except (OSError, yaml.YAMLError) as e:
+        print(f"❌ Cannot read config {args.config}: {e}")
+        return 2
+
+    if args.command in ("plan", "check"):
+        args.stages = parse_stages(args.stages, parser) if args.stages else all_stages(config or {})
+        stages = args.stages
+    elif args.command == "all":
+        stages = all_stages(config or {})
+    else:
+        stages = [args.command]
+
+    try:
+        # a plan reports missing inputs per step instead of refusing to run
+        check_config(config, stages, args.config, check_inputs=args.command != "plan")
+    except ConfigError as e:
+        print(f"❌ Invalid config {e}")
+        return 2
+    print(f"✓ Config valid for {', '.join(stages)} ({(time.perf_counter() - t0) * 1000:.0f} ms)")
+
+    if args.command == "check":
+        return 0
+
+    print("PEATFIRE SYSTEM PIPELINE")
+    runner = run_plan if args.command == "plan" else run_all if args.command == "all" else STAGES[args.command]
+    runner(args.config, config, args)
+    return 0
+
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
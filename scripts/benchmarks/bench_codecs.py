@@ -0,0 +1,140 @@
+"""
+Size / speed tradeoff of the product GeoTIFF codecs
+
+Writes a synthetic subsidence-like float32 product and a 0/1 quality mask
+through ProductWriter with every codec, then measures file size, write time,
+full-resolution read, overview read (figure-sized) and random 512x512 window
+reads. Results are printed and saved as JSON next to run_benchmarks.py output:
+
+    python scripts/benchmarks/bench_codecs.py --size 8192 --repeat 3
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+from run_benchmarks import BENCH_DIR, environment
+
+from product_writer import ProductWriter  # on sys.path via run_benchmarks
+
+VARIANTS = [
+    ("none", None), ("lzw", None),
+    ("deflate", 1), ("deflate", 6), ("deflate", 9),
+    ("zstd", 1), ("zstd", 9), ("zstd", 19),
+]
+
+
+def synthetic_product(size, seed=0):
+    """Smooth deformation field + speckle-like noise, NaN outside a swath edge"""
+    rng = np.random.default_rng(seed)
+    coarse = rng.normal(0, 1, (size // 64 + 2, size // 64 + 2)).astype('float32')
+    field = np.kron(coarse, np.ones((64, 64), dtype='float32'))[:size, :size]
+    field = np.cumsum(field, axis=1) / 64
+    data = (field * 5 + rng.normal(0, 2, (size, size))).astype('float32')
+    data[:, : size // 10] = np.nan  # outside the swath
+    mask = (rng.uniform(0, 1, (size, size)) > 0.3).astype('uint8')
+    return data, mask
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def bench_variant(path, data, kind, codec, level, repeat, n_windows=32):
+    size = data.shape[0]
+    profile = {
+        'width': size, 'height': size, 'count': 1, 'dtype': str(data.dtype),
+        'crs': 'EPSG:4326', 'transform': from_origin(102.0, 1.0, 0.00027, 0.00027),
+        'nodata': np.nan if kind == "continuous" else None,
+    }
+    writer = ProductWriter(codec=codec, level=level)
+
+    def write():
+        with writer.open(path, profile, kind=kind) as dst:
+            for row in range(0, size, 1024):
+                h = min(1024, size - row)
+                dst.write(data[row:row + h], 1, window=Window(0, row, size, h))
+
+    write_s = timed(write, 1)
+
+    def read_full():
+        with rasterio.open(path) as src:
+            src.read(1)
+
+    def read_overview():
+        with rasterio.open(path) as src:
+            src.read(1, out_shape=(1024, 1024), resampling=Resampling.average)
+
+    rnd = random.Random(0)
+    windows = [Window(rnd.randrange(0, max(1, size - 512)), rnd.randrange(0, max(1, size - 512)), 512, 512)
+               for _ in range(n_windows)]
+
+    def read_windows():
+        with rasterio.open(path) as src:
+            for window in windows:
+                src.read(1, window=window)
+
+    return {
+        "kind": kind,
+        "codec": codec,
+        "level": level,
+        "size_mb": path.stat().st_size / 1024**2,
+        "ratio": data.nbytes / path.stat().st_size,
+        "write_s": write_s,
+        "read_full_s": timed(read_full, repeat),
+        "read_overview_s": timed(read_overview, repeat),
+        "read_windows_s": timed(read_windows, repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=4096, help="raster edge length in pixels")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", help="result JSON (default: results/codecs_<time>.json)")
+    args = parser.parse_args()
+
+    data, mask = synthetic_product(args.size)
+    results = []
+
+    with tempfile.TemporaryDirectory(prefix="peatfire_codecs_") as tmp:
+        for kind, array in (("continuous", data), ("mask", mask)):
+            variants = VARIANTS if kind == "continuous" else [(c, l) for c, l in VARIANTS if l in (None, 6, 9)]
+            for codec, level in variants:
+                path = Path(tmp) / f"{kind}_{codec}_{level}.tif"
+                results.append(bench_variant(path, array, kind, codec, level, args.repeat))
+                path.unlink()
+
+    print(f"  {'product':<12}{'codec':<12}{'MB':>9}{'ratio':>7}{'write s':>9}"
+          f"{'full s':>8}{'ovr s':>8}{'win s':>8}")
+    for r in results:
+        codec = r["codec"] + (f"/{r['level']}" if r["level"] is not None else "")
+        print(f"  {r['kind']:<12}{codec:<12}{r['size_mb']:>9.1f}{r['ratio']:>7.1f}{r['write_s']:>9.2f}"
+              f"{r['read_full_s']:>8.2f}{r['read_overview_s']:>8.3f}{r['read_windows_s']:>8.3f}")
+
+    out = Path(args.out) if args.out else BENCH_DIR / "results" / f"codecs_{datetime.now():%Y%m%d_%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump({"environment": environment(), "args": vars(args), "results": results}, f, indent=2)
+    print(f"\n✓ Results: {out}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
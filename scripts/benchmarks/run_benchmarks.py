@@ -0,0 +1,317 @@
+"""
+Benchmark suite for the Sentinel-1 pipeline, runnable without SNAP
+
+SNAP GPT and SNAPHU are replaced by standin_snap.py, which writes synthetic
+BEAM-DIMAP products of a chosen size after a chosen latency, so the
+orchestration (scheduler, cache, fusion, SNAPHU driver) and the numpy/rasterio
+stages can be timed on any machine:
+
+    slc_pipeline     SLC_Processor.run_full_pipeline (stand-in GPT/SNAPHU)
+    extract          SLC_Processor.extract_products on a synthetic geocoded product
+    grd_composite    GRD_Processor.create_median_composite over a stack of scenes
+    visualizer       ResultVisualizer.load_data + plot_subsidence_map
+
+Results go to a JSON file (one entry per case × size × stack depth) with the
+git commit and library versions, so runs can be compared across versions:
+
+    python scripts/benchmarks/run_benchmarks.py --sizes 1024 4096 --stack-depths 4 16
+    python scripts/benchmarks/run_benchmarks.py --compare results/old.json results/new.json
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from importlib.machinery import SourceFileLoader
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+BENCH_DIR = Path(__file__).resolve().parent
+PIPELINE_DIR = BENCH_DIR.parent / "real_sentinel"
+sys.path.insert(0, str(PIPELINE_DIR))
+sys.path.insert(0, str(BENCH_DIR))
+
+from standin_snap import write_dimap  # noqa: E402
+
+CASES = ("slc_pipeline", "extract", "grd_composite", "visualizer")
+
+# SAFE names only need to parse (acquisition dates → temporal baseline)
+MASTER_SAFE = "S1A_IW_SLC__1SDV_20251026T215955_20251026T220022_061602_07B1DF_FE49.SAFE"
+SLAVE_SAFE = "S1A_IW_SLC__1SDV_20251107T215954_20251107T220021_061777_07B8B7_EF0D.SAFE"
+
+
+def load_module(filename, name):
+    """Import one of the numbered pipeline scripts"""
+    path = PIPELINE_DIR / filename
+    loader = SourceFileLoader(name, str(path))
+    spec = importlib.util.spec_from_loader(name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+def standin_executable(bin_dir, mode):
+    """A gpt/snaphu executable that forwards to standin_snap.py"""
+    script = BENCH_DIR / "standin_snap.py"
+    if os.name == "nt":
+        exe = bin_dir / f"{mode}.cmd"
+        exe.write_text(f'@"{sys.executable}" "{script}" {mode} %*\r\n')
+    else:
+        exe = bin_dir / mode
+        exe.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{script}" {mode} "$@"\n')
+        exe.chmod(0o755)
+    return exe
+
+
+class Workspace:
+    def __init__(self, root, size, latency, base_config):
+        """Throwaway data folders + config.yaml pointing at the stand-ins"""
+        self.root = Path(root)
+        self.size = size
+        for sub in ("bin", "inputs", "products", "reports", "temp"):
+            (self.root / sub).mkdir(parents=True, exist_ok=True)
+
+        self.master = self.root / "inputs" / MASTER_SAFE
+        self.slave = self.root / "inputs" / SLAVE_SAFE
+        self.master.mkdir(exist_ok=True)
+        self.slave.mkdir(exist_ok=True)
+
+        config = json.loads(json.dumps(base_config))  # deep copy
+        config['sentinel1'].update(slc_master=str(self.master), slc_slave=str(self.slave), grd_files=[])
+        config['snap']['gpt_path'] = str(standin_executable(self.root / "bin", "gpt"))
+        config.setdefault('snaphu', {})['path'] = str(standin_executable(self.root / "bin", "snaphu"))
+        config['output'] = {
+            'products': str(self.root / "products"),
+            'reports': str(self.root / "reports"),
+            'temp': str(self.root / "temp"),
+        }
+        # Time the work itself: no step cache hits, no profiler overhead, full swath
+        config.setdefault('cache', {})['enabled'] = False
+        config.setdefault('profiling', {})['enabled'] = False
+        config.setdefault('aoi', {})['areas'] = []
+
+        self.config_path = self.root / "config.yaml"
+        with open(self.config_path, 'w') as f:
+            yaml.safe_dump(config, f)
+
+        os.environ["STANDIN_ROWS"] = str(size)
+        os.environ["STANDIN_COLS"] = str(size)
+        os.environ["STANDIN_LATENCY_S"] = str(latency)
+
+    def reset_outputs(self):
+        for sub in ("products", "temp"):
+            shutil.rmtree(self.root / sub, ignore_errors=True)
+            (self.root / sub).mkdir()
+
+    def synthetic_products(self):
+        """GeoTIFFs ResultVisualizer reads from the products folder"""
+        import rasterio
+        from rasterio.transform import from_origin
+
+        rng = np.random.default_rng(0)
+        profile = {
+            'driver': 'GTiff', 'width': self.size, 'height': self.size, 'count': 1,
+            'crs': 'EPSG:4326', 'transform': from_origin(102.0, 1.0, 0.00027, 0.00027),
+            'compress': 'lzw',
+        }
+        layers = {
+            "subsidence_velocity.tif": rng.normal(-20, 15, (self.size, self.size)).astype('float32'),
+            "coherence_median.tif": rng.uniform(0, 1, (self.size, self.size)).astype('float32'),
+            "vv_median.tif": rng.normal(-15, 3, (self.size, self.size)).astype('float32'),
+            "canal_risk_score.tif": rng.uniform(0, 1, (self.size, self.size)).astype('float32'),
+            "canal_classification.tif": rng.integers(0, 4, (self.size, self.size)).astype('uint8'),
+        }
+        for name, data in layers.items():
+            with rasterio.open(self.root / "products" / name, 'w', dtype=data.dtype, **profile) as dst:
+                dst.write(data, 1)
+
+
+def peak_rss_mb():
+    """Peak RSS of this process so far (None where unavailable)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024**2 if sys.platform == "darwin" else rss / 1024
+
+
+def time_case(fn, repeat, setup=None, verbose=False):
+    """Wall times of `repeat` runs of fn (setup() before each, not timed)"""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        sink = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        with sink:
+            t0 = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t0)
+    return times
+
+
+def run_case(case, ws, depth, args, modules):
+    slc_mod, grd_mod, maps_mod = modules
+
+    if case == "slc_pipeline":
+        def setup():
+            ws.reset_outputs()
+        return time_case(lambda: slc_mod.SLC_Processor(ws.config_path).run_full_pipeline(),
+                         args.repeat, setup, args.verbose)
+
+    if case == "extract":
+        ws.reset_outputs()
+        geocoded = write_dimap(ws.root / "temp" / "geocoded.dim", ["Phase_ifg_VV", "coh_VV"])
+        with contextlib.redirect_stdout(io.StringIO()):
+            processor = slc_mod.SLC_Processor(ws.config_path)
+        return time_case(lambda: processor.extract_products(geocoded), args.repeat, verbose=args.verbose)
+
+    if case == "grd_composite":
+        ws.reset_outputs()
+        scenes = [write_dimap(ws.root / "temp" / f"grd_{i}_db.dim", ["Sigma0_VV_db"]) for i in range(depth)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            processor = grd_mod.GRD_Processor(ws.config_path)
+        return time_case(lambda: processor.create_median_composite(scenes), args.repeat, verbose=args.verbose)
+
+    if case == "visualizer":
+        import matplotlib.pyplot as plt
+        ws.reset_outputs()
+        ws.synthetic_products()
+
+        def render():
+            viz = maps_mod.ResultVisualizer(ws.config_path)
+            viz.load_data()
+            viz.plot_subsidence_map()
+            plt.close('all')
+        return time_case(render, args.repeat, verbose=args.verbose)
+
+    raise ValueError(f"Unknown case: {case}")
+
+
+def environment():
+    """Version info stored with every result file"""
+    def git(*cmd):
+        try:
+            return subprocess.run(["git", *cmd], cwd=BENCH_DIR, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    import rasterio
+    return {
+        "created": datetime.now().isoformat(timespec='seconds'),
+        "commit": git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "rasterio": rasterio.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run(args):
+    with open(args.config, 'r') as f:
+        base_config = yaml.safe_load(f)
+
+    import matplotlib
+    matplotlib.use("Agg")
+    modules = (
+        load_module("1.process_sentinel1.py", "process_sentinel1"),
+        load_module("2.sentinel1_grd.py", "sentinel1_grd"),
+        load_module("3.generate_maps", "generate_maps"),
+    )
+
+    results = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory(prefix=f"peatfire_bench_{size}_") as tmp:
+            ws = Workspace(tmp, size, args.latency, base_config)
+            for case in args.cases:
+                # only the composite depends on the stack depth
+                depths = args.stack_depths if case == "grd_composite" else [None]
+                for depth in depths:
+                    label = f"{case} {size}px" + (f" ×{depth}" if depth else "")
+                    print(f"▶ {label}")
+                    times = run_case(case, ws, depth, args, modules)
+                    median = statistics.median(times)
+                    mpix = size * size * (depth or 1) / 1e6
+                    results.append({
+                        "case": case,
+                        "size": size,
+                        "stack_depth": depth,
+                        "latency_s": args.latency,
+                        "repeat": args.repeat,
+                        "wall_s": times,
+                        "median_s": median,
+                        "min_s": min(times),
+                        "mpix_per_s": mpix / median if median > 0 else None,
+                        "peak_rss_mb": peak_rss_mb(),
+                    })
+                    print(f"  ✓ median {median:.3f} s (min {min(times):.3f} s, {mpix / median:.1f} Mpx/s)")
+
+    out = Path(args.out) if args.out else (
+        BENCH_DIR / "results" / f"bench_{datetime.now():%Y%m%d_%H%M%S}.json")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump({"environment": environment(), "args": vars(args), "results": results}, f, indent=2)
+    print(f"\n✓ Results: {out}")
+    return out
+
+
+def compare(old_path, new_path):
+    """Median wall time of each case in new vs old"""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    def index(doc):
+        return {(r["case"], r["size"], r["stack_depth"]): r for r in doc["results"]}
+
+    old_idx, new_idx = index(old), index(new)
+    print(f"  old: {old['environment'].get('commit')}  new: {new['environment'].get('commit')}")
+    print(f"  {'case':<28}{'old s':>10}{'new s':>10}{'speedup':>10}")
+    for key in sorted(set(old_idx) & set(new_idx), key=str):
+        case, size, depth = key
+        label = f"{case} {size}px" + (f" ×{depth}" if depth else "")
+        o, n = old_idx[key]["median_s"], new_idx[key]["median_s"]
+        print(f"  {label:<28}{o:>10.3f}{n:>10.3f}{o / n:>9.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default=str(PIPELINE_DIR / "config.yaml"),
+                        help="pipeline config to base the benchmark config on")
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1024, 2048],
+                        help="raster edge lengths in pixels")
+    parser.add_argument("--stack-depths", nargs="+", type=int, default=[4, 12],
+                        help="scenes per GRD composite")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds each stand-in GPT/SNAPHU call sleeps")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", help="result JSON (default: results/bench_<time>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+    parser.add_argument("--verbose", action="store_true", help="show pipeline output")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
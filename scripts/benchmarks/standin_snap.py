@@ -0,0 +1,175 @@
+"""
+Stand-in for SNAP GPT and SNAPHU, for benchmarking without SNAP
+
+    python standin_snap.py gpt <graph.xml> -Poutput=<out.dim> [-Pkey=val ...]
+    python standin_snap.py snaphu -f snaphu.conf [...]
+
+GPT mode writes a synthetic BEAM-DIMAP product (ENVI bands, big-endian
+float32, georeferenced) of STANDIN_ROWS x STANDIN_COLS pixels after sleeping
+STANDIN_LATENCY_S. Band names follow what the pipeline reads downstream:
+Sigma0_VV_db for GRD graphs, Phase_ifg_VV + coh_VV otherwise. SnaphuExport
+writes a snaphu.conf + phase file instead. SNAPHU mode prints SnaphuRunner's
+per-tile progress lines and writes the OUTFILE named in the .conf.
+
+Values are seeded from the output name, so reruns produce identical data.
+"""
+
+import hashlib
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Grid origin / spacing of the synthetic products (Riau, ~30 m)
+ORIGIN_LON, ORIGIN_LAT = 102.0, 1.0
+SPACING_DEG = 0.00027
+STRIP_ROWS = 512
+
+
+def raster_shape():
+    return int(os.environ.get("STANDIN_ROWS", 1024)), int(os.environ.get("STANDIN_COLS", 1024))
+
+
+def latency():
+    return float(os.environ.get("STANDIN_LATENCY_S", 0))
+
+
+def _rng(name):
+    seed = int.from_bytes(hashlib.sha256(str(name).encode()).digest()[:8], 'little')
+    return np.random.default_rng(seed)
+
+
+def _band_values(band, rng, shape):
+    if band.startswith("Sigma0"):
+        return rng.normal(-15.0, 3.0, shape)
+    if band.startswith("coh"):
+        return rng.uniform(0.0, 1.0, shape)
+    return rng.uniform(-np.pi, np.pi, shape)  # (unwrapped) phase
+
+
+def write_raw(path, band, rows, cols, seed_name):
+    """Big-endian float32 raster written in strips (bounded memory)"""
+    rng = _rng(f"{seed_name}/{band}")
+    with open(path, 'wb') as f:
+        for row in range(0, rows, STRIP_ROWS):
+            n = min(STRIP_ROWS, rows - row)
+            f.write(_band_values(band, rng, (n, cols)).astype('>f4').tobytes())
+
+
+def write_dimap(dim_path, bands, rows=None, cols=None):
+    """Synthetic BEAM-DIMAP product: .dim header + .data/<band>.img/.hdr"""
+    if rows is None or cols is None:
+        rows, cols = raster_shape()
+    dim_path = Path(dim_path)
+    data_dir = dim_path.parent / (dim_path.stem + ".data")
+    data_dir.mkdir(parents=True, exist_ok=True)
+
+    files, infos = [], []
+    for i, band in enumerate(bands):
+        write_raw(data_dir / f"{band}.img", band, rows, cols, dim_path.name)
+        (data_dir / f"{band}.hdr").write_text(
+            "ENVI\n"
+            f"samples = {cols}\n"
+            f"lines = {rows}\n"
+            "bands = 1\n"
+            "header offset = 0\n"
+            "file type = ENVI Standard\n"
+            "data type = 4\n"
+            "interleave = bsq\n"
+            "byte order = 1\n"
+            f"map info = {{Geographic Lat/Lon, 1.0, 1.0, {ORIGIN_LON}, {ORIGIN_LAT}, "
+            f"{SPACING_DEG}, {SPACING_DEG}, WGS-84}}\n"
+            f"band names = {{ {band} }}\n"
+        )
+        files.append(
+            f"    <Data_File>\n"
+            f"      <DATA_FILE_PATH href=\"{data_dir.name}/{band}.hdr\"/>\n"
+            f"      <BAND_INDEX>{i}</BAND_INDEX>\n"
+            f"    </Data_File>"
+        )
+        infos.append(
+            f"    <Spectral_Band_Info>\n"
+            f"      <BAND_INDEX>{i}</BAND_INDEX>\n"
+            f"      <BAND_NAME>{band}</BAND_NAME>\n"
+            f"      <DATA_TYPE>float32</DATA_TYPE>\n"
+            f"    </Spectral_Band_Info>"
+        )
+
+    dim_path.write_text(
+        "<?xml version=\"1.0\" encoding=\"ISO-8859-1\"?>\n"
+        f"<Dimap_Document name=\"{dim_path.name}\">\n"
+        "  <Raster_Dimensions>\n"
+        f"    <NCOLS>{cols}</NCOLS>\n"
+        f"    <NROWS>{rows}</NROWS>\n"
+        f"    <NBANDS>{len(bands)}</NBANDS>\n"
+        "  </Raster_Dimensions>\n"
+        "  <Data_Access>\n"
+        "    <DATA_FILE_FORMAT>ENVI</DATA_FILE_FORMAT>\n"
+        + "\n".join(files) + "\n"
+        "  </Data_Access>\n"
+        "  <Image_Interpretation>\n"
+        + "\n".join(infos) + "\n"
+        "  </Image_Interpretation>\n"
+        "</Dimap_Document>\n"
+    )
+    return dim_path
+
+
+def gpt(args):
+    graph = re.split(r"[\\/]", args[0])[-1]
+    params = dict(a[2:].split("=", 1) for a in args[1:] if a.startswith("-P") and "=" in a)
+    time.sleep(latency())
+
+    if "snaphu_export" in graph:
+        folder = Path(params["targetFolder"])
+        folder.mkdir(parents=True, exist_ok=True)
+        rows, cols = raster_shape()
+        write_raw(folder / "Phase_ifg_VV.snaphu.img", "Phase_ifg_VV", rows, cols, folder)
+        (folder / "snaphu.conf").write_text(
+            "# Stand-in SnaphuExport configuration\n"
+            f"# snaphu -f snaphu.conf Phase_ifg_VV.snaphu.img {cols}\n"
+            "INFILE Phase_ifg_VV.snaphu.img\n"
+            f"LINELENGTH {cols}\n"
+            "OUTFILE UnwPhase_ifg_VV.snaphu.img\n"
+        )
+        print(f"Stand-in SnaphuExport → {folder}")
+        return 0
+
+    output = Path(params["output"])
+    if not output.suffix:
+        output = output.with_suffix(".dim")
+    is_grd = "grd" in graph.lower() or "grd" in output.name.lower()
+    bands = ["Sigma0_VV_db"] if is_grd else ["Phase_ifg_VV", "coh_VV"]
+    write_dimap(output, bands)
+    print(f"Stand-in {graph} → {output}")
+    return 0
+
+
+def snaphu(args):
+    conf = Path(args[args.index("-f") + 1])
+    settings = {}
+    for line in conf.read_text().splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and not line.startswith("#"):
+            settings[parts[0]] = parts[1]
+
+    n_rows = int(settings.get("NTILEROW", 1))
+    n_cols = int(settings.get("NTILECOL", 1))
+    tiles = n_rows * n_cols
+    for r in range(n_rows):
+        for c in range(n_cols):
+            print(f"Unwrapping tile at row {r}, column {c}", flush=True)
+            time.sleep(latency() / tiles)
+
+    rows, cols = raster_shape()
+    write_raw(conf.parent / settings.get("OUTFILE", "unwrapped.img"), "UnwPhase", rows, cols, conf)
+    print("Program snaphu done")
+    return 0
+
+
+if __name__ == "__main__":
+    mode, rest = sys.argv[1], sys.argv[2:]
+    sys.exit(gpt(rest) if mode == "gpt" else snaphu(rest))
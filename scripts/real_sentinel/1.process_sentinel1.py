@@ -5,50 +5,138 @@ Process SLC pairs to extract vertical subsidence velocity
 Output: subsidence_velocity.tif, coherence_median.tif, quality_mask.tif
 """
 
-import subprocess
+import copy
+import json
+import os
 import yaml
 from pathlib import Path
-import rasterio
-import numpy as np
 from datetime import datetime
 import xml.etree.ElementTree as ET
 import shutil
 
+from step_cache import StepCache
+from gpt_scheduler import JobScheduler
+from graph_fusion import GraphFusion
+from s1_names import scene_id, acquisition_date, acquisition_time
+from snaphu import SnaphuRunner, find_snaphu
+from async_runner import AsyncRunner, step_log_path
+from intermediates import Intermediates
+from aoi import load_aois
+from profiler import Profiler, profiled
+from job_queue import ResourceLimits, limited
+from execution_plan import command_line
+from remote_inputs import RemoteInputs, input_path, is_remote
+
 class SLC_Processor:
-    def __init__(self, config_path="uh/config.yaml"):
-        """Initialize with configuration"""
+    def __init__(self, config_path="uh/config.yaml", plan=None):
+        """Initialize with configuration (plan: dry run, nothing is written)"""
         with open(config_path, 'r') as f:
             self.config = yaml.safe_load(f)
         
         self.gpt = Path(self.config['snap']['gpt_path'])
-        self.master = Path(self.config['sentinel1']['slc_master'])
-        self.slave = Path(self.config['sentinel1']['slc_slave'])
+        sentinel1 = self.config['sentinel1']
+        self.master = input_path(sentinel1['slc_master']) if sentinel1.get('slc_master') else None
+        self.slave = input_path(sentinel1['slc_slave']) if sentinel1.get('slc_slave') else None
         self.output_dir = Path(self.config['output']['products'])
         self.temp_dir = Path(self.config['output']['temp'])
         
-        # Create directories
-        self.output_dir.mkdir(parents=True, exist_ok=True)
-        self.temp_dir.mkdir(parents=True, exist_ok=True)
+        # Create directories (not for a dry run)
+        if plan is None:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            self.temp_dir.mkdir(parents=True, exist_ok=True)
+        
+        # Content-addressed cache of GPT step outputs (the plan's own in a dry run)
+        self.cache = plan.cache if plan is not None else StepCache.from_config(self.config)
+        
+        # Intermediates deleted once consumed; scratch high-water mark for the scheduler
+        self.intermediates = Intermediates.from_config(self.config, self.cache)
+        
+        # Parallel execution of independent GPT jobs within the RAM budget
+        self.scheduler_threads = JobScheduler.from_config(self.config).threads_per_job
+        
+        # Fused (single graph per chain) or step-by-step GPT execution
+        self.fusion = GraphFusion.from_config(self.config, self.cache)
+        
+        # Per-step wall/CPU time, peak RSS and I/O (reports/profile_*.json)
+        self.profiler = Profiler.from_config(self.config)
+        
+        # GPT / SNAPHU / CPU slots shared across sites by run_batch.py (unlimited here)
+        self.limits = ResourceLimits()
+        
+        # GPT/SNAPHU children on one event loop: live progress, timeouts, cancellation
+        self.runner = AsyncRunner.from_config(self.config)
+        
+        # fsspec URL inputs fetched into a local LRU cache, prefetched during earlier steps
+        self.inputs = RemoteInputs.from_config(self.config)
+        
+        # Areas of interest: subset after deburst (none = full subswath)
+        self.aois = load_aois(self.config)
+        self.aoi = None
+        
+        # Dry run (run_pipeline.py plan): steps are recorded here instead of run
+        self.plan = plan
         
         print(f"✓ Configuration loaded")
-        print(f"  Master: {self.master.name}")
-        print(f"  Slave: {self.slave.name}")
+        if self.master is not None and self.slave is not None:
+            print(f"  Master: {scene_id(self.master)}")
+            print(f"  Slave: {scene_id(self.slave)}")
+        if self.aois:
+            print(f"  AOIs: " + ", ".join(f"{a.name} ({a.area_km2:.0f} km²)" for a in self.aois))
     
     def verify_inputs(self):
         """Check if input files exist"""
-        if not self.master.exists():
+        if self.master is None or self.slave is None:
+            raise ValueError("sentinel1.slc_master and sentinel1.slc_slave must be set")
+        if not is_remote(self.master) and not self.master.exists():
             raise FileNotFoundError(f"Master SLC not found: {self.master}")
-        if not self.slave.exists():
+        if not is_remote(self.slave) and not self.slave.exists():
             raise FileNotFoundError(f"Slave SLC not found: {self.slave}")
         if not self.gpt.exists():
             raise FileNotFoundError(f"SNAP GPT not found: {self.gpt}")
         print("✓ Input files verified")
     
     def run_gpt(self, graph_xml, output_name, **params):
-        """Execute SNAP GPT command (Windows-safe)"""
-        output_path = self.temp_dir / output_name
+        """Execute SNAP GPT command (Windows-safe), skipping it on a cache hit"""
+        # Inside a fused chain: record the step instead of running it
+        if self.fusion.recording:
+            return self.fusion.record(graph_xml, output_name, **params)
+        
+        if self.plan is not None:
+            return self.plan.cached_step(graph_xml.stem, "gpt", graph_xml, output_name, params, self.temp_dir,
+                                         lambda output: [self.gpt_command(graph_xml, output, params)])
+        
+        step_key = self.cache.key(graph_xml, params)
+        cached = self.cache.lookup(step_key, output_name)
+        if cached is not None:
+            print(f"\n✓ Cached: {graph_xml.stem} → {output_name}")
+            self.intermediates.produced(cached)
+            self.intermediates.consumed(params.values())
+            return cached
+        
+        output_path = self.cache.prepare(step_key, output_name, self.temp_dir,
+                                         root=self.intermediates.root_for(graph_xml.stem))
+        cmd = self.gpt_command(graph_xml, output_path, params)
         
-        # Build GPT command
+        print(f"\n▶ Running: {graph_xml.stem}")
+        print(f"  Output: {output_name}")
+        
+        # Stream GPT's output to temp/logs, profiling the GPT process tree
+        with self.limits.slot("gpt"), self.profiler.step(graph_xml.stem, "gpt", output=output_path):
+            result = self.runner.run(cmd, graph_xml.stem, log_path=self.log_path(graph_xml.stem, output_path),
+                                     watch=self.profiler.watcher())
+        
+        if result.returncode != 0:
+            print(f"❌ ERROR:\n{result.stderr}")
+            raise RuntimeError(f"GPT failed: {graph_xml.stem}" + (f" ({result.reason})" if result.reason else ""))
+        
+        self.cache.commit(step_key, output_path, graph_xml.stem, params)
+        self.intermediates.produced(output_path)
+        self.intermediates.consumed(params.values())
+        print(f"✓ Complete: {output_name}")
+        return output_path
+
+    def gpt_command(self, graph_xml, output_path, params):
+        """GPT command line for one graph"""
         cmd = [
             str(self.gpt),
             str(graph_xml),
@@ -59,67 +147,62 @@ class SLC_Processor:
         for key, val in params.items():
             cmd.append(f"-P{key}={val}")
         
-        # Add cache size
+        # Add cache size and per-job thread count
         cmd.extend(["-c", f"{self.config['snap']['cache_size_gb']}G"])
-        
-        print(f"\n▶ Running: {graph_xml.stem}")
-        print(f"  Output: {output_name}")
-        
-        # Execute with Windows encoding
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            encoding='utf-8',
-            shell=False
-        )
-        
-        if result.returncode != 0:
-            print(f"❌ ERROR:\n{result.stderr}")
-            raise RuntimeError(f"GPT failed: {graph_xml.stem}")
-        
-        print(f"✓ Complete: {output_name}")
-        return output_path
-
-    def step0_split(self):
-        """Split the master and slave SLC products into subswaths/polarizations."""
+        cmd.extend(["-q", str(self.scheduler_threads)])
+        return cmd
+    
+    def local_input(self, slc):
+        """Local copy of an input SLC (waits for its fetch if it is a URL)"""
+        if self.plan is not None:
+            return self.plan.fetch(self.inputs, slc)
+        return self.inputs.resolve(slc)
+    
+    def log_path(self, step, output_path):
+        """Fresh temp/logs file a subprocess's stdout/stderr is streamed to"""
+        return step_log_path(self.temp_dir, step, output_path)
+    
+    def split_product(self, slc, output_name):
+        """Split one SLC product into the configured subswath/polarization"""
         graph = Path(r"C:\Users\swedha\OneDrive\vscode\MR PEATLAND\peatfire-system-1\graphs\09_split.xml")
         
-        master_split = self.run_gpt(
+        return self.run_gpt(
             graph,
-            "master_split.dim",
-            input=str(self.master),
+            output_name,
+            input=str(self.local_input(slc)),
             subswath=self.config['processing']['subswath'],
             polarization=self.config['processing']['polarization']
         )
+    
+    def apply_orbit(self, split, output_name):
+        """Apply precise orbit file to one split product"""
+        graph = Path(r"C:\Users\swedha\OneDrive\vscode\MR PEATLAND\peatfire-system-1\graphs\01_apply_orbit.xml")
         
-        slave_split = self.run_gpt(
+        return self.run_gpt(
             graph,
-            "slave_split.dim",
-            input=str(self.slave),
-            subswath=self.config['processing']['subswath'],
-            polarization=self.config['processing']['polarization']
+            output_name,
+            input=str(split)
         )
+
+    def step0_split(self):
+        """Split the master and slave SLC products into subswaths/polarizations."""
+        scheduler = JobScheduler.from_config(self.config, on_abort=self.runner.cancel_all,
+                                             intermediates=self.intermediates)
+        scheduler.add("master_split", lambda: self.split_product(self.master, "master_split.dim"))
+        scheduler.add("slave_split", lambda: self.split_product(self.slave, "slave_split.dim"))
+        results = scheduler.run()
         
-        return master_split, slave_split
+        return results["master_split"], results["slave_split"]
 
     def step1_apply_orbit(self, master_split, slave_split):
         """Apply precise orbit files to split products"""
-        graph = Path(r"C:\Users\swedha\OneDrive\vscode\MR PEATLAND\peatfire-system-1\graphs\01_apply_orbit.xml")
-        
-        master_out = self.run_gpt(
-            graph, 
-            "master_orbit.dim",
-            input=str(master_split)
-        )
+        scheduler = JobScheduler.from_config(self.config, on_abort=self.runner.cancel_all,
+                                             intermediates=self.intermediates)
+        scheduler.add("master_orbit", lambda: self.apply_orbit(master_split, "master_orbit.dim"))
+        scheduler.add("slave_orbit", lambda: self.apply_orbit(slave_split, "slave_orbit.dim"))
+        results = scheduler.run()
         
-        slave_out = self.run_gpt(
-            graph,
-            "slave_orbit.dim",
-            input=str(slave_split)
-        )
-        
-        return master_out, slave_out
+        return results["master_orbit"], results["slave_orbit"]
     
     def step2_coregister(self, master_orb, slave_orb):
         """Back-geocode coregistration"""
@@ -161,6 +244,19 @@ class SLC_Processor:
         
         return deburst_out
     
+    def step3c_subset(self, deburst):
+        """Cut the debursted interferogram down to this processor's AOI"""
+        graph = Path(r"C:\Users\swedha\OneDrive\vscode\MR PEATLAND\peatfire-system-1\graphs\11_subset.xml")
+        
+        subset_out = self.run_gpt(
+            graph,
+            "subset.dim",
+            input=str(deburst),
+            geoRegion=self.aoi.wkt
+        )
+        
+        return subset_out
+    
     def step4_topo_phase_removal(self, deburst):
         """Remove topographic phase using DEM"""
         graph = Path(r"C:\Users\swedha\OneDrive\vscode\MR PEATLAND\peatfire-system-1\graphs\04_topo_removal.xml")
@@ -189,31 +285,58 @@ class SLC_Processor:
         
         return filt_out
     
+    @profiled("06_snaphu_unwrap", "stage")
     def step6_unwrap(self, filtered):
         """Phase unwrapping using SNAP's SnaphuExport operator"""
         
-        print(f"\n▶ Running: Phase unwrapping with SnaphuExport")
-        
-        # Step 1: Use SnaphuExport to prepare data for SNAPHU
         graph_export = Path(r"C:\Users\swedha\OneDrive\vscode\MR PEATLAND\peatfire-system-1\graphs\06a_snaphu_export.xml")
+        graph_import = Path(r"C:\Users\swedha\OneDrive\vscode\MR PEATLAND\peatfire-system-1\graphs\06b_snaphu_import.xml")
+        
+        snaphu = SnaphuRunner.from_config(self.config, runner=self.runner, locate=self.plan is None)
         snaphu_folder = self.temp_dir / "snaphu_export"
         
+        # Export → SNAPHU → import is cached as one step on the filtered input
+        unwrap_params = {"input": filtered, "tiles": snaphu.settings}
+        if self.plan is not None:
+            try:
+                find_snaphu(self.config)
+                note = None
+            except RuntimeError as e:
+                note = str(e).splitlines()[0]
+            return self.plan.cached_step(
+                "snaphu_unwrap", "snaphu", [graph_export, graph_import], "unwrapped.dim",
+                unwrap_params, self.temp_dir,
+                lambda output: [
+                    self.snaphu_export_command(graph_export, filtered, snaphu_folder),
+                    f"{command_line([snaphu.exe, '-f'])} {snaphu_folder / '*.conf'}  "
+                    f"# {snaphu.tile_rows}x{snaphu.tile_cols} tiles, {snaphu.nproc} processes",
+                    self.snaphu_import_command(graph_import, filtered, snaphu_folder, output),
+                ],
+                note=note,
+            )
+        
+        key = self.cache.key([graph_export, graph_import], unwrap_params)
+        cached = self.cache.lookup(key, "unwrapped.dim")
+        if cached is not None:
+            print(f"\n✓ Cached: phase unwrapping → unwrapped.dim")
+            self.intermediates.produced(cached)
+            return cached
+        
+        print(f"\n▶ Running: Phase unwrapping with SnaphuExport")
+        
+        # Step 1: Use SnaphuExport to prepare data for SNAPHU
         if snaphu_folder.exists():
             shutil.rmtree(snaphu_folder)
         snaphu_folder.mkdir()
         
         # Run SnaphuExport (this handles all the complex phase extraction)
-        cmd = [
-            str(self.gpt),
-            str(graph_export),
-            f"-Pinput={filtered}",
-            f"-PtargetFolder={snaphu_folder}",
-            "-c", f"{self.config['snap']['cache_size_gb']}G"
-        ]
+        cmd = self.snaphu_export_command(graph_export, filtered, snaphu_folder)
         
         print(f"  Exporting for SNAPHU...")
         
-        result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8')
+        with self.limits.slot("gpt"), self.profiler.step(graph_export.stem, "gpt", output=snaphu_folder):
+            result = self.runner.run(cmd, graph_export.stem, log_path=self.log_path(graph_export.stem, snaphu_folder),
+                                     watch=self.profiler.watcher())
         
         if result.returncode != 0:
             print(f"❌ SnaphuExport failed:\n{result.stderr}")
@@ -227,57 +350,55 @@ class SLC_Processor:
         snaphu_conf = conf_files[0]
         print(f"  Found config: {snaphu_conf.name}")
         
-        # Step 3: Run SNAPHU
-        snaphu_exe = Path.home() / ".snap/auxdata/snaphu/win64/snaphu.exe"
-        
-        if not snaphu_exe.exists():
-            raise RuntimeError(
-                f"Snaphu not found: {snaphu_exe}\n"
-                "Install via SNAP: Tools → Plugins → SNAPHU Unwrapping"
-            )
-        
-        print(f"  Running SNAPHU (this may take 10-30 minutes)...")
-        
-        result = subprocess.run(
-            [str(snaphu_exe), str(snaphu_conf.name)],
-            cwd=str(snaphu_folder),
-            capture_output=True,
-            text=True,
-            timeout=7200  # 2 hour timeout
-        )
-        
-        if result.returncode != 0:
-            print(f"  SNAPHU stdout: {result.stdout}")
-            print(f"  SNAPHU stderr: {result.stderr}")
-            raise RuntimeError("SNAPHU unwrapping failed")
+        # Step 3: Run SNAPHU tiled across processes (log: snaphu_export/snaphu.log)
+        with self.limits.slot("snaphu"), self.profiler.step("snaphu", "snaphu"):
+            snaphu.run(snaphu_conf, watch=self.profiler.watcher())
         
         print(f"  ✓ Unwrapping complete")
         
         # Step 4: Import unwrapped phase back into SNAP
-        graph_import = Path(r"C:\Users\swedha\OneDrive\vscode\MR PEATLAND\peatfire-system-1\graphs\06b_snaphu_import.xml")
-        unwrap_out = self.temp_dir / "unwrapped.dim"
+        unwrap_out = self.cache.prepare(key, "unwrapped.dim", self.temp_dir)
         
-        cmd = [
-            str(self.gpt),
-            str(graph_import),
-            f"-Pinput={filtered}",
-            f"-Pfolder={snaphu_folder}",
-            f"-Poutput={unwrap_out}",
-            "-c", f"{self.config['snap']['cache_size_gb']}G"
-        ]
+        cmd = self.snaphu_import_command(graph_import, filtered, snaphu_folder, unwrap_out)
         
         print(f"  Importing unwrapped phase into SNAP...")
         
-        result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8')
+        with self.limits.slot("gpt"), self.profiler.step(graph_import.stem, "gpt", output=unwrap_out):
+            result = self.runner.run(cmd, graph_import.stem, log_path=self.log_path(graph_import.stem, unwrap_out),
+                                     watch=self.profiler.watcher())
         
         if result.returncode != 0:
             print(f"❌ SnaphuImport failed:\n{result.stderr}")
             raise RuntimeError("SnaphuImport failed")
         
+        self.cache.commit(key, unwrap_out, "snaphu_unwrap", unwrap_params)
+        self.intermediates.produced(unwrap_out)
+        # the export folder (SNAPHU input + unwrapped phase) is only read by the import
+        self.intermediates.produced(snaphu_folder)
+        self.intermediates.consumed([snaphu_folder])
         print(f"✓ Complete: unwrapped.dim")
         
         return unwrap_out
         
+    def snaphu_export_command(self, graph_export, filtered, snaphu_folder):
+        return [
+            str(self.gpt),
+            str(graph_export),
+            f"-Pinput={filtered}",
+            f"-PtargetFolder={snaphu_folder}",
+            "-c", f"{self.config['snap']['cache_size_gb']}G"
+        ]
+    
+    def snaphu_import_command(self, graph_import, filtered, snaphu_folder, unwrap_out):
+        return [
+            str(self.gpt),
+            str(graph_import),
+            f"-Pinput={filtered}",
+            f"-Pfolder={snaphu_folder}",
+            f"-Poutput={unwrap_out}",
+            "-c", f"{self.config['snap']['cache_size_gb']}G"
+        ]
+    
     def step7_phase_to_displacement(self, unwrapped):
         """Convert phase to LOS displacement (meters)"""
         graph = Path(r"C:\Users\swedha\OneDrive\vscode\MR PEATLAND\peatfire-system-1\graphs\07_phase_to_disp.xml")
@@ -303,8 +424,20 @@ class SLC_Processor:
         
         return final_out
     
+    @limited("cpu")
+    @profiled("extract_products")
     def extract_products(self, geocoded_dim):
-        """Extract GeoTIFFs from BEAM-DIMAP format"""
+        """Extract GeoTIFFs from BEAM-DIMAP format in one block-streamed pass"""
+        subsidence_tif = self.output_dir / "subsidence_velocity.tif"
+        coherence_tif = self.output_dir / "coherence_median.tif"
+        quality_tif = self.output_dir / "quality_mask.tif"
+        if self.plan is not None:
+            return self.plan.python("extract_products", (subsidence_tif, coherence_tif, quality_tif))
+        
+        import numpy as np
+        from raster_blocks import AlignedReaders, block_windows, open_raster, rows_per_block, process_blocks
+        from product_writer import ProductWriter
+        
         print("\n▶ Extracting final products...")
         
         # Read BEAM-DIMAP data folder
@@ -314,48 +447,65 @@ class SLC_Processor:
         disp_img = list(data_dir.glob("Phase_ifg_*.img"))[0]
         coh_img = list(data_dir.glob("coh_*.img"))[0]
         
-        # Convert to GeoTIFF
-        subsidence_tif = self.output_dir / "subsidence_velocity.tif"
-        coherence_tif = self.output_dir / "coherence_median.tif"
+        # Tiled COG products with overviews (geotiff section of config.yaml)
+        writer = ProductWriter.from_config(self.config)
         
-        # Use GDAL to convert (rasterio wrapper)
-        with rasterio.open(disp_img) as src:
-            profile = src.profile
-            profile.update(driver='GTiff', compress='lzw')
-            
-            disp_data = src.read(1)
-            
-            # Convert phase to vertical displacement (mm/yr)
-            # Assume 12-day repeat, convert to annual rate
-            wavelength_m = 0.056  # Sentinel-1 C-band
+        # Convert phase to vertical displacement (mm/yr)
+        # Repeat interval from the SAFE names (12-day repeat if they don't parse)
+        wavelength_m = 0.056  # Sentinel-1 C-band
+        try:
+            days_between = abs((acquisition_date(self.slave) - acquisition_date(self.master)).days) or 12
+        except (ValueError, TypeError):
             days_between = 12
+        
+        # Phase (radians) → LOS displacement (m) → vertical (m) → mm/yr, as one factor
+        incidence_rad = np.deg2rad(self.config['processing'].get('incidence_angle', 37))
+        phase_to_mm_yr = np.float32(
+            (wavelength_m / (4 * np.pi)) / np.cos(incidence_rad) * 1000 * (365.25 / days_between)
+        )
+        coh_threshold = np.float32(self.config['processing']['coherence_threshold'])
+        
+        extract_cfg = self.config.get('extract', {})
+        workers = extract_cfg.get('workers') or os.cpu_count() or 1
+        
+        with AlignedReaders([disp_img, coh_img]) as readers:
+            # phase + coherence (float32) + mask, per strip in flight
+            block_rows = rows_per_block(
+                readers.width, 4 + 4 + 1,
+                extract_cfg.get('block_budget_mb', 256) * 1024**2, 2 * workers
+            )
             
-            # Phase (radians) → LOS displacement (m) → vertical (m) → mm/yr
-            los_m = disp_data * (wavelength_m / (4 * np.pi))
-            incidence_rad = np.deg2rad(self.config['processing'].get('incidence_angle', 37))
-            vertical_m = los_m / np.cos(incidence_rad)
-            vertical_mm_yr = vertical_m * 1000 * (365.25 / days_between)
+            with open_raster(disp_img) as src:
+                disp_profile = src.profile
+            with open_raster(coh_img) as src:
+                coh_profile = src.profile
+            disp_profile.update(dtype='float32')
+            mask_profile = {**coh_profile, 'dtype': 'uint8', 'nodata': None}
             
-            with rasterio.open(subsidence_tif, 'w', **profile) as dst:
-                dst.write(vertical_mm_yr.astype('float32'), 1)
-        
-        # Coherence (copy as-is)
-        with rasterio.open(coh_img) as src:
-            profile = src.profile
-            profile.update(driver='GTiff', compress='lzw')
-            coh_data = src.read(1)
+            def extract_block(window):
+                disp_src, coh_src = readers.datasets()
+                velocity = disp_src.read(1, window=window, out_dtype='float32')
+                velocity *= phase_to_mm_yr  # in place, float32
+                coh = coh_src.read(1, window=window)
+                quality = (coh >= coh_threshold).astype('uint8')
+                return velocity, coh, quality
             
-            with rasterio.open(coherence_tif, 'w', **profile) as dst:
-                dst.write(coh_data, 1)
-        
-        # Generate quality mask
-        quality_tif = self.output_dir / "quality_mask.tif"
-        coh_threshold = self.config['processing']['coherence_threshold']
-        quality_mask = (coh_data >= coh_threshold).astype('uint8')
-        
-        profile.update(dtype='uint8')
-        with rasterio.open(quality_tif, 'w', **profile) as dst:
-            dst.write(quality_mask, 1)
+            with writer.open(subsidence_tif, disp_profile) as sub_dst, \
+                    writer.open(coherence_tif, coh_profile) as coh_dst, \
+                    writer.open(quality_tif, mask_profile, kind="mask") as mask_dst:
+                
+                def write_block(window, result):
+                    velocity, coh, quality = result
+                    sub_dst.write(velocity, 1, window=window)
+                    coh_dst.write(coh, 1, window=window)
+                    mask_dst.write(quality, 1, window=window)
+                
+                process_blocks(
+                    block_windows(readers.height, readers.width, block_rows),
+                    extract_block,
+                    write_block,
+                    workers=workers
+                )
         
         print(f"✓ Subsidence velocity: {subsidence_tif}")
         print(f"✓ Coherence: {coherence_tif}")
@@ -363,6 +513,76 @@ class SLC_Processor:
         
         return subsidence_tif, coherence_tif, quality_tif
         
+    def run_chain(self, chain, *args):
+        """Run a chain of GPT steps, as one fused graph when snap.graph_mode is fused"""
+        return self.fusion.run(lambda: chain(*args), self.run_gpt, dry_run=self.plan is not None)
+    
+    def chain_orbit(self, slc, prefix):
+        """Steps 0-1 for one scene: split → apply orbit"""
+        split = self.split_product(slc, f"{prefix}_split.dim")
+        return self.apply_orbit(split, f"{prefix}_orbit.dim")
+    
+    def chain_deburst(self, master_orb, slave_orb):
+        """Steps 2-3b: coregister → interferogram → deburst"""
+        # Step 2: Coregister (Back-Geocoding for TOPS - needs burst structure)
+        coreg = self.step2_coregister(master_orb, slave_orb)
+        
+        # Step 3: Interferogram (still in burst mode)
+        ifg = self.step3_interferogram(coreg)
+        
+        # Step 3b: Deburst (AFTER interferogram - this is the correct position)
+        return self.step3b_deburst(ifg)
+    
+    def chain_filter(self, deburst):
+        """Steps 3c-5: AOI subset (if any) → topo removal → Goldstein"""
+        # Step 3c: Subset to the AOI, so everything downstream scales with its area
+        if self.aoi is not None:
+            deburst = self.step3c_subset(deburst)
+        
+        # Step 4: Topographic phase removal
+        topo = self.step4_topo_phase_removal(deburst)
+        
+        # Step 5: Goldstein filtering
+        return self.step5_goldstein_filter(topo)
+    
+    def chain_interferogram(self, master_orb, slave_orb):
+        """Steps 2-5: coregister → interferogram → deburst → (subset) → topo removal → Goldstein"""
+        return self.chain_filter(self.chain_deburst(master_orb, slave_orb))
+    
+    def aoi_processor(self, aoi):
+        """This processor, re-pointed at one AOI's own temp and product folders"""
+        branch = copy.copy(self)
+        branch.aoi = aoi
+        branch.temp_dir = self.temp_dir / "aoi" / aoi.name
+        branch.output_dir = self.output_dir / "aoi" / aoi.name
+        if self.plan is None:
+            branch.temp_dir.mkdir(parents=True, exist_ok=True)
+            branch.output_dir.mkdir(parents=True, exist_ok=True)
+        return branch
+    
+    def add_branch(self, scheduler, deps, tag="", from_deburst=False):
+        """Jobs from the filtered interferogram (or deburst product) to the GeoTIFFs"""
+        chain = self.chain_filter if from_deburst else self.chain_interferogram
+        
+        # Steps 2-5 (or 3c-5 when branching off a shared deburst product)
+        scheduler.add(f"filt{tag}", lambda *inputs: self.run_chain(chain, *inputs), deps=deps)
+        
+        # Step 6: Phase unwrapping (external SNAPHU, never fused)
+        scheduler.add(f"unwrap{tag}", self.step6_unwrap, deps=[f"filt{tag}"])
+        
+        # Steps 7-8: Phase to displacement → terrain correction
+        scheduler.add(f"geocoded{tag}", lambda u: self.run_chain(self.chain_geocode, u),
+                      deps=[f"unwrap{tag}"])
+        
+        # Extract final products
+        scheduler.add(f"outputs{tag}", self.extract_products, deps=[f"geocoded{tag}"], mem_gb=0)
+        return f"outputs{tag}"
+    
+    def chain_geocode(self, unwrapped):
+        """Steps 7-8: phase to displacement → terrain correction"""
+        disp = self.step7_phase_to_displacement(unwrapped)
+        return self.step8_terrain_correction(disp)
+        
     def run_full_pipeline(self):
         print("\n" + "="*50)
         print("MODULE 1A: SENTINEL-1 SLC PROCESSING")
@@ -371,51 +591,224 @@ class SLC_Processor:
         start_time = datetime.now()
         
         try:
-            self.verify_inputs()
+            if self.plan is None:
+                self.verify_inputs()
+                self.inputs.prefetch([self.master, self.slave])
             
-            # CORRECTED PROCESSING ORDER FOR SENTINEL-1 TOPS:
+            # CORRECTED PROCESSING ORDER FOR SENTINEL-1 TOPS, as a DAG:
+            # master and slave branches run concurrently up to coregistration
+            scheduler = JobScheduler.from_config(self.config, on_abort=self.runner.cancel_all,
+                                                 intermediates=self.intermediates)
             
-            # Step 0: Split (select subswath and polarization)
-            master_split, slave_split = self.step0_split()
+            # Steps 0-1: Split → apply orbit, per scene
+            scheduler.add("master_orb", lambda: self.run_chain(self.chain_orbit, self.master, "master"))
+            scheduler.add("slave_orb", lambda: self.run_chain(self.chain_orbit, self.slave, "slave"))
             
-            # Step 1: Apply orbit files (BEFORE coregistration, BEFORE deburst)
-            master_orb, slave_orb = self.step1_apply_orbit(master_split, slave_split)
+            if not self.aois:
+                # Steps 2-8 over the full subswath
+                self.add_branch(scheduler, deps=["master_orb", "slave_orb"])
+                outputs = scheduler.run()["outputs"]
+            else:
+                # Steps 2-3b once, then every AOI branches off the deburst product
+                scheduler.add("deburst", lambda m, s: self.run_chain(self.chain_deburst, m, s),
+                              deps=["master_orb", "slave_orb"])
+                for aoi in self.aois:
+                    self.aoi_processor(aoi).add_branch(
+                        scheduler, deps=["deburst"], tag=f"_{aoi.name}", from_deburst=True)
+                results = scheduler.run()
+                outputs = {aoi.name: results[f"outputs_{aoi.name}"] for aoi in self.aois}
+            if self.plan is not None:
+                return outputs
             
-            # Step 2: Coregister (Back-Geocoding for TOPS - needs burst structure)
-            coreg = self.step2_coregister(master_orb, slave_orb)
+            self.fusion.report()
+            self.intermediates.report(self.profiler)
+            self.inputs.report(self.profiler)
+            self.profiler.save("slc")
             
-            # Step 3: Interferogram (still in burst mode)
-            ifg = self.step3_interferogram(coreg)
+            elapsed = (datetime.now() - start_time).total_seconds() / 60
+            print(f"\n✓ MODULE 1A COMPLETE ({elapsed:.1f} minutes)")
+            print(f"  Products saved to: {self.output_dir}")
             
-            # Step 3b: Deburst (AFTER interferogram - this is the correct position)
-            deburst = self.step3b_deburst(ifg)
+            return outputs
             
-            # Step 4: Topographic phase removal
-            topo = self.step4_topo_phase_removal(deburst)
+        except Exception as e:
+            self.inputs.cancel()
+            print(f"\n❌ PIPELINE FAILED: {e}")
+            raise
+
+class SLC_StackProcessor(SLC_Processor):
+    def __init__(self, config_path="uh/config.yaml", plan=None):
+        """Stack mode: N SLC acquisitions → many interferometric pairs"""
+        super().__init__(config_path, plan)
+        
+        stack = self.config['sentinel1'].get('slc_stack') or []
+        self.stack = sorted((input_path(p) for p in stack), key=acquisition_time)
+        self.pairs_dir = self.output_dir / "pairs"
+        
+        print(f"  Stack: {len(self.stack)} SLC scenes")
+    
+    def verify_inputs(self):
+        """Check that every stack scene exists"""
+        if len(self.stack) < 2:
+            raise ValueError("sentinel1.slc_stack needs at least two SLC scenes")
+        for slc in self.stack:
+            if not is_remote(slc) and not slc.exists():
+                raise FileNotFoundError(f"Stack SLC not found: {slc}")
+        if not self.gpt.exists():
+            raise FileNotFoundError(f"SNAP GPT not found: {self.gpt}")
+        print("✓ Input files verified")
+    
+    def select_pairs(self):
+        """Interferometric pairs from stack.pairing (sequential or sbas)"""
+        stack_cfg = self.config.get('stack', {})
+        rule = stack_cfg.get('pairing', 'sequential')
+        dates = [acquisition_date(slc) for slc in self.stack]
+        n = len(self.stack)
+        
+        if rule == 'sequential':
+            # each scene with its next N acquisitions
+            neighbours = stack_cfg.get('max_neighbours', 1)
+            pairs = [(i, j) for i in range(n) for j in range(i + 1, min(i + 1 + neighbours, n))]
+        elif rule == 'sbas':
+            # small temporal baselines (perpendicular baselines are not screened here)
+            max_days = stack_cfg.get('max_temporal_baseline_days', 48)
+            pairs = [(i, j) for i in range(n) for j in range(i + 1, n)
+                     if (dates[j] - dates[i]).days <= max_days]
+        else:
+            raise ValueError(f"stack.pairing must be 'sequential' or 'sbas', got {rule!r}")
+        
+        return [(self.stack[i], self.stack[j]) for i, j in pairs]
+    
+    @staticmethod
+    def pair_name(master, slave):
+        return f"{acquisition_date(master):%Y%m%d}_{acquisition_date(slave):%Y%m%d}"
+    
+    def pair_processor(self, master, slave):
+        """This processor, re-pointed at one pair's own temp and product folders"""
+        name = self.pair_name(master, slave)
+        pair = copy.copy(self)
+        pair.master, pair.slave = master, slave
+        pair.temp_dir = self.temp_dir / "pairs" / name
+        pair.output_dir = self.pairs_dir / name
+        if self.plan is None:
+            pair.temp_dir.mkdir(parents=True, exist_ok=True)
+            pair.output_dir.mkdir(parents=True, exist_ok=True)
+        return pair
+    
+    def write_pair_index(self, pairs, results, aoi=None):
+        """Index of every pair product folder (products/pairs/index[_<aoi>].json)"""
+        suffix = f"_{aoi.name}" if aoi is not None else ""
+        index = {
+            "created": datetime.now().isoformat(timespec='seconds'),
+            "pairing": self.config.get('stack', {}).get('pairing', 'sequential'),
+            "aoi": aoi.name if aoi is not None else None,
+            "scenes": [scene_id(slc) for slc in self.stack],
+            "pairs": [],
+        }
+        for master, slave in pairs:
+            name = self.pair_name(master, slave)
+            subsidence, coherence, quality = results[f"outputs_{name}{suffix}"]
+            index["pairs"].append({
+                "name": name,
+                "master": scene_id(master),
+                "slave": scene_id(slave),
+                "master_date": str(acquisition_date(master)),
+                "slave_date": str(acquisition_date(slave)),
+                "temporal_baseline_days": (acquisition_date(slave) - acquisition_date(master)).days,
+                "products": {
+                    "subsidence_velocity": str(subsidence.relative_to(self.pairs_dir)),
+                    "coherence": str(coherence.relative_to(self.pairs_dir)),
+                    "quality_mask": str(quality.relative_to(self.pairs_dir)),
+                },
+            })
+        
+        index_path = self.pairs_dir / f"index{suffix}.json"
+        with open(index_path, 'w') as f:
+            json.dump(index, f, indent=2)
+        return index_path
+    
+    def run_stack(self):
+        """Process every selected pair; split/orbit run once per scene"""
+        print("\n" + "="*50)
+        print("MODULE 1A: SENTINEL-1 SLC STACK PROCESSING")
+        print("="*50)
+        
+        start_time = datetime.now()
+        
+        try:
+            if self.plan is None:
+                self.verify_inputs()
+            
+            pairs = self.select_pairs()
+            if not pairs:
+                raise ValueError("Pair selection produced no pairs; relax the stack settings")
+            print(f"  {len(pairs)} pairs: " + ", ".join(self.pair_name(m, s) for m, s in pairs))
+            
+            scheduler = JobScheduler.from_config(self.config, on_abort=self.runner.cancel_all,
+                                                 intermediates=self.intermediates)
+            
+            # Steps 0-1: Split → apply orbit, once per scene however many pairs use it
+            scenes = sorted({slc for pair in pairs for slc in pair}, key=acquisition_time)
+            if self.plan is None:
+                self.inputs.prefetch(scenes)
+            for slc in scenes:
+                sid = scene_id(slc)
+                scheduler.add(f"orb_{sid}", lambda slc=slc, sid=sid: self.run_chain(self.chain_orbit, slc, sid))
             
-            # Step 5: Goldstein filtering
-            filt = self.step5_goldstein_filter(topo)
+            # Steps 2-8 + extraction per pair (and per AOI), all running concurrently
+            for master, slave in pairs:
+                pair = self.pair_processor(master, slave)
+                name = self.pair_name(master, slave)
+                orbits = [f"orb_{scene_id(master)}", f"orb_{scene_id(slave)}"]
+                
+                if not self.aois:
+                    pair.add_branch(scheduler, deps=orbits, tag=f"_{name}")
+                    continue
+                
+                scheduler.add(f"deburst_{name}",
+                              lambda m, s, pair=pair: pair.run_chain(pair.chain_deburst, m, s),
+                              deps=orbits)
+                for aoi in self.aois:
+                    pair.aoi_processor(aoi).add_branch(
+                        scheduler, deps=[f"deburst_{name}"], tag=f"_{name}_{aoi.name}", from_deburst=True)
             
-            # Step 6: Phase unwrapping
-            unwrap = self.step6_unwrap(filt)
+            results = scheduler.run()
+            if self.plan is not None:
+                self.plan.python("pair index + velocity inversion", [
+                    self.pairs_dir / f"index{'_' + aoi.name if aoi else ''}.json" for aoi in self.aois or [None]])
+                return results
             
-            # Step 7: Phase to displacement
-            disp = self.step7_phase_to_displacement(unwrap)
+            self.fusion.report()
+            self.intermediates.report(self.profiler)
+            self.inputs.report(self.profiler)
             
-            # Step 8: Terrain correction
-            geocoded = self.step8_terrain_correction(disp)
+            from timeseries import VelocityInversion
             
-            # Extract final products
-            outputs = self.extract_products(geocoded)
+            index_paths = []
+            for aoi in self.aois or [None]:
+                index_path = self.write_pair_index(pairs, results, aoi)
+                index_paths.append(index_path)
+                
+                # Coherence-weighted LS velocity over all pairs
+                if self.config.get('timeseries', {}).get('enabled', True) and len(pairs) >= 2:
+                    ts_dir = self.output_dir if aoi is None else self.output_dir / "aoi" / aoi.name
+                    ts_dir.mkdir(parents=True, exist_ok=True)
+                    with self.limits.slot("cpu"), \
+                            self.profiler.step(f"velocity_inversion{'_' + aoi.name if aoi else ''}"):
+                        VelocityInversion.from_config(self.config).run(index_path, ts_dir)
+            
+            self.profiler.save("slc_stack")
             
             elapsed = (datetime.now() - start_time).total_seconds() / 60
-            print(f"\n✓ MODULE 1A COMPLETE ({elapsed:.1f} minutes)")
-            print(f"  Products saved to: {self.output_dir}")
+            print(f"\n✓ MODULE 1A STACK COMPLETE ({elapsed:.1f} minutes)")
+            for index_path in index_paths:
+                print(f"  {len(pairs)} pair products indexed in: {index_path}")
             
-            return outputs
+            return index_paths[0] if len(index_paths) == 1 else index_paths
             
         except Exception as e:
-            print(f"\n❌ PIPELINE FAILED: {e}")
+            self.inputs.cancel()
+            print(f"\n❌ STACK PIPELINE FAILED: {e}")
             raise
 
 if __name__ == "__main__":
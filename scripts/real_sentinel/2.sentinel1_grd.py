@@ -5,26 +5,61 @@ Process GRD images to extract VV backscatter (dark linear features = canals)
 Output: vv_median.tif
 """
 
-import subprocess
 import yaml
 from pathlib import Path
-import rasterio
-import numpy as np
 from datetime import datetime
 
+from step_cache import StepCache
+from gpt_scheduler import JobScheduler
+from graph_fusion import GraphFusion
+from s1_names import scene_id, acquisition_date
+from profiler import Profiler, profiled
+from job_queue import ResourceLimits, limited
+from async_runner import AsyncRunner, step_log_path
+from intermediates import Intermediates
+from remote_inputs import RemoteInputs, input_path, is_remote
+
 class GRD_Processor:
-    def __init__(self, config_path="config.yaml"):
-        """Initialize with configuration"""
+    def __init__(self, config_path="config.yaml", plan=None):
+        """Initialize with configuration (plan: dry run, nothing is written)"""
         with open(config_path, 'r') as f:
             self.config = yaml.safe_load(f)
         
         self.gpt = Path(self.config['snap']['gpt_path'])
-        self.grd_files = [Path(f) for f in self.config['sentinel1']['grd_files']]
+        self.grd_files = [input_path(f) for f in self.config['sentinel1']['grd_files']]
         self.output_dir = Path(self.config['output']['products'])
         self.temp_dir = Path(self.config['output']['temp'])
         
-        self.output_dir.mkdir(parents=True, exist_ok=True)
-        self.temp_dir.mkdir(parents=True, exist_ok=True)
+        if plan is None:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            self.temp_dir.mkdir(parents=True, exist_ok=True)
+        
+        # Content-addressed cache of GPT step outputs (the plan's own in a dry run)
+        self.cache = plan.cache if plan is not None else StepCache.from_config(self.config)
+        
+        # Intermediates deleted once consumed; scratch high-water mark for the scheduler
+        self.intermediates = Intermediates.from_config(self.config, self.cache)
+        
+        # Parallel execution of independent GPT jobs within the RAM budget
+        self.scheduler_threads = JobScheduler.from_config(self.config).threads_per_job
+        
+        # Fused (single graph per scene) or step-by-step GPT execution
+        self.fusion = GraphFusion.from_config(self.config, self.cache)
+        
+        # Per-step wall/CPU time, peak RSS and I/O (reports/profile_*.json)
+        self.profiler = Profiler.from_config(self.config)
+        
+        # GPT / CPU slots shared across sites by run_batch.py (unlimited here)
+        self.limits = ResourceLimits()
+        
+        # GPT children on one event loop: live progress, timeouts, cancellation
+        self.runner = AsyncRunner.from_config(self.config)
+        
+        # fsspec URL inputs fetched into a local LRU cache, prefetched during earlier scenes
+        self.inputs = RemoteInputs.from_config(self.config)
+        
+        # Dry run (run_pipeline.py plan): steps are recorded here instead of run
+        self.plan = plan
         
         print(f"✓ Configuration loaded")
         print(f"  GRD files: {len(self.grd_files)}")
@@ -32,54 +67,81 @@ class GRD_Processor:
     def verify_inputs(self):
         """Check if GRD files exist"""
         for grd in self.grd_files:
-            if not grd.exists():
+            if not is_remote(grd) and not grd.exists():
                 raise FileNotFoundError(f"GRD not found: {grd}")
         if not self.gpt.exists():
             raise FileNotFoundError(f"SNAP GPT not found: {self.gpt}")
         print("✓ Input files verified")
     
     def run_gpt(self, graph_xml, output_name, **params):
-        """Execute SNAP GPT command"""
-        output_path = self.temp_dir / output_name
+        """Execute SNAP GPT command, skipping it on a cache hit"""
+        # Inside a fused chain: record the step instead of running it
+        if self.fusion.recording:
+            return self.fusion.record(graph_xml, output_name, **params)
         
-        cmd = [
-            str(self.gpt),
-            str(graph_xml),
-            f"-Poutput={output_path}",
-        ]
+        if self.plan is not None:
+            return self.plan.cached_step(graph_xml.stem, "gpt", graph_xml, output_name, params, self.temp_dir,
+                                         lambda output: [self.gpt_command(graph_xml, output, params)])
         
-        for key, val in params.items():
-            cmd.append(f"-P{key}={val}")
+        step_key = self.cache.key(graph_xml, params)
+        cached = self.cache.lookup(step_key, output_name)
+        if cached is not None:
+            print(f"\n✓ Cached: {graph_xml.stem} → {output_name}")
+            self.intermediates.produced(cached)
+            self.intermediates.consumed(params.values())
+            return cached
         
-        cmd.extend(["-c", f"{self.config['snap']['cache_size_gb']}G"])
+        output_path = self.cache.prepare(step_key, output_name, self.temp_dir,
+                                         root=self.intermediates.root_for(graph_xml.stem))
+        cmd = self.gpt_command(graph_xml, output_path, params)
         
         print(f"\n▶ Running: {graph_xml.stem}")
         
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            encoding='utf-8',
-            shell=False
-        )
+        with self.limits.slot("gpt"), self.profiler.step(graph_xml.stem, "gpt", output=output_path):
+            result = self.runner.run(cmd, graph_xml.stem, log_path=step_log_path(self.temp_dir, graph_xml.stem, output_path),
+                                     watch=self.profiler.watcher())
         
         if result.returncode != 0:
             print(f"❌ ERROR:\n{result.stderr}")
-            raise RuntimeError(f"GPT failed: {graph_xml.stem}")
+            raise RuntimeError(f"GPT failed: {graph_xml.stem}" + (f" ({result.reason})" if result.reason else ""))
         
+        self.cache.commit(step_key, output_path, graph_xml.stem, params)
+        self.intermediates.produced(output_path)
+        self.intermediates.consumed(params.values())
         print(f"✓ Complete: {output_name}")
         return output_path
     
+    def gpt_command(self, graph_xml, output_path, params):
+        """GPT command line for one graph"""
+        cmd = [
+            str(self.gpt),
+            str(graph_xml),
+            f"-Poutput={output_path}",
+        ]
+        
+        for key, val in params.items():
+            cmd.append(f"-P{key}={val}")
+        
+        cmd.extend(["-c", f"{self.config['snap']['cache_size_gb']}G"])
+        cmd.extend(["-q", str(self.scheduler_threads)])
+        return cmd
+    
     def process_single_grd(self, grd_path, idx):
         """Process one GRD image: calibrate → terrain-correct → dB"""
         print(f"\n--- Processing GRD {idx+1}/{len(self.grd_files)} ---")
         
+        # One fused graph per scene when snap.graph_mode is fused
+        return self.fusion.run(lambda: self.chain_single_grd(grd_path, idx), self.run_gpt,
+                               dry_run=self.plan is not None)
+    
+    def chain_single_grd(self, grd_path, idx):
+        """Steps 1-5 for one GRD: orbit → calibrate → speckle filter → TC → dB"""
         # Step 1: Apply orbit file
         graph1 = Path("graphs/grd_01_orbit.xml")
         orbit_out = self.run_gpt(
             graph1,
             f"grd_{idx}_orbit.dim",
-            input=str(grd_path)
+            input=str(self.local_input(grd_path))
         )
         
         # Step 2: Calibrate to sigma0
@@ -118,37 +180,59 @@ class GRD_Processor:
         
         return db_out
     
+    def local_input(self, grd):
+        """Local copy of an input GRD (waits for its fetch if it is a URL)"""
+        if self.plan is not None:
+            return self.plan.fetch(self.inputs, grd)
+        return self.inputs.resolve(grd)
+    
+    def vv_band(self, grd_dim):
+        """VV dB band (.img) inside a processed BEAM-DIMAP product"""
+        data_dir = grd_dim.parent / (grd_dim.stem + ".data")
+        return list(data_dir.glob("Sigma0_VV_db*.img"))[0]
+    
+    @limited("cpu")
+    @profiled("vv_composite")
     def create_median_composite(self, processed_grds):
-        """Stack GRDs and compute median (reduces speckle noise)"""
-        print("\n▶ Creating median composite...")
+        """Composite GRDs block by block: median (reduces speckle noise) + extra reducers"""
+        from block_composite import BlockCompositor
         
-        # Read all VV bands
-        vv_stack = []
-        profile = None
+        # Median always; mean/count/percentiles from composite.reducers in the same pass
+        compositor = BlockCompositor.from_config(self.config)
+        if 'median' not in compositor.reducers:
+            compositor.reducers.insert(0, 'median')
         
-        for grd_dim in processed_grds:
-            data_dir = grd_dim.parent / (grd_dim.stem + ".data")
-            vv_img = list(data_dir.glob("Sigma0_VV_db*.img"))[0]
-            
-            with rasterio.open(vv_img) as src:
-                if profile is None:
-                    profile = src.profile
-                    profile.update(driver='GTiff', compress='lzw')
-                
-                vv_data = src.read(1)
-                vv_stack.append(vv_data)
+        outputs = {name: self.output_dir / f"vv_{name}.tif" for name in compositor.reducers}
+        if self.plan is not None:
+            return self.plan.python("vv_composite", list(outputs.values()))[0]
         
-        # Compute median across time (robust to outliers)
-        vv_median = np.nanmedian(np.stack(vv_stack, axis=0), axis=0)
+        print("\n▶ Creating median composite...")
+        
+        # VV band of each processed scene
+        vv_imgs = [self.vv_band(grd_dim) for grd_dim in processed_grds]
+        compositor.run(vv_imgs, outputs)
         
-        # Save output
-        output_tif = self.output_dir / "vv_median.tif"
-        with rasterio.open(output_tif, 'w', **profile) as dst:
-            dst.write(vv_median.astype('float32'), 1)
+        for name, path in outputs.items():
+            if name != 'median':
+                print(f"✓ VV {name} composite: {path}")
         
+        output_tif = outputs['median']
         print(f"✓ VV median composite: {output_tif}")
         return output_tif
     
+    @limited("cpu")
+    @profiled("vv_change")
+    def detect_changes(self, processed_grds):
+        """Date and size of the strongest VV break per pixel (processed in self.grd_files order)"""
+        from change_detection import ChangeDetector
+        
+        if self.plan is not None:
+            return self.plan.python("vv_change", [self.output_dir / f"vv_change_{name}.tif"
+                                                  for name in ("date", "db", "score")])
+        scenes = [(acquisition_date(grd), self.vv_band(grd_dim))
+                  for grd, grd_dim in zip(self.grd_files, processed_grds)]
+        return ChangeDetector.from_config(self.config).run(scenes, self.output_dir)
+    
     def run_full_pipeline(self):
         """Execute complete GRD workflow"""
         print("\n" + "="*50)
@@ -158,16 +242,43 @@ class GRD_Processor:
         start_time = datetime.now()
         
         try:
-            self.verify_inputs()
+            if self.plan is None:
+                self.verify_inputs()
+                self.inputs.prefetch(self.grd_files)
             
-            # Process each GRD
-            processed = []
-            for i, grd in enumerate(self.grd_files):
-                result = self.process_single_grd(grd, i)
-                processed.append(result)
+            # Scenes are independent: process them concurrently,
+            # composite once every scene is done
+            scheduler = JobScheduler.from_config(self.config, on_abort=self.runner.cancel_all,
+                                                 intermediates=self.intermediates)
+            scene_jobs = [
+                scheduler.add(f"grd_{i}", lambda grd=grd, i=i: self.process_single_grd(grd, i))
+                for i, grd in enumerate(self.grd_files)
+            ]
             
             # Create median composite
-            vv_median = self.create_median_composite(processed)
+            scheduler.add(
+                "vv_median",
+                lambda *processed: self.create_median_composite(list(processed)),
+                deps=scene_jobs,
+                mem_gb=0
+            )
+            
+            # When canals were dug / sections flooded: needs the whole stack, not the median
+            cd_cfg = self.config.get('change_detection', {})
+            if cd_cfg.get('enabled', True) and len(scene_jobs) >= 2 * cd_cfg.get('min_segment', 3):
+                scheduler.add(
+                    "vv_change",
+                    lambda *processed: self.detect_changes(list(processed)),
+                    deps=scene_jobs,
+                    mem_gb=0
+                )
+            vv_median = scheduler.run()["vv_median"]
+            if self.plan is not None:
+                return vv_median
+            self.fusion.report()
+            self.intermediates.report(self.profiler)
+            self.inputs.report(self.profiler)
+            self.profiler.save("grd")
             
             elapsed = (datetime.now() - start_time).total_seconds() / 60
             print(f"\n✓ MODULE 1B COMPLETE ({elapsed:.1f} minutes)")
@@ -176,9 +287,80 @@ class GRD_Processor:
             return vv_median
             
         except Exception as e:
+            self.inputs.cancel()
             print(f"\n❌ PIPELINE FAILED: {e}")
             raise
 
+    def update_composite(self):
+        """Fold newly listed GRDs into the persistent composite state and re-emit the median
+        
+        Only scenes not yet in the state are processed; scenes older than
+        composite.rolling_window_days (relative to the newest) are removed.
+        """
+        print("\n" + "="*50)
+        print("MODULE 1B: INCREMENTAL VV COMPOSITE UPDATE")
+        print("="*50)
+        
+        from composite_state import CompositeState
+        from product_writer import ProductWriter
+        
+        start_time = datetime.now()
+        comp_cfg = self.config.get('composite', {})
+        state_dir = self.output_dir / "vv_composite_state"
+        
+        try:
+            self.verify_inputs()
+            
+            state = CompositeState(state_dir) if (state_dir / "state.json").exists() else None
+            known = state.scenes if state is not None else {}
+            new_grds = [(i, grd) for i, grd in enumerate(self.grd_files) if scene_id(grd) not in known]
+            print(f"  {len(known)} scenes in composite, {len(new_grds)} new")
+            self.inputs.prefetch(grd for _, grd in new_grds)
+            
+            # Process only the new acquisitions (concurrently)
+            scheduler = JobScheduler.from_config(self.config, on_abort=self.runner.cancel_all,
+                                                 intermediates=self.intermediates)
+            for i, grd in new_grds:
+                scheduler.add(scene_id(grd), lambda grd=grd, i=i: self.process_single_grd(grd, i))
+            processed = scheduler.run() if new_grds else {}
+            
+            if state is None:
+                if not processed:
+                    raise RuntimeError("No composite state and no GRD scenes to build it from")
+                first = self.vv_band(next(iter(processed.values())))
+                state = CompositeState.create(
+                    state_dir, first,
+                    range_db=tuple(comp_cfg.get('state_range_db', [-35.0, 5.0])),
+                    bin_db=comp_cfg.get('state_bin_db', 0.25)
+                )
+            
+            print("\n▶ Updating composite state...")
+            with self.limits.slot("cpu"), \
+                    self.profiler.step("vv_composite_update", output=self.output_dir / "vv_median.tif"):
+                for _, grd in sorted(new_grds, key=lambda item: acquisition_date(item[1])):
+                    sid = scene_id(grd)
+                    state.add_scene(sid, self.vv_band(processed[sid]), acquisition_date(grd))
+                    self.intermediates.release(processed[sid])  # folded into the state
+                
+                state.prune(comp_cfg.get('rolling_window_days'))
+                
+                output_tif = state.write_median(self.output_dir / "vv_median.tif",
+                                                ProductWriter.from_config(self.config))
+            self.intermediates.report(self.profiler)
+            self.inputs.report(self.profiler)
+            self.profiler.save("grd_update")
+            
+            elapsed = (datetime.now() - start_time).total_seconds() / 60
+            print(f"\n✓ VV median composite: {output_tif} ({len(state.scenes)} scenes)")
+            print(f"✓ MODULE 1B UPDATE COMPLETE ({elapsed:.1f} minutes)")
+            
+            return output_tif
+            
+        except Exception as e:
+            self.inputs.cancel()
+            print(f"\n❌ UPDATE FAILED: {e}")
+            raise
+
 if __name__ == "__main__":
     processor = GRD_Processor()
     processor.run_full_pipeline()
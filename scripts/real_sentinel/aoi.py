@@ -0,0 +1,115 @@
+"""
+Areas of interest for early subsetting
+
+AOIs come from the `aoi` section of config.yaml as bbox lists or vector files
+(GeoJSON, shapefile, GeoPackage). Each becomes a WGS84 WKT polygon for the
+SNAP Subset operator, which cuts the debursted interferogram down to the
+peatland footprint before topo removal, filtering and unwrapping.
+"""
+
+import math
+import re
+from pathlib import Path
+
+
+class AOI:
+    def __init__(self, name, geometry):
+        """One named area of interest (shapely geometry in EPSG:4326)"""
+        self.name = name
+        self.geometry = geometry
+
+    @property
+    def wkt(self):
+        """Subset geoRegion: the AOI's bounding polygon, as SNAP subsets to a rectangle anyway"""
+        from shapely.geometry import box
+        return box(*self.geometry.bounds).wkt
+
+    @property
+    def area_km2(self):
+        """Approximate area (equirectangular at the AOI's latitude)"""
+        lat = math.radians(self.geometry.centroid.y)
+        return self.geometry.area * 111.32 * 111.32 * math.cos(lat)
+
+    def __repr__(self):
+        return f"AOI({self.name!r}, {self.area_km2:.0f} km²)"
+
+
+def _safe_name(name):
+    return re.sub(r"[^\w.-]+", "_", str(name)).strip("_") or "aoi"
+
+
+def _from_file(path, name_field=None, dissolve=True):
+    import geopandas as gpd
+
+    gdf = gpd.read_file(path)
+    if gdf.crs is not None and gdf.crs.to_epsg() != 4326:
+        gdf = gdf.to_crs(epsg=4326)
+
+    if dissolve:
+        return [AOI(Path(path).stem, gdf.geometry.union_all())]
+
+    aois = []
+    for i, row in gdf.iterrows():
+        label = row[name_field] if name_field and name_field in gdf.columns else f"{Path(path).stem}_{i}"
+        aois.append(AOI(_safe_name(label), row.geometry))
+    return aois
+
+
+def load_aois(config):
+    """AOIs from config.yaml; an empty list means process the full subswath
+
+    aoi:
+      buffer_deg: 0.01
+      areas:
+        - [102.1, 0.9, 102.4, 1.2]                      # bbox lon/lat
+        - {name: block_a, bbox: [102.1, 0.9, 102.4, 1.2]}
+        - {path: concessions.geojson, split_by: name}   # one AOI per feature
+        - concessions.shp                               # all features as one AOI
+    """
+    aoi_cfg = config.get('aoi') or {}
+    buffer_deg = aoi_cfg.get('buffer_deg', 0.0)
+    if not aoi_cfg.get('areas'):
+        return []
+
+    # shapely only when there are AOIs: keeps full-subswath startup light
+    from shapely import wkt
+    from shapely.geometry import box
+
+    aois = []
+    for i, entry in enumerate(aoi_cfg.get('areas') or []):
+        if isinstance(entry, (list, tuple)):
+            entry = {"bbox": entry}
+        elif isinstance(entry, str):
+            entry = {"path": entry}
+
+        if "bbox" in entry:
+            minx, miny, maxx, maxy = entry["bbox"]
+            if not (minx < maxx and miny < maxy):
+                raise ValueError(f"AOI bbox must be [min_lon, min_lat, max_lon, max_lat]: {entry['bbox']}")
+            found = [AOI(entry.get("name") or f"aoi_{i + 1}", box(minx, miny, maxx, maxy))]
+        elif "wkt" in entry:
+            found = [AOI(entry.get("name") or f"aoi_{i + 1}", wkt.loads(entry["wkt"]))]
+        elif "path" in entry:
+            path = Path(entry["path"])
+            if not path.exists():
+                raise FileNotFoundError(f"AOI file not found: {path}")
+            split_by = entry.get("split_by")
+            found = _from_file(path, split_by, dissolve=split_by is None)
+            if entry.get("name") and len(found) == 1:
+                found[0].name = entry["name"]
+        else:
+            raise ValueError(f"AOI entry needs bbox, wkt or path: {entry}")
+
+        for aoi in found:
+            aoi.name = _safe_name(aoi.name)
+            if buffer_deg:
+                aoi.geometry = aoi.geometry.buffer(buffer_deg)
+            aois.append(aoi)
+
+    names = [a.name for a in aois]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate AOI names: {duplicates}")
+
+    return aois
+
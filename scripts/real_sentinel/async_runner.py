@@ -0,0 +1,323 @@
+"""
+Streaming subprocess runner for GPT and SNAPHU
+
+Every child process runs on one shared asyncio event loop (in a single
+background thread), whichever thread starts it: stdout/stderr are read as
+they arrive instead of being buffered until exit, written to a log file
+line by line, and only a bounded tail is kept in memory. GPT's
+"....10%....20%" progress is parsed from partial lines and printed live.
+
+A step is killed, together with its whole process tree, when it exceeds
+its timeout, stalls (no progress for stall_timeout), is cancelled (another
+job failed, cancel_all()) or the user presses Ctrl-C.
+"""
+
+import asyncio
+import concurrent.futures
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+try:
+    import psutil
+except ImportError:  # optional: falls back to process groups / taskkill
+    psutil = None
+
+GPT_PROGRESS = re.compile(r"(?<!\d)(\d{1,3})%")
+CHUNK_BYTES = 64 * 1024
+MAX_LINE_CHARS = 64 * 1024  # longer "lines" (progress dots) are flushed as they are
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def event_loop():
+    """The shared loop all child processes run on (started on first use)"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            if sys.platform.startswith("linux") and sys.version_info < (3, 12) \
+                    and hasattr(os, "pidfd_open"):
+                # reap children via pidfds on the loop instead of one waitpid thread each
+                watcher = asyncio.PidfdChildWatcher()
+                watcher.attach_loop(loop)
+                asyncio.get_event_loop_policy().set_child_watcher(watcher)
+            threading.Thread(target=loop.run_forever, name="subprocess-loop", daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+def step_log_path(temp_dir, step, output_path):
+    """Fresh temp/logs file a step's stdout/stderr is streamed to"""
+    log_dir = Path(temp_dir) / "logs"
+    log_dir.mkdir(parents=True, exist_ok=True)
+    log_path = log_dir / f"{step}_{Path(output_path).stem}.log"
+    log_path.unlink(missing_ok=True)
+    return log_path
+
+
+def cancel_all():
+    """Cancel every step running on the shared loop, whichever runner started it"""
+    loop = _loop
+    if loop is None:
+        return
+
+    def cancel():
+        for task in asyncio.all_tasks(loop):
+            task.cancel()
+
+    loop.call_soon_threadsafe(cancel)
+
+
+def process_tree(pid):
+    """psutil handles of a process's descendants (taken before it dies and they are orphaned)"""
+    if psutil is None:
+        return []
+    try:
+        return psutil.Process(pid).children(recursive=True)
+    except psutil.NoSuchProcess:
+        return []
+
+
+def signal_tree(pid, descendants, kill=False):
+    """SIGTERM (or SIGKILL) a process and its descendants without reaping the process itself"""
+    if psutil is not None:
+        for p in [*descendants, psutil.Process(pid) if psutil.pid_exists(pid) else None]:
+            try:
+                if p is not None:
+                    p.kill() if kill else p.terminate()
+            except psutil.NoSuchProcess:
+                pass
+    elif os.name == "nt":
+        subprocess.run(["taskkill", *(["/F"] if kill else []), "/T", "/PID", str(pid)], capture_output=True)
+    else:
+        # children were started in their own session: the group is the tree
+        try:
+            os.killpg(pid, signal.SIGKILL if kill else signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+class StepCancelled(RuntimeError):
+    pass
+
+
+class StepResult:
+    def __init__(self, args, returncode, stdout, stderr, elapsed_s, percent=None,
+                 reason=None, log_path=None):
+        """CompletedProcess-like result; stdout/stderr hold the last lines only"""
+        self.args = args
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.elapsed_s = elapsed_s
+        self.percent = percent  # last GPT progress seen
+        self.reason = reason  # "timeout", "stalled" or None
+        self.log_path = log_path
+
+
+class AsyncRunner:
+    def __init__(self, timeout_min=None, stall_timeout_min=None, tail_lines=200, grace_s=5.0):
+        """Per-step limits (None = unlimited) for every command started through it"""
+        self.timeout_s = timeout_min * 60 if timeout_min else None
+        self.stall_s = stall_timeout_min * 60 if stall_timeout_min else None
+        self.tail_lines = tail_lines
+        self.grace_s = grace_s
+        self._tasks = set()  # only touched on the loop thread
+
+    @classmethod
+    def from_config(cls, config):
+        """Build from the `snap` section of config.yaml"""
+        snap_cfg = config.get('snap', {})
+        return cls(
+            timeout_min=snap_cfg.get('step_timeout_min'),
+            stall_timeout_min=snap_cfg.get('stall_timeout_min'),
+        )
+
+    # ---------- coroutine API (one event loop, many children) ----------
+
+    async def stream(self, cmd, name, log_path=None, cwd=None, watch=None, on_line=None,
+                     timeout_s=None, stall_s=None, progress=True):
+        """Run cmd, streaming its output; kills the process tree on timeout/cancel
+
+        progress parses and prints GPT's percentages from stdout. on_line(stream,
+        line) may return True to mark progress: when given, only those lines
+        (and percentages) reset the stall clock, otherwise any output does.
+        """
+        timeout_s = self.timeout_s if timeout_s is None else timeout_s
+        stall_s = self.stall_s if stall_s is None else stall_s
+        kwargs = {}
+        if os.name == "nt":
+            kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs['start_new_session'] = True  # own process group, killed as one
+
+        start = last_progress = time.monotonic()
+        proc = await asyncio.create_subprocess_exec(
+            *[str(c) for c in cmd], cwd=cwd,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, **kwargs)
+        if watch is not None:
+            watch(proc)
+
+        tails = {"stdout": deque(maxlen=self.tail_lines), "stderr": deque(maxlen=self.tail_lines)}
+        percent = None
+        log = open(log_path, 'a', encoding='utf-8') if log_path else None
+
+        def handle(stream, line):
+            nonlocal last_progress
+            tails[stream].append(line)
+            if log is not None:
+                log.write(line + "\n")
+            marked = on_line(stream, line) if on_line is not None else None
+            if marked or (on_line is None and line.strip()):
+                last_progress = time.monotonic()
+
+        async def pump(stream_name, reader):
+            nonlocal last_progress, percent
+            pending = ""
+            while True:
+                chunk = await reader.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                text = pending + chunk.decode('utf-8', errors='replace').replace("\r", "\n")
+
+                # GPT prints its percentages on one growing line: parse them as they come
+                if progress and stream_name == "stdout":
+                    # a percentage may straddle two chunks: rescan the carried-over tail
+                    for match in GPT_PROGRESS.finditer(text, max(0, len(pending) - 3)):
+                        pct = int(match.group(1))
+                        if pct <= 100 and pct != percent:
+                            percent = pct
+                            last_progress = time.monotonic()
+                            print(f"  {name}: {pct}%")
+
+                *lines, pending = text.split("\n")
+                for line in lines:
+                    handle(stream_name, line)
+                if len(pending) > MAX_LINE_CHARS:
+                    handle(stream_name, pending)
+                    pending = ""
+            if pending:
+                handle(stream_name, pending)
+
+        readers = asyncio.gather(pump("stdout", proc.stdout), pump("stderr", proc.stderr))
+        reason = None
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(asyncio.shield(readers), timeout=1.0)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+                now = time.monotonic()
+                if timeout_s and now - start > timeout_s:
+                    reason = "timeout"
+                    break
+                if stall_s and now - last_progress > stall_s:
+                    reason = "stalled"
+                    break
+
+            if reason is not None:
+                print(f"  ⚠ {name}: {reason} after {(time.monotonic() - start) / 60:.1f} minutes, "
+                      f"killing process tree")
+                await self._kill(proc)
+            returncode = await proc.wait()
+        except asyncio.CancelledError:
+            print(f"  ⚠ {name}: cancelled, killing process tree")
+            await self._kill(proc)
+            raise
+        finally:
+            if not readers.done():
+                readers.cancel()
+            if log is not None:
+                log.close()
+
+        return StepResult(
+            cmd, returncode,
+            "\n".join(tails["stdout"]), "\n".join(tails["stderr"]),
+            time.monotonic() - start, percent, reason, log_path,
+        )
+
+    async def _kill(self, proc):
+        """Terminate the process tree, killing whatever outlives the grace period"""
+        if proc.returncode is not None:
+            return
+        descendants = process_tree(proc.pid)
+        signal_tree(proc.pid, descendants)
+        try:
+            await asyncio.wait_for(proc.wait(), self.grace_s)
+        except asyncio.TimeoutError:
+            pass
+        # the child itself is only ever reaped by asyncio; descendants are polled
+        if psutil is not None:
+            alive = [p for p in descendants if p.is_running() and p.status() != psutil.STATUS_ZOMBIE]
+        else:
+            alive = proc.returncode is None
+        if alive or proc.returncode is None:
+            signal_tree(proc.pid, descendants, kill=True)
+        await proc.wait()
+
+    async def gather(self, steps):
+        """Run several stream() calls concurrently; a failure cancels the rest"""
+        tasks = [asyncio.ensure_future(self.stream(**step)) for step in steps]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    # ---------- blocking API (from pipeline threads) ----------
+
+    def submit(self, coro):
+        """Schedule a coroutine on the shared loop; cancel_all() can cancel it"""
+        async def tracked():
+            task = asyncio.current_task()
+            self._tasks.add(task)
+            try:
+                return await coro
+            finally:
+                self._tasks.discard(task)
+
+        return asyncio.run_coroutine_threadsafe(tracked(), event_loop())
+
+    def wait(self, future, name):
+        try:
+            return future.result()
+        except concurrent.futures.CancelledError:
+            raise StepCancelled(f"{name} cancelled") from None
+        except KeyboardInterrupt:
+            # Ctrl-C: kill our children before handing the interrupt on
+            self.cancel_all()
+            try:
+                future.result(timeout=self.grace_s + 10)
+            except (concurrent.futures.CancelledError, concurrent.futures.TimeoutError):
+                pass
+            raise
+
+    def run(self, cmd, name, **kwargs):
+        """Blocking stream(): returns a StepResult, raises StepCancelled if cancelled"""
+        return self.wait(self.submit(self.stream(cmd, name, **kwargs)), name)
+
+    def run_many(self, steps):
+        """Blocking gather() of stream() keyword dicts"""
+        return self.wait(self.submit(self.gather(steps)), "steps")
+
+    def cancel_all(self):
+        """Cancel every step started through this runner (their trees are killed)"""
+        if _loop is None:
+            return
+
+        def cancel():
+            for task in list(self._tasks):
+                task.cancel()
+
+        _loop.call_soon_threadsafe(cancel)
@@ -0,0 +1,425 @@
+"""
+Canal detection engine (Module 2)
+
+Canals are found from two independent signals:
+
+- dark linear features in the VV composite (open water below
+  vv_threshold_db): connected components are cut into grid cells, and every
+  piece whose moments describe a narrow, straight strip becomes a short
+  line segment;
+- V-shaped subsidence troughs: coherent pixels sinking faster than their
+  surroundings within v_shape_radius_m.
+
+The raster is split into square chunks with a halo wide enough for every
+filter and processed on a thread pool. Segments from neighbouring chunks are
+stitched through a spatial index before the min_canal_length_m filter. A
+second chunked pass scores every pixel from its distance to the accepted
+canals (distance transform) and the trough depth nearby, and writes
+canal_risk_score.tif, canal_classification.tif and the canal_confirmed /
+canal_potential shapefiles read by ResultVisualizer.
+"""
+
+import math
+import os
+import warnings
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.features import rasterize
+from rasterio.windows import Window
+from scipy import ndimage
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from profiler import Profiler, profiled
+from product_writer import ProductWriter
+from raster_blocks import AlignedReaders, metres_per_unit, read_masked, process_blocks
+
+# canal_classification.tif values
+CLASSES = {"low": 0, "moderate": 1, "high_potential": 2, "confirmed": 3}
+CLASS_NODATA = 255
+
+# Risk = 0.6 × strongest indicator + 0.4 × the other one (aligned):
+# one strong indicator alone reaches high_potential (0.6), confirmed (0.8)
+# needs a dark line and a trough of at least half depth within tolerance.
+SINGLE_WEIGHT = 0.6
+ALIGNED_WEIGHT = 0.4
+
+
+def chunk_windows(height, width, size, halo):
+    """(core, read) window pairs: square chunks and their halo-expanded reads"""
+    for row in range(0, height, size):
+        for col in range(0, width, size):
+            core = Window(col, row, min(size, width - col), min(size, height - row))
+            r0, c0 = max(0, row - halo), max(0, col - halo)
+            r1 = min(height, row + core.height + halo)
+            c1 = min(width, col + core.width + halo)
+            yield core, Window(c0, r0, c1 - c0, r1 - r0)
+
+
+def nan_mean_filter(data, size):
+    """Moving-window mean ignoring NaN (normalized convolution)"""
+    valid = np.isfinite(data)
+    total = ndimage.uniform_filter(np.where(valid, data, 0).astype('float32'), size, mode='constant')
+    weight = ndimage.uniform_filter(valid.astype('float32'), size, mode='constant')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(weight > 1e-6, total / weight, np.nan)
+
+
+def line_segments(dark, pixel_m, max_width_m, cell_px, origin=(0, 0), min_elongation=3.0):
+    """Short straight segments along the narrow, elongated parts of a mask
+
+    Components are cut along a global grid of cell_px (rows, cols) cells, so
+    junctions and bends don't distort a canal's axis: every piece gets its
+    own segment from its moments, and junction pieces fail the elongation
+    test. All pieces are measured at once. Returns (n, 4) rows of x0, y0, x1,
+    y1 in metres from the array origin, plus the piece centroids (n, 2) in
+    pixel (col, row). `origin` is the array's (row, col) in the full raster.
+    """
+    px, py = pixel_m
+    labels, n = ndimage.label(dark, structure=np.ones((3, 3), dtype=bool))
+    if n == 0:
+        return np.empty((0, 4)), np.empty((0, 2))
+
+    rows, cols = np.nonzero(labels)
+    cell = ((rows + origin[0]) // cell_px[0]) * (1 << 20) + (cols + origin[1]) // cell_px[1]
+    _, piece = np.unique(labels[rows, cols].astype('int64') * (1 << 40) + cell, return_inverse=True)
+    m = piece.max() + 1
+    x = (cols + 0.5) * px
+    y = (rows + 0.5) * py
+    index = np.arange(m)
+
+    count = np.bincount(piece, minlength=m).astype('float64')
+    mx = np.bincount(piece, x, m) / count
+    my = np.bincount(piece, y, m) / count
+    dx, dy = x - mx[piece], y - my[piece]
+    sxx = np.bincount(piece, dx * dx, m) / count
+    syy = np.bincount(piece, dy * dy, m) / count
+    sxy = np.bincount(piece, dx * dy, m) / count
+
+    # principal axis of each piece
+    theta = 0.5 * np.arctan2(2 * sxy, sxx - syy)
+    ux, uy = np.cos(theta), np.sin(theta)
+    along = dx * ux[piece] + dy * uy[piece]
+    lo = np.asarray(ndimage.minimum(along, piece, index))
+    hi = np.asarray(ndimage.maximum(along, piece, index))
+    length = hi - lo + min(px, py)
+
+    # half-width: deepest point of the whole component from its edge
+    # (EDT counts to the nearest background pixel centre, half a pixel beyond the edge)
+    depth = ndimage.distance_transform_edt(dark, sampling=(py, px))
+    half_width = np.asarray(ndimage.maximum(depth[rows, cols], piece, index)) - min(px, py) / 2
+    # spread across the axis: ~0.6 half-widths for a straight strip, far more at junctions
+    minor = (sxx + syy) / 2 - np.sqrt(((sxx - syy) / 2) ** 2 + sxy ** 2)
+    across = np.sqrt(np.maximum(minor, 0))
+
+    keep = ((count >= 3) & (2 * half_width <= max_width_m)
+            & (length >= min_elongation * 2 * half_width)
+            & (across <= np.maximum(half_width, max(px, py))))
+    segments = np.column_stack([mx + lo * ux, my + lo * uy, mx + hi * ux, my + hi * uy])[keep]
+    centroids = np.column_stack([mx / px, my / py])[keep]
+    return segments, centroids
+
+
+def stitch_segments(segments, gap_m, offset_m, max_angle_deg=15.0):
+    """Merge collinear segments that overlap or nearly touch
+
+    segments: (n, 4) x0, y0, x1, y1 in a metric frame. Candidate pairs within
+    gap_m come from an STRtree; pairs that are nearly parallel and offset
+    sideways by at most offset_m are joined, and each connected group becomes
+    one segment spanning all its endpoints.
+    """
+    from shapely import STRtree, linestrings
+
+    n = len(segments)
+    if n == 0:
+        return segments
+    lines = linestrings(segments.reshape(n, 2, 2))
+    i, j = STRtree(lines).query(lines, predicate="dwithin", distance=gap_m)
+    i, j = i[i < j], j[i < j]
+
+    d = segments[:, 2:] - segments[:, :2]
+    length = np.hypot(d[:, 0], d[:, 1])
+    u = d / np.maximum(length, 1e-9)[:, None]
+    mid = (segments[:, :2] + segments[:, 2:]) / 2
+
+    parallel = np.abs((u[i] * u[j]).sum(axis=1)) >= math.cos(math.radians(max_angle_deg))
+    rel = mid[j] - mid[i]
+    offset = np.abs(rel[:, 0] * u[i, 1] - rel[:, 1] * u[i, 0])
+    join = parallel & (offset <= offset_m)
+
+    graph = coo_matrix((np.ones(join.sum()), (i[join], j[join])), shape=(n, n))
+    n_groups, group = connected_components(graph, directed=False)
+
+    # direction of the longest member; extent from all member endpoints
+    order = np.lexsort((length, group))
+    last = np.r_[group[order][1:] != group[order][:-1], True]
+    ref = np.empty(n_groups, dtype=int)
+    ref[group[order][last]] = order[last]
+    g_u = u[ref]
+    g_u[g_u[:, 0] < 0] *= -1  # consistent orientation
+    weight = np.bincount(group, length, n_groups)
+    center = np.column_stack([
+        np.bincount(group, mid[:, 0] * length, n_groups),
+        np.bincount(group, mid[:, 1] * length, n_groups),
+    ]) / np.maximum(weight, 1e-9)[:, None]
+
+    ends = np.concatenate([segments[:, :2], segments[:, 2:]])
+    end_group = np.concatenate([group, group])
+    along = ((ends - center[end_group]) * g_u[end_group]).sum(axis=1)
+    index = np.arange(n_groups)
+    lo = np.asarray(ndimage.minimum(along, end_group, index))
+    hi = np.asarray(ndimage.maximum(along, end_group, index))
+    return np.column_stack([center + lo[:, None] * g_u, center + hi[:, None] * g_u])
+
+
+class CanalDetector:
+    def __init__(self, products_dir, vv_threshold_db=-18.0, v_shape_radius_m=150,
+                 alignment_tolerance_m=50, min_canal_length_m=100, max_canal_width_m=40,
+                 v_shape_depth_mm=10.0, coherence_threshold=0.3, risk_thresholds=None,
+                 chunk_px=2048, workers=None, writer=None):
+        """Module 2 engine; thresholds in dB, metres and mm/yr"""
+        self.products_dir = Path(products_dir)
+        self.vv_threshold_db = vv_threshold_db
+        self.v_shape_radius_m = v_shape_radius_m
+        self.alignment_tolerance_m = alignment_tolerance_m
+        self.min_canal_length_m = min_canal_length_m
+        self.max_canal_width_m = max_canal_width_m
+        self.v_shape_depth_mm = v_shape_depth_mm
+        self.coherence_threshold = coherence_threshold
+        self.risk_thresholds = risk_thresholds or {"confirmed": 0.8, "high_potential": 0.6, "moderate": 0.4}
+        self.chunk_px = chunk_px
+        self.workers = workers or os.cpu_count() or 1
+        self.writer = writer or ProductWriter()
+        self.profiler = Profiler(enabled=False)
+
+    @classmethod
+    def from_config(cls, config):
+        """Build from the `processing`, `risk_thresholds` and `canals` sections"""
+        proc = config['processing']
+        canal_cfg = config.get('canals', {})
+        detector = cls(
+            config['output']['products'],
+            vv_threshold_db=proc['vv_threshold_db'],
+            v_shape_radius_m=proc['v_shape_radius_m'],
+            alignment_tolerance_m=proc['alignment_tolerance_m'],
+            min_canal_length_m=proc['min_canal_length_m'],
+            max_canal_width_m=proc.get('max_canal_width_m', 40),
+            v_shape_depth_mm=proc.get('v_shape_depth_mm', 10.0),
+            coherence_threshold=proc['coherence_threshold'],
+            risk_thresholds=config.get('risk_thresholds'),
+            chunk_px=canal_cfg.get('chunk_px', 2048),
+            workers=canal_cfg.get('workers'),
+            writer=ProductWriter.from_config(config),
+        )
+        detector.profiler = Profiler.from_config(config)
+        return detector
+
+    def classify(self, risk):
+        t = self.risk_thresholds
+        classes = np.full(risk.shape, CLASS_NODATA, dtype='uint8')
+        valid = np.isfinite(risk)
+        classes[valid] = CLASSES["low"]
+        classes[valid & (risk >= t["moderate"])] = CLASSES["moderate"]
+        classes[valid & (risk >= t["high_potential"])] = CLASSES["high_potential"]
+        classes[valid & (risk >= t["confirmed"])] = CLASSES["confirmed"]
+        return classes
+
+    def trough_score(self, subsidence, radius_px):
+        """0-1: how much deeper a pixel sinks than the mean within v_shape_radius_m"""
+        local = nan_mean_filter(subsidence, (2 * radius_px[1] + 1, 2 * radius_px[0] + 1))
+        depth = local - subsidence  # velocities are negative when sinking
+        score = np.clip(depth / self.v_shape_depth_mm, 0, 1)
+        return np.nan_to_num(score, nan=0.0).astype('float32')
+
+    def cell_m(self):
+        """Grid cell canals are cut into: long enough to tell the widest canal from a blob"""
+        return 4 * self.max_canal_width_m
+
+    def find_segments(self, readers, pixel_m, halo):
+        """Pass 1: candidate dark-line pieces per chunk, in metres from the raster origin"""
+        cell_px = (max(4, round(self.cell_m() / pixel_m[1])), max(4, round(self.cell_m() / pixel_m[0])))
+        found = []
+
+        def detect(chunk):
+            core, read = chunk
+            vv = read_masked(readers.datasets()[0], read)
+            dark = ndimage.binary_closing(vv < self.vv_threshold_db)  # bridge speckle gaps
+            segments, centroids = line_segments(dark, pixel_m, self.max_canal_width_m, cell_px,
+                                                origin=(read.row_off, read.col_off))
+
+            # a piece is reported by the chunk whose core holds its centroid
+            col = centroids[:, 0] + read.col_off
+            row = centroids[:, 1] + read.row_off
+            own = ((col >= core.col_off) & (col < core.col_off + core.width) &
+                   (row >= core.row_off) & (row < core.row_off + core.height))
+            shift = np.array([read.col_off * pixel_m[0], read.row_off * pixel_m[1]] * 2)
+            return segments[own] + shift
+
+        process_blocks(
+            chunk_windows(readers.height, readers.width, self.chunk_px, halo),
+            detect,
+            lambda chunk, segments: found.append(segments),
+            workers=self.workers,
+        )
+        return np.concatenate(found) if found else np.empty((0, 4))
+
+    @profiled("canal_detection", "stage")
+    def run(self):
+        """Detect canals and write the risk/class rasters and canal shapefiles"""
+        print("\n▶ Detecting canals...")
+        vv_path = self.products_dir / "vv_median.tif"
+        sub_path = self.products_dir / "subsidence_velocity.tif"
+        coh_path = self.products_dir / "coherence_median.tif"
+        if not vv_path.exists():
+            raise FileNotFoundError(f"VV composite not found: {vv_path} (run Module 1B first)")
+        has_sub = sub_path.exists() and coh_path.exists()
+        if not has_sub:
+            print("  ⚠ No subsidence/coherence products: dark lines only, no V-shape troughs")
+
+        inputs = [vv_path] + ([sub_path, coh_path] if has_sub else [])
+        with AlignedReaders(inputs) as readers:
+            left, bottom, right, top = rasterio.transform.array_bounds(
+                readers.height, readers.width, readers.transform)
+            unit_m = metres_per_unit(readers.crs, (bottom + top) / 2)
+            pixel_m = (abs(readers.transform.a) * unit_m[0], abs(readers.transform.e) * unit_m[1])
+            radius_px = [max(1, round(self.v_shape_radius_m / p)) for p in pixel_m]
+            tol_px = [max(1, round(self.alignment_tolerance_m / p)) for p in pixel_m]
+            cell_px = round(self.cell_m() / min(pixel_m))
+            halo = max(max(radius_px + tol_px) + max(tol_px), 2 * cell_px) + 2
+            print(f"  {readers.width}x{readers.height} px at {pixel_m[0]:.0f}x{pixel_m[1]:.0f} m, "
+                  f"{self.chunk_px} px chunks + {halo} px halo")
+
+            candidates = self.find_segments(readers, pixel_m, halo)
+            # bridge one dropped junction cell; sideways offset within a canal's width
+            stitched = stitch_segments(candidates, 1.5 * self.cell_m(),
+                                       self.max_canal_width_m / 2 + max(pixel_m))
+            lengths = np.hypot(stitched[:, 2] - stitched[:, 0], stitched[:, 3] - stitched[:, 1])
+            canals = stitched[lengths >= self.min_canal_length_m]
+            lengths = lengths[lengths >= self.min_canal_length_m]
+            print(f"  {len(candidates)} dark-line segments → {len(stitched)} stitched "
+                  f"→ {len(canals)} ≥ {self.min_canal_length_m} m")
+
+            # metres from the raster origin → map coordinates
+            to_map = np.array([np.sign(readers.transform.a) / unit_m[0],
+                               np.sign(readers.transform.e) / unit_m[1]] * 2)
+            origin = np.array([readers.transform.c, readers.transform.f] * 2)
+            canals_map = origin + canals * to_map
+            outputs = self.score(readers, canals_map, pixel_m, radius_px, tol_px, halo, has_sub)
+
+        outputs.update(self.write_vectors(canals_map, lengths, outputs.pop("line_trough"), readers.crs))
+        print("✓ Canal detection complete")
+        return outputs
+
+    def score(self, readers, canals_map, pixel_m, radius_px, tol_px, halo, has_sub):
+        """Pass 2: per-pixel risk and class; mean aligned trough along each canal"""
+        from shapely import STRtree, box, linestrings
+
+        lines = linestrings(canals_map.reshape(-1, 2, 2)) if len(canals_map) else np.array([])
+        tree = STRtree(lines)
+        n = len(lines)
+        trough_sum = np.zeros(n + 1)
+        trough_count = np.zeros(n + 1)
+
+        risk_path = self.products_dir / "canal_risk_score.tif"
+        class_path = self.products_dir / "canal_classification.tif"
+        profile = {**readers.profile, 'count': 1}
+
+        with self.writer.open(risk_path, {**profile, 'dtype': 'float32', 'nodata': np.nan}) as risk_dst, \
+                self.writer.open(class_path, {**profile, 'dtype': 'uint8', 'nodata': CLASS_NODATA},
+                                 kind="class") as class_dst:
+
+            def score_chunk(chunk):
+                core, read = chunk
+                datasets = readers.datasets()
+                vv = read_masked(datasets[0], read)
+                transform = rasterio.windows.transform(read, readers.transform)
+
+                hits = tree.query(box(*rasterio.windows.bounds(read, readers.transform)))
+                if len(hits):
+                    ids = rasterize(((lines[k], k + 1) for k in hits), out_shape=vv.shape,
+                                    transform=transform, all_touched=True, dtype='int32')
+                    distance = ndimage.distance_transform_edt(ids == 0, sampling=pixel_m[::-1])
+                    distance = np.maximum(distance - max(pixel_m), 0)  # centreline rasterized ±1 px
+                    line = np.clip(1 - distance / self.alignment_tolerance_m, 0, 1).astype('float32')
+                else:
+                    ids = np.zeros(vv.shape, dtype='int32')
+                    line = np.zeros(vv.shape, dtype='float32')
+
+                if has_sub:
+                    sub = read_masked(datasets[1], read)
+                    sub[~(read_masked(datasets[2], read) >= self.coherence_threshold)] = np.nan
+                    trough = self.trough_score(sub, radius_px)
+                else:
+                    trough = np.zeros(vv.shape, dtype='float32')
+
+                # strongest trough within the alignment tolerance of each pixel
+                aligned = ndimage.maximum_filter(trough, size=(2 * tol_px[1] + 1, 2 * tol_px[0] + 1))
+                risk = (SINGLE_WEIGHT * np.maximum(line, trough)
+                        + ALIGNED_WEIGHT * np.minimum(line, aligned))
+                risk[np.isnan(vv)] = np.nan
+
+                inner = (slice(core.row_off - read.row_off, core.row_off - read.row_off + core.height),
+                         slice(core.col_off - read.col_off, core.col_off - read.col_off + core.width))
+                core_ids = ids[inner].ravel()
+                on_line = core_ids > 0
+                stats = (np.bincount(core_ids[on_line], aligned[inner].ravel()[on_line], n + 1),
+                         np.bincount(core_ids[on_line], minlength=n + 1))
+                return risk[inner], stats
+
+            def write_chunk(chunk, result):
+                core, _ = chunk
+                risk, (t_sum, t_count) = result
+                risk_dst.write(risk, 1, window=core)
+                class_dst.write(self.classify(risk), 1, window=core)
+                trough_sum[:] += t_sum
+                trough_count[:] += t_count
+
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                process_blocks(
+                    chunk_windows(readers.height, readers.width, self.chunk_px, halo),
+                    score_chunk,
+                    write_chunk,
+                    workers=self.workers,
+                )
+
+        print(f"  ✓ {risk_path.name}, {class_path.name}")
+        line_trough = trough_sum[1:] / np.maximum(trough_count[1:], 1)
+        return {"risk": risk_path, "classification": class_path, "line_trough": line_trough}
+
+    def write_vectors(self, canals_map, lengths, line_trough, crs):
+        """canal_confirmed.shp / canal_potential.shp, split by canal risk"""
+        import geopandas as gpd
+        from shapely import linestrings
+
+        risk = SINGLE_WEIGHT + ALIGNED_WEIGHT * line_trough  # every canal is a dark line
+        confirmed = risk >= self.risk_thresholds["confirmed"]
+        outputs = {}
+        for name, keep in (("confirmed", confirmed), ("potential", ~confirmed)):
+            path = self.products_dir / f"canal_{name}.shp"
+            for old in self.products_dir.glob(f"canal_{name}.*"):
+                old.unlink()  # never leave canals from a previous run behind
+            if not keep.any():
+                print(f"  ⚠ No {name} canals")
+                continue
+            gdf = gpd.GeoDataFrame({
+                "length_m": lengths[keep].round(1),
+                "trough": line_trough[keep].round(3),
+                "risk": risk[keep].round(3),
+            }, geometry=linestrings(canals_map[keep].reshape(-1, 2, 2)), crs=crs)
+            gdf.to_file(path)
+            outputs[name] = path
+            print(f"  ✓ {path.name}: {len(gdf)} canals, {lengths[keep].sum() / 1000:.1f} km")
+        return outputs
+
+
+if __name__ == "__main__":
+    import yaml
+
+    with open("config.yaml", 'r') as f:
+        config = yaml.safe_load(f)
+    detector = CanalDetector.from_config(config)
+    detector.run()
+    detector.profiler.save("canals")
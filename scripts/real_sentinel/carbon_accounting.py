@@ -0,0 +1,241 @@
+"""
+Zonal carbon-loss accounting for MRV reporting
+
+Subsidence velocity (mm/yr, negative = sinking) is converted per pixel to
+emissions with the `carbon` section of config.yaml:
+
+    t CO₂/ha/yr = sinking (m/yr) × bulk density (t/m³) × 10 000 m²/ha
+                  × carbon fraction × CO₂/C ratio
+
+Pixels outside quality_mask.tif are excluded. Parcels (concessions, plots)
+are rasterized once onto the product grid into a cached label raster; each
+new velocity product then needs a single block-streamed pass in which every
+strip is aggregated for all parcels at once with np.bincount. Results go to
+carbon_parcels.gpkg (with geometry) and carbon_parcels.csv.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.features import rasterize
+
+from profiler import Profiler, profiled
+from product_writer import ProductWriter
+from raster_blocks import (AlignedReaders, block_windows, metres_per_unit, rows_per_block,
+                           read_masked, process_blocks)
+
+# Per-parcel sums accumulated over the strips
+SUMS = ("pixels", "valid", "emission", "velocity")
+
+
+def emission_factor(carbon_cfg):
+    """t CO₂/ha/yr per mm/yr of subsidence"""
+    return (1e-3                                # mm → m
+            * carbon_cfg['peat_bulk_density']   # g/cm³ = t/m³
+            * 1e4                               # m² per ha
+            * carbon_cfg['carbon_fraction']
+            * carbon_cfg['co2_to_carbon_ratio'])
+
+
+class CarbonAccounting:
+    def __init__(self, products_dir, cache_dir, parcels, carbon_cfg, id_field=None,
+                 block_budget_mb=256, workers=None, writer=None):
+        """Zonal emissions of `parcels` (any vector file geopandas reads)"""
+        self.products_dir = Path(products_dir)
+        self.cache_dir = Path(cache_dir)
+        self.parcels = Path(parcels) if parcels else None
+        self.id_field = id_field
+        self.factor = emission_factor(carbon_cfg)
+        self.budget_bytes = block_budget_mb * 1024**2
+        self.workers = workers or os.cpu_count() or 1
+        self.writer = writer or ProductWriter()
+        self.profiler = Profiler(enabled=False)
+
+    @classmethod
+    def from_config(cls, config):
+        """Build from the `carbon` section of config.yaml"""
+        carbon_cfg = config['carbon']
+        accounting = cls(
+            config['output']['products'],
+            Path(config['output']['temp']) / "carbon",
+            carbon_cfg.get('parcels'),
+            carbon_cfg,
+            id_field=carbon_cfg.get('id_field'),
+            block_budget_mb=carbon_cfg.get('block_budget_mb', 256),
+            workers=carbon_cfg.get('workers'),
+            writer=ProductWriter.from_config(config),
+        )
+        accounting.profiler = Profiler.from_config(config)
+        return accounting
+
+    def load_parcels(self, crs):
+        import geopandas as gpd
+
+        if self.parcels is None or not self.parcels.exists():
+            raise FileNotFoundError(f"Parcel polygons not found: {self.parcels} (set carbon.parcels)")
+        gdf = gpd.read_file(self.parcels)
+        if self.id_field and self.id_field not in gdf.columns:
+            raise ValueError(f"carbon.id_field {self.id_field!r} not in {self.parcels.name} "
+                             f"(columns: {', '.join(gdf.columns.drop('geometry'))})")
+        return gdf.to_crs(crs) if gdf.crs != crs else gdf
+
+    def labels_key(self, grid):
+        """Cache key: parcel file(s) + id field + product grid"""
+        crs, transform, width, height = grid
+        h = hashlib.sha256()
+        # a shapefile's geometry and attributes live in its sidecar files
+        for f in sorted(self.parcels.parent.glob(self.parcels.stem + ".*")):
+            st = f.stat()
+            h.update(f"{f.name}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+        h.update(json.dumps([self.id_field, crs.to_wkt(), list(transform), width, height]).encode())
+        return h.hexdigest()[:16]
+
+    def label_raster(self, readers, gdf):
+        """Parcel index + 1 per pixel (0 = no parcel), rasterized once per grid"""
+        grid = (readers.crs, readers.transform, readers.width, readers.height)
+        path = self.cache_dir / f"parcel_labels_{self.labels_key(grid)}.tif"
+        if path.exists():
+            print(f"  ✓ Parcel labels (cached): {path.name}")
+            return path
+
+        from shapely import STRtree, box
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        for old in self.cache_dir.glob("parcel_labels_*.tif"):
+            old.unlink()  # only the current grid's labels are worth keeping
+
+        geoms = gdf.geometry.values
+        tree = STRtree(geoms)
+        profile = {**readers.profile, 'count': 1, 'dtype': 'uint32', 'nodata': None}
+        block_rows = rows_per_block(readers.width, 4, self.budget_bytes, 2 * self.workers)
+        if len(gdf) >= 2**32 - 1:
+            raise ValueError(f"Too many parcels for a uint32 label raster: {len(gdf)}")
+
+        # later parcels win where polygons overlap
+        def label_block(window):
+            transform = rasterio.windows.transform(window, readers.transform)
+            hits = np.sort(tree.query(box(*rasterio.windows.bounds(window, readers.transform))))
+            if len(hits) == 0:
+                return np.zeros((window.height, window.width), dtype='uint32')
+            return rasterize(((geoms[k], k + 1) for k in hits), out_shape=(window.height, window.width),
+                             transform=transform, fill=0, dtype='uint32')
+
+        with ProductWriter(codec="deflate", overviews=False).open(path, profile, kind="class") as dst:
+            process_blocks(
+                block_windows(readers.height, readers.width, block_rows),
+                label_block,
+                lambda window, labels: dst.write(labels, 1, window=window),
+                workers=self.workers,
+            )
+        print(f"  ✓ Parcel labels: {len(gdf)} parcels → {path.name}")
+        return path
+
+    @profiled("carbon_accounting", "stage")
+    def run(self, velocity_tif=None, quality_tif=None):
+        """Per-pixel emissions raster + per-parcel table; returns the output paths"""
+        print("\n▶ Carbon accounting...")
+        velocity_tif = Path(velocity_tif or self.products_dir / "subsidence_velocity.tif")
+        quality_tif = Path(quality_tif or self.products_dir / "quality_mask.tif")
+        emission_tif = self.products_dir / "carbon_emission.tif"
+
+        with rasterio.open(velocity_tif) as src:
+            crs = src.crs
+        gdf = self.load_parcels(crs)
+
+        with AlignedReaders([velocity_tif]) as grid:
+            labels_tif = self.label_raster(grid, gdf)
+        n = len(gdf)
+
+        inputs = [velocity_tif, quality_tif, labels_tif]
+        with AlignedReaders(inputs, reference=velocity_tif) as readers:
+            left, bottom, right, top = rasterio.transform.array_bounds(
+                readers.height, readers.width, readers.transform)
+            unit_m = metres_per_unit(readers.crs, (bottom + top) / 2)
+            pixel_ha = (abs(readers.transform.a) * unit_m[0] * abs(readers.transform.e) * unit_m[1]) / 1e4
+
+            # velocity + emission (float32), mask, labels (uint32) + bincount temporaries
+            block_rows = rows_per_block(readers.width, 4 + 4 + 1 + 4 + 8, self.budget_bytes, 2 * self.workers)
+            totals = {name: np.zeros(n + 1) for name in SUMS}
+
+            def account_block(window):
+                vel_src, mask_src, label_src = readers.datasets()
+                velocity = read_masked(vel_src, window)
+                valid = (mask_src.read(1, window=window) > 0) & np.isfinite(velocity)
+                labels = label_src.read(1, window=window).ravel()
+
+                # only sinking emits; uplift is noise or rewetting, counted as zero
+                emission = np.where(valid, np.maximum(-velocity, 0) * self.factor, np.nan).astype('float32')
+                v = valid.ravel()
+                sums = {
+                    "pixels": np.bincount(labels, minlength=n + 1),
+                    "valid": np.bincount(labels[v], minlength=n + 1),
+                    "emission": np.bincount(labels[v], emission.ravel()[v], n + 1),
+                    "velocity": np.bincount(labels[v], velocity.ravel()[v], n + 1),
+                }
+                return emission, sums
+
+            profile = {**readers.profile, 'count': 1, 'dtype': 'float32', 'nodata': np.nan}
+            with self.writer.open(emission_tif, profile) as dst:
+                def write_block(window, result):
+                    emission, sums = result
+                    dst.write(emission, 1, window=window)
+                    for name in SUMS:
+                        totals[name] += sums[name]
+
+                process_blocks(
+                    block_windows(readers.height, readers.width, block_rows),
+                    account_block,
+                    write_block,
+                    workers=self.workers,
+                )
+        print(f"  ✓ {emission_tif.name} (t CO₂/ha/yr)")
+
+        return {"emission": emission_tif, **self.write_table(gdf, totals, pixel_ha)}
+
+    def write_table(self, gdf, totals, pixel_ha):
+        """carbon_parcels.gpkg + .csv; rates are means over quality-masked pixels"""
+        t = {name: values[1:] for name, values in totals.items()}  # drop label 0 (no parcel)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rate = t["emission"] / t["valid"]
+            velocity = t["velocity"] / t["valid"]
+            coverage = t["valid"] / t["pixels"]
+
+        table = gdf.copy()
+        if self.id_field:
+            table = table[[self.id_field, 'geometry']]
+        else:
+            table = table[['geometry']]
+            table.insert(0, 'parcel_id', np.arange(1, len(gdf) + 1))
+        table['area_ha'] = (t["pixels"] * pixel_ha).round(2)
+        table['valid_ha'] = (t["valid"] * pixel_ha).round(2)
+        table['coverage'] = coverage.round(3)
+        table['subsidence_mm_yr'] = velocity.round(2)
+        table['t_co2_ha_yr'] = rate.round(3)
+        # parcel total, extrapolating the valid-pixel rate over the whole parcel
+        table['t_co2_yr'] = (rate * t["pixels"] * pixel_ha).round(1)
+
+        gpkg = self.products_dir / "carbon_parcels.gpkg"
+        csv = self.products_dir / "carbon_parcels.csv"
+        if gpkg.exists():
+            gpkg.unlink()
+        table.to_file(gpkg, layer="carbon_parcels", driver="GPKG")
+        table.drop(columns='geometry').to_csv(csv, index=False)
+
+        covered = t["valid"] > 0
+        print(f"  ✓ {gpkg.name}, {csv.name}: {covered.sum()}/{len(table)} parcels with valid pixels, "
+              f"{np.nansum(table['t_co2_yr']):,.0f} t CO₂/yr in total")
+        return {"parcels_gpkg": gpkg, "parcels_csv": csv}
+
+
+if __name__ == "__main__":
+    import yaml
+
+    with open("config.yaml", 'r') as f:
+        config = yaml.safe_load(f)
+    accounting = CarbonAccounting.from_config(config)
+    accounting.run()
+    accounting.profiler.save("carbon")
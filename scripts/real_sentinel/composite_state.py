@@ -0,0 +1,289 @@
+"""
+Persistent per-pixel composite state for incremental VV updates
+
+The state keeps, for every pixel, a histogram of quantized dB values across
+all scenes in the composite (a uint8 memory-mapped array of shape
+(bins, rows, cols)) plus each scene's quantized raster. Adding or removing a
+scene touches only that scene's pixels; the median is read back from the
+histograms without revisiting the rest of the stack.
+
+Updates are journalled: a scene's quantized raster is written first, then
+state.json records the change as pending, then the histograms are updated
+and the change committed. A state opened with a change still pending (a
+crash or Ctrl-C mid-update) has its histograms rebuilt from the stored
+scene rasters, completing the change, so no scene is ever counted twice.
+"""
+
+import json
+import os
+import shutil
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+import rasterio
+
+from raster_blocks import AlignedReaders, block_windows, open_raster, rows_per_block, read_masked
+from product_writer import ProductWriter
+
+STATE_NAME = "state.json"
+HIST_NAME = "hist.npy"
+NODATA_BIN = 255
+STATE_VERSION = 2  # 2: journalled updates
+
+
+class CompositeState:
+    def __init__(self, state_dir):
+        """Open an existing composite state folder"""
+        self.state_dir = Path(state_dir)
+        self.scene_dir = self.state_dir / "scenes"
+        with open(self.state_dir / STATE_NAME, 'r') as f:
+            self.meta = json.load(f)
+        self.hist = np.load(self.state_dir / HIST_NAME, mmap_mode='r+')
+
+        if self.meta.get("pending") is not None:
+            self._recover()
+        elif self.meta.get("version", 1) < STATE_VERSION:
+            # written before journalling: an interrupted update may have double-counted a scene
+            if not self.counts_match():
+                print("  ⚠ Composite histograms do not match the stored scenes, rebuilding")
+                self.rebuild()
+            self.meta["version"] = STATE_VERSION
+            self._save_meta()
+
+    @classmethod
+    def create(cls, state_dir, reference_img, range_db=(-35.0, 5.0), bin_db=0.25):
+        """Initialise an empty state on the grid of a reference raster"""
+        state_dir = Path(state_dir)
+        lo, hi = range_db
+        n_bins = int(np.ceil((hi - lo) / bin_db))
+        if n_bins >= NODATA_BIN:
+            raise ValueError(f"{n_bins} bins; widen bin_db so there are fewer than {NODATA_BIN}")
+
+        with open_raster(reference_img) as ref:
+            profile = ref.profile
+            grid = {
+                "crs": ref.crs.to_wkt() if ref.crs else None,
+                "transform": list(ref.transform)[:6],
+                "width": ref.width,
+                "height": ref.height,
+            }
+
+        state_dir.mkdir(parents=True, exist_ok=True)
+        (state_dir / "scenes").mkdir(exist_ok=True)
+        np.lib.format.open_memmap(
+            state_dir / HIST_NAME, mode='w+', dtype='uint8',
+            shape=(n_bins, profile['height'], profile['width'])
+        ).flush()
+
+        meta = {
+            "version": STATE_VERSION,
+            "grid": grid,
+            "range_db": [lo, hi],
+            "bin_db": bin_db,
+            "n_bins": n_bins,
+            "scenes": {},
+            "pending": None,
+        }
+        with open(state_dir / STATE_NAME, 'w') as f:
+            json.dump(meta, f, indent=2)
+
+        print(f"  Created composite state: {n_bins} bins × {grid['width']}x{grid['height']} px")
+        return cls(state_dir)
+
+    @classmethod
+    def open_or_create(cls, state_dir, reference_img, **kwargs):
+        if (Path(state_dir) / STATE_NAME).exists():
+            return cls(state_dir)
+        return cls.create(state_dir, reference_img, **kwargs)
+
+    @property
+    def scenes(self):
+        return self.meta["scenes"]
+
+    @property
+    def profile(self):
+        grid = self.meta["grid"]
+        return {
+            'driver': 'GTiff',
+            'dtype': 'float32',
+            'count': 1,
+            'width': grid["width"],
+            'height': grid["height"],
+            'crs': grid["crs"],
+            'transform': rasterio.Affine(*grid["transform"]),
+            'nodata': np.nan,
+        }
+
+    def _save_meta(self):
+        tmp = self.state_dir / (STATE_NAME + ".tmp")
+        with open(tmp, 'w') as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp, self.state_dir / STATE_NAME)
+
+    def _block_rows(self):
+        # histogram rows dominate: n_bins bytes per pixel, ~64 MB per block
+        return rows_per_block(self.meta["grid"]["width"], self.meta["n_bins"] + 8, 64 * 1024**2)
+
+    def _quantize(self, values):
+        lo, _ = self.meta["range_db"]
+        q = np.floor((values - lo) / self.meta["bin_db"])
+        q = np.clip(q, 0, self.meta["n_bins"] - 1)
+        q[np.isnan(values)] = NODATA_BIN
+        return q.astype('uint8')
+
+    def _apply(self, quantized, window, delta):
+        valid = quantized != NODATA_BIN
+        rows, cols = np.nonzero(valid)
+        block = self.hist[:, window.row_off:window.row_off + window.height, :]
+        # each (row, col) appears once, so fancy-index += is safe
+        if delta > 0:
+            block[quantized[valid], rows, cols] += 1
+        else:
+            block[quantized[valid], rows, cols] -= 1
+
+    def add_scene(self, scene_id, img_path, acq_date):
+        """Fold one processed scene into the histograms (O(one scene))"""
+        if scene_id in self.scenes:
+            print(f"  Already in composite: {scene_id}")
+            return False
+        if len(self.scenes) >= NODATA_BIN - 1:
+            raise RuntimeError("Composite state holds at most 254 scenes; prune the window first")
+
+        grid = self.meta["grid"]
+        quantized = np.lib.format.open_memmap(
+            self.scene_dir / f"{scene_id}.npy", mode='w+', dtype='uint8',
+            shape=(grid["height"], grid["width"])
+        )
+
+        # Align the scene onto the state grid, not onto itself
+        state_grid = (
+            rasterio.crs.CRS.from_wkt(grid["crs"]) if grid["crs"] else None,
+            rasterio.Affine(*grid["transform"]),
+            grid["width"],
+            grid["height"],
+        )
+        with AlignedReaders([img_path], grid=state_grid) as readers:
+            for window in block_windows(grid["height"], grid["width"], self._block_rows()):
+                q = self._quantize(read_masked(readers.datasets()[0], window))
+                quantized[window.row_off:window.row_off + window.height] = q
+        quantized.flush()
+        del quantized
+
+        entry = {"date": str(acq_date), "source": str(img_path)}
+        self._begin("add", scene_id, entry)
+        self._apply_scene(scene_id, +1)
+        self.scenes[scene_id] = entry
+        self._commit()
+        print(f"  + {scene_id} ({acq_date})")
+        return True
+
+    def remove_scene(self, scene_id):
+        """Subtract one scene from the histograms using its stored quantized raster"""
+        if scene_id not in self.scenes:
+            raise KeyError(f"Scene not in composite: {scene_id}")
+
+        self._begin("remove", scene_id)
+        self._apply_scene(scene_id, -1)
+        acq_date = self.scenes.pop(scene_id)["date"]
+        self._commit()
+        (self.scene_dir / f"{scene_id}.npy").unlink(missing_ok=True)
+        print(f"  - {scene_id} ({acq_date})")
+
+    def _apply_scene(self, scene_id, delta):
+        quantized = np.load(self.scene_dir / f"{scene_id}.npy", mmap_mode='r')
+        grid = self.meta["grid"]
+        for window in block_windows(grid["height"], grid["width"], self._block_rows()):
+            q = np.asarray(quantized[window.row_off:window.row_off + window.height])
+            self._apply(q, window, delta)
+        self.hist.flush()
+
+    # ---------- journal ----------
+
+    def _begin(self, op, scene_id, entry=None):
+        self.meta["pending"] = {"op": op, "scene": scene_id, **(entry or {})}
+        self._save_meta()
+
+    def _commit(self):
+        self.meta["pending"] = None
+        self._save_meta()
+
+    def _recover(self):
+        """Finish the update an interrupted run left pending (rebuilding the histograms)"""
+        pending = self.meta["pending"]
+        scene_id = pending["scene"]
+        if pending["op"] == "add":
+            # its quantized raster was complete before the change was recorded
+            self.scenes[scene_id] = {"date": pending["date"], "source": pending["source"]}
+        else:
+            self.scenes.pop(scene_id, None)
+        print(f"  ⚠ Composite update of {scene_id} was interrupted, rebuilding histograms")
+        self.rebuild()
+        self._commit()
+        if pending["op"] == "remove":
+            (self.scene_dir / f"{scene_id}.npy").unlink(missing_ok=True)
+
+    def _scene_rasters(self):
+        return [np.load(self.scene_dir / f"{sid}.npy", mmap_mode='r') for sid in self.scenes]
+
+    def rebuild(self):
+        """Recompute the histograms from the stored quantized scene rasters"""
+        grid = self.meta["grid"]
+        rasters = self._scene_rasters()
+        for window in block_windows(grid["height"], grid["width"], self._block_rows()):
+            self.hist[:, window.row_off:window.row_off + window.height, :] = 0
+            for quantized in rasters:
+                q = np.asarray(quantized[window.row_off:window.row_off + window.height])
+                self._apply(q, window, +1)
+        self.hist.flush()
+
+    def counts_match(self):
+        """True if every pixel's histogram total equals its number of valid scenes"""
+        grid = self.meta["grid"]
+        rasters = self._scene_rasters()
+        for window in block_windows(grid["height"], grid["width"], self._block_rows()):
+            rows = slice(window.row_off, window.row_off + window.height)
+            total = self.hist[:, rows, :].sum(axis=0, dtype='uint16')
+            valid = sum((np.asarray(q[rows]) != NODATA_BIN).astype('uint16') for q in rasters)
+            if not np.array_equal(total, valid if rasters else np.zeros_like(total)):
+                return False
+        return True
+
+    def prune(self, window_days, latest=None):
+        """Drop scenes older than the rolling window (relative to the newest scene)"""
+        if not window_days or not self.scenes:
+            return []
+        latest = latest or max(date.fromisoformat(s["date"]) for s in self.scenes.values())
+        cutoff = latest - timedelta(days=window_days)
+        expired = [sid for sid, s in self.scenes.items() if date.fromisoformat(s["date"]) < cutoff]
+        for sid in expired:
+            self.remove_scene(sid)
+        return expired
+
+    def write_median(self, output_tif, writer=None):
+        """Median per pixel from the cumulative histograms (bin-centre precision)"""
+        lo, _ = self.meta["range_db"]
+        bin_db = self.meta["bin_db"]
+        grid = self.meta["grid"]
+
+        with (writer or ProductWriter()).open(output_tif, self.profile) as dst:
+            for window in block_windows(grid["height"], grid["width"], self._block_rows()):
+                counts = self.hist[:, window.row_off:window.row_off + window.height, :]
+                cum = np.cumsum(counts, axis=0, dtype='uint16')
+                total = cum[-1]
+
+                # lower and upper middle ranks; equal when the count is odd
+                lower = np.argmax(cum >= ((total + 1) // 2)[None], axis=0)
+                upper = np.argmax(cum >= (total // 2 + 1)[None], axis=0)
+                median = lo + ((lower + upper) / 2 + 0.5) * bin_db
+
+                median = median.astype('float32')
+                median[total == 0] = np.nan
+                dst.write(median, 1, window=window)
+
+        return output_tif
+
+    def reset(self):
+        """Delete the state folder"""
+        del self.hist
+        shutil.rmtree(self.state_dir)
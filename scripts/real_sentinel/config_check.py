@@ -0,0 +1,159 @@
+"""
+Up-front validation of a site config
+
+Checks the keys, values and input paths the requested stages will need, so a
+typo or a missing SAFE folder fails before any processing starts instead of
+an hour into a run. Only the standard library is used: validating a config
+must not pay for importing the raster stack.
+"""
+
+import importlib.util
+from pathlib import Path
+
+from remote_inputs import is_remote
+
+# stage → products it reads from earlier stages
+STAGE_INPUTS = {
+    "canals": ["vv_median.tif", "subsidence_velocity.tif"],
+    "carbon": ["subsidence_velocity.tif"],
+    "maps": ["subsidence_velocity.tif"],
+    "report": [],
+}
+
+# fsspec protocol → package implementing it (remote inputs)
+REMOTE_BACKENDS = {"s3": "s3fs", "gs": "gcsfs", "gcs": "gcsfs", "az": "adlfs", "abfs": "adlfs"}
+
+
+class ConfigError(ValueError):
+    def __init__(self, config_path, problems):
+        self.problems = problems
+        super().__init__(f"{config_path}: {len(problems)} problem(s)\n"
+                         + "\n".join(f"  - {p}" for p in problems))
+
+
+def site_name(config_path):
+    """Site id of a config: its file name, or its folder for sites/<site>/config.yaml"""
+    path = Path(config_path).resolve()
+    return path.parent.name if path.stem == "config" else path.stem
+
+
+def site_names(config_paths):
+    """{config path: site id} for several sites; ValueError if two map to the same id"""
+    names, seen = {}, {}
+    for config_path in config_paths:
+        resolved = Path(config_path).resolve()
+        if resolved in seen.values():
+            continue
+        name = site_name(resolved)
+        if name in seen:
+            raise ValueError(f"Configs {seen[name]} and {resolved} are both site {name!r}; "
+                             f"rename one of them")
+        seen[name] = resolved
+        names[config_path] = name
+    return names
+
+
+def _get(config, dotted):
+    value = config
+    for part in dotted.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def check_config(config, stages, config_path="config.yaml", check_inputs=True):
+    """Raise ConfigError listing every problem the given stages would hit
+
+    check_inputs=False skips the existence checks of input data and tools
+    (a dry-run plan reports those per step instead).
+    """
+    problems = []
+
+    def require(dotted, kind=None):
+        value = _get(config, dotted)
+        if value is None:
+            problems.append(f"{dotted} is not set")
+        elif kind is not None and not isinstance(value, kind):
+            problems.append(f"{dotted} must be a {kind.__name__ if isinstance(kind, type) else 'number'}, "
+                            f"got {value!r}")
+        return value
+
+    def exists(dotted, path, what="file"):
+        if path and is_remote(path):
+            # fetched at run time (remote_inputs); only the fsspec backend is checked here
+            protocol = str(path).partition("://")[0]
+            for package in ("fsspec", REMOTE_BACKENDS.get(protocol)):
+                if package and importlib.util.find_spec(package) is None:
+                    problems.append(f"{dotted}: {protocol}:// inputs need the {package} package")
+        elif check_inputs and path and not Path(path).exists():
+            problems.append(f"{dotted}: {what} not found: {path}")
+
+    def one_of(dotted, default, allowed):
+        value = _get(config, dotted)
+        if value is not None and value not in allowed:
+            problems.append(f"{dotted} must be one of {', '.join(map(repr, allowed))}, got {value!r}")
+        return value if value is not None else default
+
+    if not isinstance(config, dict):
+        raise ConfigError(config_path, ["not a YAML mapping"])
+
+    for key in ("products", "reports", "temp"):
+        require(f"output.{key}", str)
+
+    if {"slc", "grd"} & set(stages):
+        exists("snap.gpt_path", require("snap.gpt_path", str), "SNAP GPT")
+        require("snap.cache_size_gb", (int, float))
+        one_of("snap.graph_mode", "stepwise", ("fused", "stepwise"))
+
+    if "slc" in stages:
+        stack = _get(config, "sentinel1.slc_stack") or []
+        if stack:
+            if len(stack) < 2:
+                problems.append("sentinel1.slc_stack needs at least two SLC scenes")
+            for i, slc in enumerate(stack):
+                exists(f"sentinel1.slc_stack[{i}]", slc, "SLC")
+            one_of("stack.pairing", "sequential", ("sequential", "sbas"))
+        else:
+            for key in ("slc_master", "slc_slave"):
+                exists(f"sentinel1.{key}", require(f"sentinel1.{key}", str), "SLC")
+        for key in ("subswath", "polarization"):
+            require(f"processing.{key}", str)
+        one_of("processing.subswath", "IW2", ("IW1", "IW2", "IW3"))
+        dem = _get(config, "dem.path") or "auto"
+        if dem != "auto":
+            exists("dem.path", dem, "DEM")
+        exists("snaphu.path", _get(config, "snaphu.path"), "SNAPHU")
+        for i, area in enumerate(_get(config, "aoi.areas") or []):
+            path = area if isinstance(area, str) else area.get("path") if isinstance(area, dict) else None
+            exists(f"aoi.areas[{i}]", path, "AOI file")
+
+    if "grd" in stages:
+        grd_files = require("sentinel1.grd_files", list) or []
+        if isinstance(grd_files, list) and not grd_files:
+            problems.append("sentinel1.grd_files is empty")
+        for i, grd in enumerate(grd_files if isinstance(grd_files, list) else []):
+            exists(f"sentinel1.grd_files[{i}]", grd, "GRD")
+
+    if {"slc", "canals", "maps", "report"} & set(stages):
+        threshold = require("processing.coherence_threshold", (int, float))
+        if isinstance(threshold, (int, float)) and not 0 <= threshold <= 1:
+            problems.append(f"processing.coherence_threshold must be within 0-1, got {threshold}")
+
+    if "carbon" in stages:
+        exists("carbon.parcels", require("carbon.parcels", str), "parcel file")
+
+    if {"maps", "report"} & set(stages):
+        require("viz.dpi", (int, float))
+
+    # products of earlier stages, when those stages are not part of this run
+    products = _get(config, "output.products")
+    if check_inputs and isinstance(products, str):
+        for stage in stages:
+            for name in STAGE_INPUTS.get(stage, []):
+                producer = "grd" if name.startswith("vv_") else "slc"
+                if producer not in stages and not (Path(products) / name).exists():
+                    problems.append(f"{stage} needs {name} in output.products (run {producer} first)")
+
+    if problems:
+        raise ConfigError(config_path, problems)
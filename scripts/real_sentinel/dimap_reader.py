@@ -0,0 +1,207 @@
+"""
+Memory-mapped BEAM-DIMAP band reader
+
+SNAP writes every band of a BEAM-DIMAP product as a raw ENVI file
+(<product>.data/<band>.img + .hdr, big-endian, band-sequential). Instead of
+decoding it through GDAL, a band is exposed as a read-only numpy.memmap:
+slicing a window only pages in the rows it touches, and view() hands that
+slice to numpy code without any copy.
+
+Dimensions, data type, byte order and georeferencing come from the .hdr
+(map info / coordinate system string, as GDAL's ENVI driver reads them),
+falling back to the .dim; no-data comes from the .dim band info. DimapBand
+mimics the parts of a rasterio dataset the block readers use.
+"""
+
+import re
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+
+# ENVI "data type" codes → numpy
+ENVI_DTYPES = {
+    1: 'uint8', 2: 'int16', 3: 'int32', 4: 'float32', 5: 'float64',
+    6: 'complex64', 9: 'complex128', 12: 'uint16', 13: 'uint32', 14: 'int64', 15: 'uint64',
+}
+
+HDR_FIELD = re.compile(r"^\s*([^=]+?)\s*=\s*(.*)$")
+
+
+class DimapError(ValueError):
+    pass
+
+
+def parse_hdr(hdr_path):
+    """ENVI header fields (lower-case keys; {...} values unwrapped, may span lines)"""
+    fields = {}
+    text = Path(hdr_path).read_text(errors='replace')
+    if not text.lstrip().startswith("ENVI"):
+        raise DimapError(f"Not an ENVI header: {hdr_path}")
+
+    key, value = None, None
+    for line in text.splitlines()[1:]:
+        if key is not None:  # inside a multi-line {...}
+            value += " " + line.strip()
+        else:
+            match = HDR_FIELD.match(line)
+            if not match:
+                continue
+            key, value = match.group(1).lower(), match.group(2).strip()
+        if value.startswith("{") and not value.endswith("}"):
+            continue
+        fields[key] = value[1:-1].strip() if value.startswith("{") else value
+        key, value = None, None
+    return fields
+
+
+def map_info_georef(fields):
+    """(crs, transform) from ENVI map info / coordinate system string, or (None, None)"""
+    info = fields.get("map info")
+    if not info:
+        return None, None
+    parts = [p.strip() for p in info.split(",")]
+    try:
+        ref_x, ref_y, easting, northing, dx, dy = (float(v) for v in parts[1:7])
+    except (ValueError, IndexError):
+        return None, None
+
+    if any(p.lower().startswith("rotation=") and float(p.split("=")[1]) for p in parts):
+        raise DimapError("rotated map info")  # SNAP grids are north-up; leave these to GDAL
+
+    # the tie point is the upper-left corner of 1-based pixel (ref_x, ref_y)
+    transform = rasterio.Affine(dx, 0, easting - (ref_x - 1) * dx,
+                                0, -dy, northing + (ref_y - 1) * dy)
+
+    crs = None
+    wkt = fields.get("coordinate system string")
+    if wkt:
+        crs = CRS.from_wkt(wkt)
+    elif parts[0].lower().startswith("geographic lat/lon"):
+        crs = CRS.from_epsg(4326)
+    elif parts[0].upper() == "UTM" and len(parts) > 8:
+        zone, hemisphere = int(parts[7]), parts[8].lower()
+        crs = CRS.from_epsg((32700 if hemisphere.startswith("s") else 32600) + zone)
+    return crs, transform
+
+
+def dim_path_for(img_path):
+    """<product>.dim of a <product>.data/<band>.img"""
+    data_dir = Path(img_path).parent
+    return data_dir.parent / (data_dir.name[:-len(".data")] + ".dim") if data_dir.name.endswith(".data") else None
+
+
+def dim_band_info(dim_path, band_file):
+    """(nodata, crs, transform) the .dim records for one band file"""
+    root = ET.parse(dim_path).getroot()
+    index = None
+    for data_file in root.iter("Data_File"):
+        href = data_file.find("DATA_FILE_PATH").get("href", "")
+        if Path(href).stem == Path(band_file).stem:
+            index = data_file.findtext("BAND_INDEX")
+            break
+
+    nodata = None
+    for band in root.iter("Spectral_Band_Info"):
+        if band.findtext("BAND_INDEX") == index:
+            if (band.findtext("NO_DATA_VALUE_USED") or "").strip().lower() == "true":
+                nodata = float(band.findtext("NO_DATA_VALUE"))
+            break
+
+    crs = None
+    wkt = root.findtext(".//Coordinate_Reference_System/WKT")
+    if wkt and wkt.strip():
+        crs = CRS.from_wkt(wkt.strip())
+    transform = None
+    i2m = root.findtext(".//Geoposition/IMAGE_TO_MODEL_TRANSFORM")
+    if i2m:
+        # java AffineTransform order: m00, m10, m01, m11, m02, m12
+        m00, m10, m01, m11, m02, m12 = (float(v) for v in i2m.split(","))
+        transform = rasterio.Affine(m00, m01, m02, m10, m11, m12)
+    return nodata, crs, transform
+
+
+class DimapBand:
+    def __init__(self, img_path):
+        """Read-only memmap of one BEAM-DIMAP band (.img with its .hdr)"""
+        self.name = str(img_path)
+        img_path = Path(img_path)
+        fields = parse_hdr(img_path.with_suffix(".hdr"))
+
+        try:
+            self.width = int(fields["samples"])
+            self.height = int(fields["lines"])
+            bands = int(fields.get("bands", 1))
+            dtype = ENVI_DTYPES[int(fields["data type"])]
+        except (KeyError, ValueError) as e:
+            raise DimapError(f"Unsupported ENVI header {img_path.with_suffix('.hdr')}: {e}") from None
+        if bands != 1 and fields.get("interleave", "bsq").lower() != "bsq":
+            raise DimapError(f"{img_path.name}: only band-sequential files are memory-mapped")
+
+        # SNAP writes big-endian (byte order = 1)
+        order = ">" if fields.get("byte order", "0").strip() == "1" else "<"
+        self.dtype = dtype
+        self.count = bands
+        self.array = np.memmap(img_path, dtype=np.dtype(dtype).newbyteorder(order), mode='r',
+                               offset=int(fields.get("header offset", 0)),
+                               shape=(bands, self.height, self.width))
+
+        self.crs, self.transform = map_info_georef(fields)
+        ignore = fields.get("data ignore value")
+        self.nodata = float(ignore) if ignore else None
+
+        dim_path = dim_path_for(img_path)
+        if dim_path is not None and dim_path.is_file():
+            nodata, crs, transform = dim_band_info(dim_path, img_path)
+            self.nodata = nodata if nodata is not None else self.nodata
+            self.crs = self.crs or crs
+            self.transform = self.transform or transform
+        self.transform = self.transform or rasterio.Affine.identity()
+
+    @property
+    def profile(self):
+        return {
+            'driver': 'ENVI', 'dtype': self.dtype, 'nodata': self.nodata,
+            'width': self.width, 'height': self.height, 'count': self.count,
+            'crs': self.crs, 'transform': self.transform,
+        }
+
+    def view(self, window=None, band=1):
+        """Zero-copy (file byte order) slice of a band; only touched rows are paged in"""
+        if window is None:
+            return self.array[band - 1]
+        (r0, r1), (c0, c1) = window.toranges()
+        return self.array[band - 1, int(r0):int(r1), int(c0):int(c1)]
+
+    def read(self, indexes=1, window=None, out_dtype=None, out=None):
+        """rasterio-style read: a native-order copy of the window"""
+        if not isinstance(indexes, int):
+            return np.stack([self.read(i, window, out_dtype) for i in indexes])
+        data = self.view(window, indexes)
+        dtype = np.dtype(out_dtype or self.dtype)
+        if out is not None:
+            out[...] = data
+            return out
+        return data.astype(dtype)
+
+    def close(self):
+        self.array = None  # the mapping closes once no view references it
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_band(path):
+    """DimapBand for a SNAP .img band, None for anything that is not one"""
+    path = Path(path)
+    if path.suffix.lower() != ".img" or not path.with_suffix(".hdr").is_file():
+        return None
+    try:
+        return DimapBand(path)
+    except (DimapError, OSError, ValueError):
+        return None  # e.g. compressed or unusual layout: let GDAL read it
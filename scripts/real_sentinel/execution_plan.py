@@ -0,0 +1,134 @@
+"""
+Dry-run execution plans
+
+With a plan attached (processor.plan), the pipelines build their usual job
+DAG but run nothing: every GPT step resolves its command line, cache key and
+cache status and records it here, SNAPHU and the Python stages record what
+they would write, and each step hands the path its output would have to the
+steps after it. Expected sizes come from the step cache's history.
+
+A step reading an output that is still to be produced is checked against the
+cache through the key in that output's path; outside the cache (cache
+disabled) its key depends on files that do not exist yet, so it is counted
+as a run.
+"""
+
+import os
+import shlex
+import subprocess
+import threading
+
+from remote_inputs import is_remote
+from step_cache import producer_key, product_size
+
+
+def command_line(cmd):
+    """A command as it would be typed into this platform's shell"""
+    cmd = [str(c) for c in cmd]
+    return subprocess.list2cmdline(cmd) if os.name == "nt" else shlex.join(cmd)
+
+
+def size_text(size):
+    if size is None:
+        return "?"
+    return f"{size / 1024**3:.1f} GB" if size >= 1024**3 else f"{size / 1024**2:.0f} MB"
+
+
+class PlannedStep:
+    def __init__(self, name, kind, commands, output, cached=False, size=None, note=None):
+        self.name = name
+        self.kind = kind  # "gpt", "snaphu", "python" or "fetch"
+        self.commands = commands
+        self.output = output
+        self.cached = cached
+        self.size = size  # expected output bytes, None if never run before
+        self.note = note
+
+
+class ExecutionPlan:
+    def __init__(self, cache):
+        """Collects the steps a pipeline run would execute (from any thread)"""
+        self.cache = cache
+        self.steps = []
+        self.pending = set()  # outputs the plan has yet to produce
+        self.fetched = set()  # remote inputs already planned
+        self._lock = threading.Lock()
+
+    def waits_on(self, params):
+        """True if any parameter is an output still to be produced outside the cache"""
+        return any(str(v) in self.pending and producer_key(v) is None for v in params.values())
+
+    def cached_step(self, name, kind, graphs, output_name, params, work_dir, build_cmds, note=None):
+        """Plan a cached step (GPT graph, or export → SNAPHU → import); returns its output path
+
+        build_cmds(output) gives the command lines the step would run.
+        """
+        try:
+            key = self.cache.key(graphs, params)
+        except OSError as e:
+            key, note = None, f"graph not readable: {e.filename}"
+        cached = None
+        if key is not None and not self.waits_on(params):
+            cached = self.cache.lookup(key, output_name, touch=False)
+        output = cached or self.cache.planned_path(key, output_name, work_dir)
+        return self.add(name, kind, build_cmds(output), output, cached is not None, note=note)
+
+    def add(self, name, kind, commands, output, cached=False, size=None, note=None):
+        """Record a step; returns its output"""
+        if size is None:
+            paths = output if isinstance(output, (list, tuple)) else [output]
+            if cached:
+                size = sum(product_size(p) for p in paths)
+            else:
+                size = self.cache.typical_size(name)
+        with self._lock:
+            self.steps.append(PlannedStep(name, kind, commands, output, cached, size, note))
+            if not cached:
+                paths = output if isinstance(output, (list, tuple)) else [output]
+                self.pending.update(str(p) for p in paths)
+        return output
+
+    def fetch(self, inputs, path):
+        """Record fetching a remote input into the RemoteInputs cache (once); returns its local path"""
+        if not is_remote(path):
+            return path
+        with self._lock:
+            if path in self.fetched:
+                return inputs.local_path(path)
+            self.fetched.add(path)
+        return self.add(f"fetch {path}", "fetch", [], inputs.local_path(path), inputs.is_cached(path))
+
+    def python(self, name, output, note=None):
+        """Record an in-process stage (compositing, extraction, inversion)"""
+        return self.add(name, "python", [], output, note=note)
+
+    def report(self):
+        """Print every planned step, then cache hits and the data a run would write"""
+        print("\n" + "=" * 50)
+        print("EXECUTION PLAN (nothing was run)")
+        print("=" * 50)
+        for i, step in enumerate(self.steps, 1):
+            status = "cached" if step.cached else "run"
+            print(f"\n[{i}] {step.name} ({step.kind}, {status}, {size_text(step.size)})")
+            outputs = step.output if isinstance(step.output, (list, tuple)) else [step.output]
+            for output in outputs:
+                print(f"    → {output}")
+            for cmd in step.commands:
+                print(f"    $ {command_line(cmd) if isinstance(cmd, (list, tuple)) else cmd}")
+            if step.note:
+                print(f"    ⚠ {step.note}")
+
+        gpt = [s for s in self.steps if s.kind == "gpt"]
+        to_run = [s for s in self.steps if not s.cached]
+        known = [s.size for s in to_run if s.size is not None]
+        print(f"\n  {len(gpt)} GPT calls, {sum(s.cached for s in gpt)} cached; "
+              f"{len(to_run)} steps to run")
+        if known:
+            print(f"  Expected output of the steps to run: {size_text(sum(known))}"
+                  + (f" (+ {len(to_run) - len(known)} steps never run before)" if len(known) < len(to_run) else ""))
+        elif to_run:
+            print("  Expected output of the steps to run: unknown (none of them has run before)")
+        notes = [s for s in self.steps if s.note]
+        if notes:
+            print(f"  ⚠ {len(notes)} step(s) with problems (see ⚠ above)")
+        return self.steps
@@ -0,0 +1,195 @@
+"""
+DAG scheduler for SNAP GPT jobs
+
+Pipelines are described as jobs with dependencies; ready jobs run in parallel
+as long as their combined JVM memory fits in the machine's RAM budget.
+"""
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+
+def system_memory_gb():
+    """Physical RAM of this machine in GB"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024**3
+    except (ValueError, OSError, AttributeError):
+        pass
+
+    if sys.platform == "win32":
+        import ctypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [
+                ("dwLength", ctypes.c_ulong),
+                ("dwMemoryLoad", ctypes.c_ulong),
+                ("ullTotalPhys", ctypes.c_ulonglong),
+                ("ullAvailPhys", ctypes.c_ulonglong),
+                ("ullTotalPageFile", ctypes.c_ulonglong),
+                ("ullAvailPageFile", ctypes.c_ulonglong),
+                ("ullTotalVirtual", ctypes.c_ulonglong),
+                ("ullAvailVirtual", ctypes.c_ulonglong),
+                ("sullAvailExtendedVirtual", ctypes.c_ulonglong),
+            ]
+
+        stat = MEMORYSTATUSEX()
+        stat.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(stat))
+        return stat.ullTotalPhys / 1024**3
+
+    return None
+
+
+class GPTJob:
+    def __init__(self, name, fn, deps=(), mem_gb=None):
+        """One node of the pipeline DAG; fn receives the results of deps in order"""
+        self.name = name
+        self.fn = fn
+        self.deps = list(deps)
+        self.mem_gb = mem_gb
+
+
+class JobScheduler:
+    def __init__(self, max_workers=None, job_mem_gb=8, mem_budget_gb=None, on_abort=None,
+                 intermediates=None):
+        """Scheduler bounded by worker count, total job memory and scratch disk
+
+        on_abort() is called when a job fails or on Ctrl-C, to cancel the
+        jobs still running (e.g. AsyncRunner.cancel_all kills their GPT trees).
+        intermediates (an Intermediates) deletes job outputs once their
+        dependants finish and holds new jobs above its high-water mark.
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.job_mem_gb = job_mem_gb
+        self.mem_budget_gb = mem_budget_gb
+        self.on_abort = on_abort
+        self.intermediates = intermediates
+        self.jobs = {}
+
+    @classmethod
+    def from_config(cls, config, on_abort=None, intermediates=None):
+        """Size the scheduler from the `snap` and `scheduler` sections of config.yaml"""
+        snap_cfg = config['snap']
+        sched_cfg = config.get('scheduler', {})
+
+        # GPT's tile cache (-c) lives inside the JVM heap, plus JVM overhead
+        job_mem_gb = snap_cfg.get('jvm_heap_gb', snap_cfg['cache_size_gb'] + 2)
+
+        total_gb = system_memory_gb()
+        mem_budget_gb = None
+        if total_gb is not None:
+            mem_budget_gb = max(total_gb - sched_cfg.get('memory_reserve_gb', 4), job_mem_gb)
+
+        return cls(
+            max_workers=sched_cfg.get('max_workers'),
+            job_mem_gb=job_mem_gb,
+            mem_budget_gb=mem_budget_gb,
+            on_abort=on_abort,
+            intermediates=intermediates,
+        )
+
+    @property
+    def max_concurrent(self):
+        """Upper bound on simultaneously running full-size GPT jobs"""
+        if self.mem_budget_gb is None:
+            return self.max_workers
+        return max(1, min(self.max_workers, int(self.mem_budget_gb // self.job_mem_gb)))
+
+    @property
+    def threads_per_job(self):
+        """GPT -q parallelism so concurrent JVMs don't oversubscribe the cores"""
+        return max(1, (os.cpu_count() or 1) // self.max_concurrent)
+
+    def add(self, name, fn, deps=(), mem_gb=None):
+        """Register a job; returns its name for use as a dependency"""
+        if name in self.jobs:
+            raise ValueError(f"Duplicate job: {name}")
+        for dep in deps:
+            if dep not in self.jobs:
+                raise ValueError(f"Job {name} depends on unknown job {dep}")
+        self.jobs[name] = GPTJob(name, fn, deps, self.job_mem_gb if mem_gb is None else mem_gb)
+        return name
+
+    def run(self):
+        """Run all jobs respecting dependencies and the memory budget"""
+        results = {}
+        pending = dict(self.jobs)
+        running = {}
+        mem_in_use = 0.0
+        error = None
+
+        start_time = datetime.now()
+        print(f"\n▶ Scheduling {len(pending)} jobs "
+              f"(≤{self.max_concurrent} concurrent, {self.job_mem_gb} GB/job)")
+
+        def fits(job):
+            if not running:
+                return True  # always let one job through, however large
+            if len(running) >= self.max_workers:
+                return False
+            if self.intermediates is not None and self.intermediates.over_high_water():
+                return False
+            if self.mem_budget_gb is None:
+                return True
+            return mem_in_use + job.mem_gb <= self.mem_budget_gb
+
+        if self.intermediates is not None:
+            self.intermediates.plan({name: job.deps for name, job in self.jobs.items()})
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                if error is None:
+                    ready = [j for j in pending.values() if all(d in results for d in j.deps)]
+                    for job in ready:
+                        if not fits(job):
+                            continue
+                        del pending[job.name]
+                        mem_in_use += job.mem_gb
+                        args = [results[d] for d in job.deps]
+                        running[pool.submit(self.call, job, args)] = job
+                elif not running:
+                    break
+
+                if not running:
+                    raise RuntimeError(f"Unschedulable jobs (dependency cycle?): {list(pending)}")
+
+                # while throttled on scratch space, re-check as running jobs free it
+                throttled = self.intermediates is not None and self.intermediates.throttled
+                try:
+                    done, _ = wait(running, timeout=10 if throttled else None, return_when=FIRST_COMPLETED)
+                except KeyboardInterrupt:
+                    print(f"\n⚠ Interrupted: cancelling {len(running)} running jobs")
+                    self.abort()
+                    raise
+
+                for future in done:
+                    job = running.pop(future)
+                    mem_in_use -= job.mem_gb
+                    try:
+                        results[job.name] = future.result()
+                        if self.intermediates is not None:
+                            self.intermediates.finish(job.name, results[job.name], job.deps)
+                    except Exception as e:
+                        print(f"❌ Job failed: {job.name}: {e}")
+                        if error is None:
+                            error = e
+                            self.abort()
+
+        if error is not None:
+            raise error
+
+        elapsed = (datetime.now() - start_time).total_seconds() / 60
+        print(f"✓ {len(results)} jobs complete ({elapsed:.1f} minutes)")
+        return results
+
+    def call(self, job, args):
+        if self.intermediates is None:
+            return job.fn(*args)
+        with self.intermediates.job(job.name):
+            return job.fn(*args)
+
+    def abort(self):
+        if self.on_abort is not None:
+            self.on_abort()
@@ -0,0 +1,249 @@
+"""
+Reference-counted intermediate products
+
+Every GPT output written during a scheduler run is attributed to the job
+that produced it. Inside a job a product is consumed by the next step that
+reads it (the chains are linear); a job's result is consumed by the jobs
+that depend on it. Once its last consumer has finished a product is deleted
+(through the step cache, so its entry goes too). Results of jobs nothing in
+the run depends on are left for the caller, which can release() them.
+Deleting does not cost later cache hits: downstream step keys come from
+the content-addressed paths of their inputs, not from the files themselves.
+
+While live intermediates exceed intermediates.high_water_gb (or the temp
+volume has less than min_free_gb free) the scheduler starts no new jobs, so
+running consumers can free space first. Steps whose earlier outputs were
+small can be written to a RAM-backed directory instead of the temp disk.
+"""
+
+import fnmatch
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from step_cache import product_size
+
+
+def product_paths(value):
+    """Paths inside a job result (a path, or tuples/lists/dicts of them)"""
+    if isinstance(value, (str, Path)):
+        return [Path(value)]
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return [p for v in value for p in product_paths(v)]
+    return []
+
+
+def remove_product(path):
+    """Delete a product: .dim + .data/, a folder, or a single file"""
+    path = Path(path)
+    if path.suffix == ".dim":
+        shutil.rmtree(path.parent / (path.stem + ".data"), ignore_errors=True)
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    elif path.exists():
+        path.unlink()
+
+
+class Product:
+    def __init__(self, path, job, size, ram=False):
+        self.path = path
+        self.job = job
+        self.size = size
+        self.ram = ram
+        self.refs = None  # consumers still to finish; None until its job has finished
+
+
+class Intermediates:
+    def __init__(self, temp_dir, cache=None, enabled=True, keep=(), high_water_gb=None,
+                 min_free_gb=None, ram_dir=None, ram_budget_gb=2, ram_max_mb=512):
+        """Track, throttle on and delete the intermediates of one pipeline run"""
+        self.temp_dir = Path(temp_dir)
+        self.cache = cache
+        self.enabled = enabled
+        self.keep = list(keep)
+        self.high_water = high_water_gb * 1024**3 if high_water_gb else None
+        self.min_free = min_free_gb * 1024**3 if min_free_gb else None
+        self.ram_dir = Path(ram_dir) if ram_dir else None
+        self.ram_budget = ram_budget_gb * 1024**3
+        self.ram_max = ram_max_mb * 1024**2
+
+        self.products = {}
+        self.dependants = {}
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self.throttled = False
+
+        self.live_bytes = 0
+        self.ram_bytes = 0
+        self.peak_bytes = 0
+        self.freed_bytes = 0
+        self.freed_count = 0
+        self.min_free_bytes = None
+        self._free_now = None
+
+    @classmethod
+    def from_config(cls, config, cache=None):
+        """Build from the `intermediates` section of config.yaml"""
+        im_cfg = config.get('intermediates', {})
+        return cls(
+            config['output']['temp'],
+            cache=cache,
+            enabled=im_cfg.get('delete_consumed', True),
+            keep=im_cfg.get('keep') or [],
+            high_water_gb=im_cfg.get('high_water_gb'),
+            min_free_gb=im_cfg.get('min_free_gb'),
+            ram_dir=im_cfg.get('ram_dir'),
+            ram_budget_gb=im_cfg.get('ram_budget_gb', 2),
+            ram_max_mb=im_cfg.get('ram_max_mb', 512),
+        )
+
+    # ---------- scheduler hooks ----------
+
+    def plan(self, jobs):
+        """{job name: deps} of the run about to start"""
+        with self._lock:
+            self.dependants = {name: 0 for name in jobs}
+            for deps in jobs.values():
+                for dep in deps:
+                    self.dependants[dep] += 1
+
+    @contextmanager
+    def job(self, name):
+        """Attribute products registered on this thread to job `name`"""
+        self._local.job = name
+        try:
+            yield
+        finally:
+            self._local.job = None
+
+    def finish(self, name, result, deps):
+        """Job done: drop its leftovers, count its result's consumers, release its inputs"""
+        results = {p for p in product_paths(result)}
+        with self._lock:
+            for product in [p for p in self.products.values() if p.job == name and p.refs is None]:
+                if product.path in results:
+                    product.refs = self.dependants.get(name, 0)
+                else:
+                    self._delete(product)  # in-job intermediate nothing consumed
+            for dep in deps:
+                self._release_job(dep)
+
+    def over_high_water(self):
+        """True while new jobs should wait for running ones to free scratch space"""
+        with self._lock:
+            self._sample_free()
+            over = ((self.high_water is not None and self.live_bytes > self.high_water)
+                    or (self.min_free is not None and self._free_now is not None
+                        and self._free_now < self.min_free))
+            if over and not self.throttled:
+                print(f"  ⚠ Scratch high-water mark: {self.live_bytes / 1024**3:.1f} GB of "
+                      f"intermediates live; holding new jobs until running ones free space")
+            self.throttled = over
+            return over
+
+    # ---------- producers / consumers ----------
+
+    def root_for(self, step):
+        """Folder a step's output goes to: the RAM dir if it has been small before, else None"""
+        if self.ram_dir is None or self.cache is None:
+            return None
+        size = self.cache.typical_size(step)
+        if size is None or size > self.ram_max:
+            return None
+        with self._lock:
+            if self.ram_bytes + size > self.ram_budget:
+                return None
+        try:
+            self.ram_dir.mkdir(parents=True, exist_ok=True)
+            if shutil.disk_usage(self.ram_dir).free < 2 * size:
+                return None
+        except OSError:
+            return None
+        return self.ram_dir
+
+    def produced(self, path):
+        """Register a product written (or reused from the cache) by the current job"""
+        name = getattr(self._local, "job", None)
+        if name is None or path is None:
+            return
+        path = Path(path)
+        with self._lock:
+            if path in self.products or not path.exists():
+                return
+            ram = self.ram_dir is not None and path.is_relative_to(self.ram_dir)
+            product = Product(path, name, product_size(path), ram)
+            self.products[path] = product
+            self.live_bytes += product.size
+            self.ram_bytes += product.size if ram else 0
+            self.peak_bytes = max(self.peak_bytes, self.live_bytes)
+            self._sample_free()
+
+    def consumed(self, inputs):
+        """A step of the current job finished reading `inputs` (paths or -P values)"""
+        name = getattr(self._local, "job", None)
+        if name is None:
+            return
+        with self._lock:
+            for value in inputs:
+                product = self.products.get(Path(str(value)))
+                # chains are linear: the next in-job reader is the only one
+                if product is not None and product.job == name and product.refs is None:
+                    self._delete(product)
+
+    def release(self, path):
+        """The caller is done with a product it got back from the scheduler"""
+        with self._lock:
+            product = self.products.get(Path(path))
+            if product is not None:
+                self._delete(product)
+
+    # ---------- internals ----------
+
+    def _release_job(self, name):
+        for product in [p for p in self.products.values() if p.job == name and p.refs]:
+            product.refs -= 1
+            if product.refs == 0:
+                self._delete(product)
+
+    def _delete(self, product):
+        self.products.pop(product.path, None)
+        self.live_bytes -= product.size
+        self.ram_bytes -= product.size if product.ram else 0
+        if not self.enabled or any(fnmatch.fnmatch(product.path.name, k) for k in self.keep):
+            return
+        if self.cache is None or not self.cache.discard(product.path):
+            remove_product(product.path)
+        self.freed_bytes += product.size
+        self.freed_count += 1
+
+    def _sample_free(self):
+        try:
+            self._free_now = shutil.disk_usage(self.temp_dir).free
+        except OSError:
+            self._free_now = None
+            return
+        self.min_free_bytes = (self._free_now if self.min_free_bytes is None
+                               else min(self.min_free_bytes, self._free_now))
+
+    def stats(self):
+        return {
+            "peak_intermediates_bytes": self.peak_bytes,
+            "live_intermediates_bytes": self.live_bytes,
+            "deleted": self.freed_count,
+            "deleted_bytes": self.freed_bytes,
+            "min_free_bytes": self.min_free_bytes,
+        }
+
+    def report(self, profiler=None):
+        """Print (and add to the run's profile) peak scratch usage"""
+        if self.peak_bytes == 0:
+            return
+        free = (f", temp volume down to {self.min_free_bytes / 1024**3:.1f} GB free"
+                if self.min_free_bytes is not None else "")
+        print(f"\n  Scratch: peak {self.peak_bytes / 1024**3:.1f} GB of intermediates, "
+              f"{self.freed_count} deleted after use ({self.freed_bytes / 1024**3:.1f} GB){free}")
+        if profiler is not None:
+            profiler.extra["scratch"] = self.stats()
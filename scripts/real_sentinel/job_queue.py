@@ -0,0 +1,260 @@
+"""
+Persistent multi-site job queue
+
+Each job is one stage (slc, grd, canals, carbon, maps, ...) of one site's
+config. Jobs live in a local SQLite database, so a batch survives restarts:
+finished jobs are never redone, jobs left running by a killed batch are
+requeued, and failed jobs are retried up to max_attempts. A job becomes
+ready once all its dependencies are done. Enqueueing a site under a new
+config version supersedes its unfinished jobs of older versions: the queue
+stores only the config path, so they would run the new config too,
+concurrently and in the same folders.
+
+ResourceLimits caps how many GPT, SNAPHU and CPU-bound numpy stages run at
+once across every site in the process. The processors take a slot around
+each such call; without a batch runner the limits are unbounded.
+"""
+
+import functools
+import hashlib
+import json
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    site TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    config TEXT NOT NULL,
+    run_key TEXT NOT NULL,
+    resource TEXT,
+    deps TEXT NOT NULL DEFAULT '[]',
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    enqueued REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    owner TEXT,
+    error TEXT,
+    result TEXT,
+    UNIQUE (site, stage, run_key)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+"""
+
+# pending → running → done | pending (retry) | failed; blocked = a dependency failed;
+# superseded = the site's config changed before the job finished
+STATUSES = ("pending", "running", "done", "failed", "blocked", "superseded")
+
+
+class ResourceLimits:
+    def __init__(self, limits=None):
+        """{resource: max concurrent} (None or missing = unlimited)"""
+        self.limits = {name: n for name, n in (limits or {}).items() if n}
+        self._semaphores = {name: threading.BoundedSemaphore(n) for name, n in self.limits.items()}
+        self._lock = threading.Lock()
+        self.wait_s = {name: 0.0 for name in self.limits}
+
+    @contextmanager
+    def slot(self, resource):
+        """Hold one slot of `resource` for the duration of the block"""
+        semaphore = self._semaphores.get(resource)
+        if semaphore is None:
+            yield
+            return
+        t0 = time.perf_counter()
+        semaphore.acquire()
+        with self._lock:
+            self.wait_s[resource] += time.perf_counter() - t0
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def try_acquire(self, resource):
+        semaphore = self._semaphores.get(resource)
+        return semaphore is None or semaphore.acquire(blocking=False)
+
+    def release(self, resource):
+        semaphore = self._semaphores.get(resource)
+        if semaphore is not None:
+            semaphore.release()
+
+
+def limited(resource):
+    """Method decorator: run the call inside one of self.limits' `resource` slots"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with self.limits.slot(resource):
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def run_key(config_path):
+    """Jobs are per config content: a changed config (new acquisitions) is a new run"""
+    return hashlib.sha256(Path(config_path).read_bytes()).hexdigest()[:16]
+
+
+class JobQueue:
+    def __init__(self, path, max_attempts=2):
+        """SQLite-backed queue; one batch runner per database"""
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_attempts = max_attempts
+        self.owner = f"{socket.gethostname()}:{id(self):x}"
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def close(self):
+        self._db.close()
+
+    # ---------- producers ----------
+
+    def enqueue(self, site, stage, config_path, resource=None, deps=()):
+        """Add a job unless this site/stage/config run already exists; returns its id
+
+        Unfinished jobs of the site's other config versions are superseded
+        (running ones only if a previous, killed batch left them running).
+        """
+        key = run_key(config_path)
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE jobs SET status='superseded', error='config changed', owner=NULL "
+                "WHERE site=? AND run_key!=? AND (status IN ('pending', 'failed', 'blocked') "
+                "OR (status='running' AND owner IS NOT ?))",
+                (site, key, self.owner),
+            )
+            db.execute(
+                "INSERT OR IGNORE INTO jobs (site, stage, config, run_key, resource, deps, enqueued) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (site, stage, str(config_path), key, resource, json.dumps(list(deps)), time.time()),
+            )
+            row = db.execute("SELECT id FROM jobs WHERE site=? AND stage=? AND run_key=?",
+                             (site, stage, key)).fetchone()
+        return row["id"]
+
+    def recover(self):
+        """Requeue jobs a previous (killed) batch left running; returns how many"""
+        with self.transaction() as db:
+            n = db.execute("UPDATE jobs SET status='pending', owner=NULL WHERE status='running'").rowcount
+        return n
+
+    def retry_failed(self):
+        """Give failed and blocked jobs a fresh set of attempts"""
+        with self.transaction() as db:
+            return db.execute("UPDATE jobs SET status='pending', attempts=0, error=NULL "
+                              "WHERE status IN ('failed', 'blocked')").rowcount
+
+    # ---------- workers ----------
+
+    def ready(self):
+        """Pending jobs whose dependencies are all done, oldest first"""
+        with self._lock:
+            rows = self._db.execute("SELECT id, deps, status FROM jobs").fetchall()
+            status = {row["id"]: row["status"] for row in rows}
+            ready, blocked = [], []
+            for row in rows:
+                if row["status"] != "pending":
+                    continue
+                deps = json.loads(row["deps"])
+                if any(status.get(d) in ("failed", "blocked") for d in deps):
+                    blocked.append(row["id"])
+                elif all(status.get(d) == "done" for d in deps):
+                    ready.append(row["id"])
+        if blocked:
+            with self.transaction() as db:
+                db.executemany("UPDATE jobs SET status='blocked', error='dependency failed' WHERE id=?",
+                               [(i,) for i in blocked])
+        return self.jobs(ready)
+
+    def jobs(self, ids=None):
+        with self._lock:
+            if ids is None:
+                return [dict(r) for r in self._db.execute("SELECT * FROM jobs ORDER BY id")]
+            if not ids:
+                return []
+            marks = ",".join("?" * len(ids))
+            return [dict(r) for r in self._db.execute(
+                f"SELECT * FROM jobs WHERE id IN ({marks}) ORDER BY id", list(ids))]
+
+    def claim(self, job_id):
+        """Atomically mark a pending job running; False if another worker got it"""
+        with self.transaction() as db:
+            n = db.execute(
+                "UPDATE jobs SET status='running', started=?, attempts=attempts+1, owner=? "
+                "WHERE id=? AND status='pending'",
+                (time.time(), self.owner, job_id),
+            ).rowcount
+        return n == 1
+
+    def complete(self, job_id, result=None):
+        with self.transaction() as db:
+            db.execute("UPDATE jobs SET status='done', finished=?, result=?, error=NULL WHERE id=?",
+                       (time.time(), json.dumps(result, default=str), job_id))
+
+    def fail(self, job_id, error):
+        """Back to pending while attempts remain, else failed"""
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE jobs SET finished=?, error=?, "
+                "status=CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END WHERE id=?",
+                (time.time(), str(error), self.max_attempts, job_id),
+            )
+
+    def unfinished(self):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running')").fetchone()[0]
+
+    # ---------- reporting ----------
+
+    def stats(self, since=None):
+        """Counts by status, throughput, and queue wait / run time per stage"""
+        import numpy as np  # only for the report: keeps the pipelines' startup light
+
+        jobs = self.jobs()
+        counts = {s: sum(j["status"] == s for j in jobs) for s in STATUSES}
+        done = [j for j in jobs if j["status"] == "done" and (since is None or j["finished"] >= since)]
+
+        def summary(values):
+            if not values:
+                return None
+            values = np.asarray(values)
+            return {"mean": float(values.mean()), "p50": float(np.percentile(values, 50)),
+                    "p95": float(np.percentile(values, 95)), "max": float(values.max())}
+
+        stages = {}
+        for stage in sorted({j["stage"] for j in done}):
+            sj = [j for j in done if j["stage"] == stage]
+            stages[stage] = {
+                "done": len(sj),
+                "wait_s": summary([j["started"] - j["enqueued"] for j in sj]),
+                "run_s": summary([j["finished"] - j["started"] for j in sj]),
+            }
+
+        throughput = None
+        if done:
+            span = max(j["finished"] for j in done) - (since or min(j["started"] for j in done))
+            throughput = len(done) / max(span, 1e-9) * 3600
+        return {"counts": counts, "throughput_per_h": throughput, "stages": stages}
@@ -0,0 +1,163 @@
+"""
+Cloud-optimized GeoTIFF writer for the pipeline products
+
+Products are written block by block into a tiled, uncompressed scratch file.
+On close, internal overviews are built and the file is copied once into its
+final COG layout: internal tiles, overviews copied in front of the data
+(COPY_SRC_OVERVIEWS), the chosen codec with a predictor, and quality masks
+bit-packed to 1 bit per pixel. Dashboards and ResultVisualizer can then read
+any window or zoom level without reading the whole file.
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+
+CODECS = ("lzw", "deflate", "zstd", "none")
+
+# Product kind → overview resampling
+OVERVIEW_RESAMPLING = {
+    "continuous": Resampling.average,
+    "class": Resampling.mode,
+    "mask": Resampling.nearest,
+}
+
+
+def overview_factors(width, height, blocksize):
+    """Power-of-two decimations until the smallest level fits in one tile"""
+    factors = []
+    factor = 2
+    while max(width, height) / (factor // 2) > blocksize:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+class ProductWriter:
+    def __init__(self, codec="deflate", level=None, blocksize=512, overviews=True, mask_nbits=1):
+        """COG settings shared by every product the pipeline writes"""
+        codec = (codec or "none").lower()
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec!r} (use one of {', '.join(CODECS)})")
+        self.codec = codec
+        self.level = level
+        self.blocksize = blocksize
+        self.overviews = overviews
+        self.mask_nbits = mask_nbits
+
+    @classmethod
+    def from_config(cls, config):
+        """Build from the `geotiff` section of config.yaml"""
+        tif_cfg = config.get('geotiff', {})
+        return cls(
+            codec=tif_cfg.get('codec', 'deflate'),
+            level=tif_cfg.get('level'),
+            blocksize=tif_cfg.get('blocksize', 512),
+            overviews=tif_cfg.get('overviews', True),
+            mask_nbits=tif_cfg.get('mask_nbits', 1),
+        )
+
+    def creation_options(self, dtype, kind="continuous"):
+        """GTiff creation options of the final COG"""
+        options = {
+            'tiled': True,
+            'blockxsize': self.blocksize,
+            'blockysize': self.blocksize,
+            'BIGTIFF': 'IF_SAFER',
+        }
+        bit_packed = kind == "mask" and bool(self.mask_nbits)
+        if bit_packed:
+            options['nbits'] = self.mask_nbits
+
+        if self.codec != "none":
+            options['compress'] = self.codec
+
+            # no predictor on bit-packed masks: it needs whole bytes per sample
+            if np.issubdtype(np.dtype(dtype), np.floating):
+                options['predictor'] = 3  # floating-point predictor
+            elif not bit_packed:
+                options['predictor'] = 2  # horizontal differencing
+
+            if self.level is not None:
+                if self.codec == "deflate":
+                    options['zlevel'] = self.level
+                elif self.codec == "zstd":
+                    options['zstd_level'] = self.level
+        return options
+
+    def open(self, path, profile, kind="continuous"):
+        """Writable product; use as a context manager or close() it to finalize"""
+        if kind not in OVERVIEW_RESAMPLING:
+            raise ValueError(f"Unknown product kind {kind!r}")
+        return COGDataset(self, path, profile, kind)
+
+
+class COGDataset:
+    def __init__(self, writer, path, profile, kind):
+        """Scratch dataset that becomes a COG at `path` when closed"""
+        self.writer = writer
+        self.path = Path(path)
+        self.kind = kind
+        self.scratch = self.path.with_name(self.path.stem + ".partial.tif")
+
+        scratch_profile = {
+            k: v for k, v in profile.items()
+            if k in ('width', 'height', 'count', 'dtype', 'crs', 'transform', 'nodata')
+        }
+        scratch_profile.update(
+            driver='GTiff',
+            tiled=True,
+            blockxsize=writer.blocksize,
+            blockysize=writer.blocksize,
+            BIGTIFF='IF_SAFER',
+        )
+        self.dtype = scratch_profile['dtype']
+        self._dst = rasterio.open(self.scratch, 'w', **scratch_profile)
+
+    def write(self, *args, **kwargs):
+        self._dst.write(*args, **kwargs)
+
+    def close(self):
+        """Build overviews and copy into the final COG layout"""
+        if self._dst is None:
+            return
+        dst, self._dst = self._dst, None
+
+        try:
+            if self.writer.overviews:
+                factors = overview_factors(dst.width, dst.height, self.writer.blocksize)
+                if factors:
+                    resampling = OVERVIEW_RESAMPLING[self.kind]
+                    dst.build_overviews(factors, resampling)
+                    dst.update_tags(ns='rio_overview', resampling=resampling.name)
+            dst.close()
+
+            options = self.writer.creation_options(self.dtype, self.kind)
+            rasterio.shutil.copy(self.scratch, self.path, driver='GTiff',
+                                 copy_src_overviews=True, **options)
+        finally:
+            if not dst.closed:
+                dst.close()
+            if self.scratch.exists():
+                os.remove(self.scratch)
+
+    def abort(self):
+        """Discard a product whose computation failed"""
+        if self._dst is not None:
+            self._dst.close()
+            self._dst = None
+        if self.scratch.exists():
+            os.remove(self.scratch)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,338 @@
+"""
+Per-step performance profiling
+
+Every GPT call, SNAPHU run and Python stage is recorded with wall time, CPU
+time, peak RSS of the process tree (the JVM and SNAPHU children, or this
+process for Python stages), bytes read/written and the size of its output on
+disk. Profiles are written as JSON plus a Chrome trace (chrome://tracing,
+Perfetto) and printed as a summary table.
+
+Process-tree sampling uses psutil when it is installed; without it only wall
+time and output size are recorded.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from step_cache import product_size
+
+try:
+    import psutil
+except ImportError:  # optional: timings only
+    psutil = None
+
+
+class StepRecord:
+    def __init__(self, name, kind, depth, output=None):
+        """Measurements for one profiled step"""
+        self.name = name
+        self.kind = kind
+        self.depth = depth
+        self.output = output
+        self.thread = threading.get_ident()
+        self.start = time.time()
+        self.wall_s = None
+        self.cpu_s = None
+        self.peak_rss_bytes = None
+        self.read_bytes = None
+        self.write_bytes = None
+        self.output_bytes = None
+        self.status = "running"
+        self._samplers = []
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "depth": self.depth,
+            "status": self.status,
+            "start": self.start,
+            "wall_s": self.wall_s,
+            "cpu_s": self.cpu_s,
+            "peak_rss_mb": None if self.peak_rss_bytes is None else self.peak_rss_bytes / 1024**2,
+            "read_mb": None if self.read_bytes is None else self.read_bytes / 1024**2,
+            "write_mb": None if self.write_bytes is None else self.write_bytes / 1024**2,
+            "output_mb": None if self.output_bytes is None else self.output_bytes / 1024**2,
+            "output": None if self.output is None else [str(p) for p in _paths(self.output)],
+        }
+
+    def _add(self, attr, value):
+        if value is not None:
+            setattr(self, attr, (getattr(self, attr) or 0) + value)
+
+
+class TreeSampler:
+    def __init__(self, pid, interval=0.5, own_process=False):
+        """Poll a process tree for RSS, CPU time and I/O until stopped
+
+        CPU and I/O counters are cumulative per process, so the last value
+        seen for each pid is summed when sampling stops. With own_process the
+        root alone is sampled and counted from now on (a Python stage; its
+        figures include any other threads running meanwhile).
+        """
+        self.root = psutil.Process(pid)
+        self.interval = interval
+        self.own_process = own_process
+        self.peak_rss = 0
+        self._cpu = {}
+        self._io = {}
+        self._base_cpu = 0.0
+        self._base_io = (0, 0)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def start(self):
+        if self.own_process:
+            cpu = self.root.cpu_times()
+            self._base_cpu = cpu.user + cpu.system
+            self._base_io = _io_counters(self.root) or (0, 0)
+        self._sample()
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        try:
+            procs = [self.root] if self.own_process else [self.root] + self.root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return
+        rss = 0
+        for proc in procs:
+            try:
+                with proc.oneshot():
+                    rss += proc.memory_info().rss
+                    cpu = proc.cpu_times()
+                    self._cpu[proc.pid] = cpu.user + cpu.system
+                    io = _io_counters(proc)
+                    if io is not None:
+                        self._io[proc.pid] = io
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        self.peak_rss = max(self.peak_rss, rss)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def stop(self):
+        """Stop sampling; returns (cpu_s, peak_rss, read_bytes, write_bytes)"""
+        self._sample()
+        self._stop.set()
+        self._thread.join()
+
+        cpu = sum(self._cpu.values()) - self._base_cpu
+        if not self._io:
+            return cpu, self.peak_rss, None, None
+        reads = sum(io[0] for io in self._io.values()) - self._base_io[0]
+        writes = sum(io[1] for io in self._io.values()) - self._base_io[1]
+        return cpu, self.peak_rss, reads, writes
+
+
+def _paths(output):
+    """Product paths in a step result (a path, or a tuple/list/dict of them)"""
+    if isinstance(output, dict):
+        output = list(output.values())
+    if isinstance(output, (list, tuple)):
+        return [p for item in output for p in _paths(item)]
+    return [Path(output)] if isinstance(output, (str, os.PathLike)) else []
+
+
+def profiled(name, kind="python"):
+    """Method decorator: profile the call with self.profiler, sizing what it returns"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with self.profiler.step(name, kind) as record:
+                result = fn(self, *args, **kwargs)
+                if record is not None:
+                    record.output = result
+                return result
+        return wrapper
+    return decorate
+
+
+def _io_counters(proc):
+    try:
+        io = proc.io_counters()  # not available on macOS
+    except (AttributeError, psutil.AccessDenied, NotImplementedError):
+        return None
+    return io.read_bytes, io.write_bytes
+
+
+class Profiler:
+    def __init__(self, enabled=True, reports_dir=None, interval=0.5):
+        """Collects StepRecords from any thread"""
+        self.enabled = enabled
+        self.reports_dir = Path(reports_dir) if reports_dir else None
+        self.interval = interval
+        self.records = []
+        self.extra = {}  # run-level figures saved with the profile (e.g. peak scratch)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._warned = False
+
+    @classmethod
+    def from_config(cls, config):
+        """Build from the `profiling` section of config.yaml"""
+        prof_cfg = config.get('profiling', {})
+        return cls(
+            enabled=prof_cfg.get('enabled', True),
+            reports_dir=prof_cfg.get('output_dir') or config['output']['reports'],
+            interval=prof_cfg.get('sample_interval_s', 0.5),
+        )
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def step(self, name, kind="python", output=None):
+        """Profile a block; subprocesses started inside it are attached via watch()"""
+        if not self.enabled:
+            yield None
+            return
+
+        stack = self._stack()
+        record = StepRecord(name, kind, len(stack), output)
+        with self._lock:
+            self.records.append(record)
+
+        # Python stages sample this process; subprocess steps sample their children
+        if kind == "python" and psutil is not None:
+            record._samplers.append(TreeSampler(os.getpid(), self.interval, own_process=True).start())
+        elif psutil is None and not self._warned:
+            self._warned = True
+            print("  ⚠ psutil not installed: profiling wall time and output size only")
+
+        stack.append(record)
+        t0 = time.perf_counter()
+        try:
+            yield record
+            record.status = "ok"
+        except BaseException:
+            record.status = "failed"
+            raise
+        finally:
+            stack.pop()
+            record.wall_s = time.perf_counter() - t0
+            for sampler in record._samplers:
+                cpu, rss, reads, writes = sampler.stop()
+                record._add("cpu_s", cpu)
+                record.peak_rss_bytes = max(record.peak_rss_bytes or 0, rss)
+                record._add("read_bytes", reads)
+                record._add("write_bytes", writes)
+            record._samplers = []
+            if record.output is not None:
+                existing = [p for p in _paths(record.output) if p.exists()]
+                if existing:
+                    record.output_bytes = sum(product_size(p) for p in existing)
+
+    def watch(self, proc, record=None):
+        """Sample a child process tree under `record` (default: innermost active step)"""
+        if record is None:
+            stack = self._stack() if self.enabled else []
+            record = stack[-1] if stack else None
+        if record is None or psutil is None:
+            return
+        try:
+            record._samplers.append(TreeSampler(proc.pid, self.interval).start())
+        except psutil.NoSuchProcess:
+            pass  # already exited; nothing to sample
+
+    def watcher(self):
+        """watch() bound to this thread's innermost step, callable from any thread"""
+        stack = self._stack() if self.enabled else []
+        record = stack[-1] if stack else None
+        return lambda proc: self.watch(proc, record) if record is not None else None
+
+    def summary(self):
+        """Table of every step, slowest top-level steps first"""
+        if not self.records:
+            return ""
+
+        # children print under their parent, parents by wall time
+        def inside(child, parent):
+            end = parent.start + (parent.wall_s or 0)
+            return (child.depth > 0 and child.thread == parent.thread
+                    and parent.start <= child.start <= end)
+
+        order = []
+        top = sorted((r for r in self.records if r.depth == 0), key=lambda r: -(r.wall_s or 0))
+        for parent in top:
+            order.append(parent)
+            order.extend(r for r in self.records if inside(r, parent))
+
+        total = sum(r.wall_s or 0 for r in self.records if r.depth == 0) or 1
+
+        def fmt(value, spec):
+            return "-" if value is None else format(value, spec)
+
+        lines = [
+            f"  {'step':<34}{'kind':>8}{'wall s':>9}{'%':>6}{'cpu s':>9}"
+            f"{'peak MB':>9}{'read MB':>9}{'write MB':>9}{'out MB':>9}",
+            "  " + "-" * 102,
+        ]
+        for r in order:
+            d = r.as_dict()
+            name = ("  " * r.depth + r.name)[:33]
+            pct = 100 * (r.wall_s or 0) / total if r.depth == 0 else None
+            lines.append(
+                f"  {name:<34}{r.kind:>8}{fmt(r.wall_s, '.1f'):>9}{fmt(pct, '.0f'):>6}"
+                f"{fmt(r.cpu_s, '.1f'):>9}{fmt(d['peak_rss_mb'], '.0f'):>9}"
+                f"{fmt(d['read_mb'], '.0f'):>9}{fmt(d['write_mb'], '.0f'):>9}"
+                f"{fmt(d['output_mb'], '.0f'):>9}"
+                + ("" if r.status == "ok" else f"  [{r.status}]")
+            )
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """Chrome trace-event JSON (complete events, one lane per thread)"""
+        origin = min(r.start for r in self.records)
+        events = []
+        for r in self.records:
+            args = {k: v for k, v in r.as_dict().items()
+                    if k not in ("name", "kind", "start", "wall_s", "depth") and v is not None}
+            events.append({
+                "name": r.name,
+                "cat": r.kind,
+                "ph": "X",
+                "ts": (r.start - origin) * 1e6,
+                "dur": (r.wall_s or 0) * 1e6,
+                "pid": os.getpid(),
+                "tid": r.thread,
+                "args": args,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, label):
+        """Write profile_<label>_<time>.json + .trace.json and print the summary"""
+        if not self.enabled or not self.records:
+            return None
+
+        self.reports_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        base = self.reports_dir / f"profile_{label}_{stamp}"
+
+        with open(base.with_suffix(".json"), 'w') as f:
+            json.dump({
+                "label": label,
+                "created": datetime.now().isoformat(timespec='seconds'),
+                "psutil": psutil is not None,
+                "steps": [r.as_dict() for r in self.records],
+                **self.extra,
+            }, f, indent=2)
+        with open(base.with_suffix(".trace.json"), 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+        print(f"\n  Step profile ({label}):")
+        print(self.summary())
+        print(f"  Profile: {base.with_suffix('.json')}")
+        print(f"  Trace (chrome://tracing): {base.with_suffix('.trace.json')}")
+        return base.with_suffix(".json")
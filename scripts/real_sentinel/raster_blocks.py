@@ -0,0 +1,140 @@
+"""
+Block-wise raster processing helpers
+
+Rasters are processed as full-width row strips (SNAP's ENVI .img bands are
+stored row-major, so a strip is one contiguous read, and such bands are
+memory-mapped rather than decoded through GDAL). Strips are dispatched to a
+thread pool and results are handed back in the calling thread as soon as
+each strip finishes, so writers never need locking.
+"""
+
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+import rasterio
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+
+from dimap_reader import DimapBand, open_band
+
+
+def block_windows(height, width, block_rows):
+    """Full-width row strips covering a raster"""
+    for row in range(0, height, block_rows):
+        yield Window(0, row, width, min(block_rows, height - row))
+
+
+def rows_per_block(width, bytes_per_pixel, budget_bytes, in_flight=1):
+    """Strip height such that `in_flight` strips fit in the memory budget"""
+    per_row = max(1, width * bytes_per_pixel * in_flight)
+    return max(1, int(budget_bytes // per_row))
+
+
+def metres_per_unit(crs, lat):
+    """(x, y) metres per CRS unit near latitude `lat`"""
+    if crs.is_geographic:
+        return 111320.0 * math.cos(math.radians(lat)), 110574.0
+    return 1.0, 1.0
+
+
+def open_raster(path):
+    """A SNAP .img band as a memory-mapped DimapBand, anything else through rasterio"""
+    return open_band(path) or rasterio.open(path)
+
+
+def read_masked(src, window):
+    """Read band 1 of a window as float32 with nodata turned into NaN"""
+    data = src.read(1, window=window, out_dtype='float32')
+    if src.nodata is not None and not np.isnan(src.nodata):
+        data[data == src.nodata] = np.nan
+    return data
+
+
+class AlignedReaders:
+    def __init__(self, paths, reference=None, grid=None):
+        """Per-thread rasterio handles, resampled onto a reference grid if needed
+
+        The grid is taken from `reference` (default: the first path), or given
+        directly as grid=(crs, transform, width, height).
+        """
+        self.paths = [str(p) for p in paths]
+        self._local = threading.local()
+        self._all = []
+        self._lock = threading.Lock()
+
+        with open_raster(reference or self.paths[0]) as ref:
+            self.profile = ref.profile.copy()
+            self.crs = ref.crs
+            self.transform = ref.transform
+            self.width = ref.width
+            self.height = ref.height
+
+        if grid is not None:
+            self.crs, self.transform, self.width, self.height = grid
+            self.profile.update(crs=self.crs, transform=self.transform,
+                                width=self.width, height=self.height)
+
+    def _open(self, path):
+        src = open_raster(path)
+        if (src.crs, src.transform, src.width, src.height) == \
+                (self.crs, self.transform, self.width, self.height):
+            return src
+        # Scenes geocoded onto slightly different grids: warp onto the reference
+        if isinstance(src, DimapBand):  # WarpedVRT needs a GDAL dataset
+            src.close()
+            src = rasterio.open(path)
+        return WarpedVRT(src, crs=self.crs, transform=self.transform,
+                         width=self.width, height=self.height,
+                         nodata=src.nodata if src.nodata is not None else np.nan)
+
+    def datasets(self):
+        """This thread's open datasets (rasterio handles are not thread-safe)"""
+        handles = getattr(self._local, "handles", None)
+        if handles is None:
+            handles = [self._open(p) for p in self.paths]
+            self._local.handles = handles
+            with self._lock:
+                self._all.append(handles)
+        return handles
+
+    def close(self):
+        with self._lock:
+            for handles in self._all:
+                for src in handles:
+                    src.close()
+            self._all.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def process_blocks(windows, fn, on_done, workers=None):
+    """Run fn(window) on a thread pool; on_done(window, result) in this thread
+
+    At most 2×workers blocks are in flight, which bounds peak memory.
+    """
+    workers = workers or os.cpu_count() or 1
+    windows = iter(windows)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        def fill():
+            while len(running) < 2 * workers:
+                window = next(windows, None)
+                if window is None:
+                    return
+                running[pool.submit(fn, window)] = window
+
+        fill()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                window = running.pop(future)
+                on_done(window, future.result())
+            fill()
@@ -0,0 +1,408 @@
+"""
+Local LRU cache of remote Sentinel-1 inputs
+
+sentinel1.slc_master/slc_slave/slc_stack/grd_files may be fsspec URLs
+(s3://bucket/S1A_..._COG.SAFE, https://..., memory://...) instead of local
+paths. Each remote product (SAFE folder or single file) is fetched once into
+<temp>/remote/<key>/: every file is read as parallel byte ranges, checked
+against its size, the MD5 the store reports (S3 ETag, GCS md5Hash) and the
+MD5s listed in the SAFE manifest.safe, and the product only shows up in the
+cache once complete. Scenes are prefetched in the background so downloads
+overlap the GPT steps of the scenes before them.
+
+Sentinel-1 products never change under the same name, so a cached URL is not
+revalidated against the store on later runs.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import posixpath
+import shutil
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path, PurePosixPath
+
+MANIFEST_NAME = "manifest.json"
+RANGE_ATTEMPTS = 3  # tries per byte range before the fetch fails
+
+
+def is_remote(path):
+    """True for an fsspec URL other than file://"""
+    protocol, sep, _ = str(path).partition("://")
+    return bool(sep) and protocol not in ("file", "local")
+
+
+def input_path(value):
+    """A configured input: Path if local, the URL string itself if remote"""
+    text = str(value)
+    if text.startswith("file://"):
+        return Path(text[len("file://"):])
+    return text if is_remote(text) else Path(text)
+
+
+def file_md5(path, chunk=8 * 1024**2):
+    h = hashlib.md5(usedforsecurity=False)
+    with open(path, 'rb') as f:
+        while block := f.read(chunk):
+            h.update(block)
+    return h.hexdigest()
+
+
+def remote_md5(info):
+    """MD5 the store reports for a file (hex), None if it has none"""
+    etag = str(info.get("ETag") or info.get("etag") or "").strip('"').lower()
+    # multipart S3 uploads have "<md5 of md5s>-<parts>" ETags: not a content MD5
+    if len(etag) == 32 and all(c in "0123456789abcdef" for c in etag):
+        return etag
+    if info.get("md5"):
+        return str(info["md5"]).lower()
+    if info.get("md5Hash"):
+        return base64.b64decode(info["md5Hash"]).hex()
+    return None
+
+
+def safe_checksums(safe_dir):
+    """MD5 of every data object listed in a SAFE folder's manifest.safe ({} if none)"""
+    manifest = Path(safe_dir) / "manifest.safe"
+    if not manifest.is_file():
+        return {}
+    try:
+        root = ET.parse(manifest).getroot()
+    except ET.ParseError:
+        return {}
+
+    sums = {}
+    for stream in root.iter():
+        if not str(stream.tag).endswith("byteStream"):
+            continue
+        href = md5 = None
+        for child in stream:
+            if child.tag.endswith("fileLocation"):
+                href = child.get("href")
+            elif child.tag.endswith("checksum") and (child.get("checksumName") or "").upper() == "MD5":
+                md5 = (child.text or "").strip().lower()
+        if href and md5:
+            sums[str(PurePosixPath(href))] = md5
+    return sums
+
+
+class RemoteInputs:
+    def __init__(self, cache_dir, max_size_gb=None, block_size_mb=16, workers=8, prefetch=2,
+                 verify_on_hit=False, storage_options=None):
+        """Fetch remote inputs into cache_dir, least recently used evicted beyond max_size_gb"""
+        self.root = Path(cache_dir)
+        self.manifest_path = self.root / MANIFEST_NAME
+        self.max_bytes = int(max_size_gb * 1024**3) if max_size_gb else None
+        self.block_size = int(block_size_mb * 1024**2)
+        self.workers = workers
+        self.prefetch_scenes = prefetch
+        self.verify_on_hit = verify_on_hit
+        self.storage_options = storage_options or {}  # protocol → fsspec options
+
+        # Per-run figures for report()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_fetched = 0
+        self.fetch_seconds = 0.0
+
+        self._lock = threading.RLock()
+        self._session = set()  # keys used by this run, never evicted mid-run
+        self._fetches = {}  # url → Future of its local path
+        self._scenes = None  # fetches whole products, prefetch at a time
+        self._ranges = None  # ranged reads of those products
+        self._cancelled = threading.Event()
+
+    @classmethod
+    def from_config(cls, config):
+        """Build from the `remote` section of config.yaml"""
+        remote_cfg = config.get('remote', {})
+        return cls(
+            remote_cfg.get('cache_dir') or Path(config['output']['temp']) / "remote",
+            max_size_gb=remote_cfg.get('max_size_gb'),
+            block_size_mb=remote_cfg.get('block_size_mb', 16),
+            workers=remote_cfg.get('workers', 8),
+            prefetch=remote_cfg.get('prefetch', 2),
+            verify_on_hit=remote_cfg.get('verify_on_hit', False),
+            storage_options=remote_cfg.get('storage_options'),
+        )
+
+    # ---------- manifest ----------
+
+    def _load(self):
+        if not self.manifest_path.exists():
+            return {"version": 1, "entries": {}}
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError):
+            print(f"  ⚠ Remote input cache manifest unreadable, starting fresh")
+            return {"version": 1, "entries": {}}
+
+    def _save(self, manifest):
+        tmp = self.manifest_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, self.manifest_path)
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha256(str(url).encode()).hexdigest()[:16]
+
+    @staticmethod
+    def product_name(url):
+        return str(url).rstrip("/").rsplit("/", 1)[-1]
+
+    # ---------- resolution ----------
+
+    def local_path(self, url):
+        """Where a remote product is (or would be) cached; local paths are returned as is"""
+        if not is_remote(url):
+            return Path(url)
+        return self.root / self.key(url) / self.product_name(url)
+
+    def is_cached(self, url):
+        """True if a remote product is in the cache (sizes checked, nothing fetched)"""
+        if not is_remote(url) or not self.manifest_path.exists():
+            return not is_remote(url)
+        with self._lock:
+            entry = self._load()["entries"].get(self.key(url))
+        return entry is not None and self._is_intact(self.local_path(url), entry, hash_files=False)
+
+    def prefetch(self, paths):
+        """Start fetching the remote ones of paths in the background, in order"""
+        for path in paths:
+            if is_remote(path):
+                self._submit(str(path))
+
+    def resolve(self, path):
+        """Local path of an input, waiting for (or starting) its fetch if remote"""
+        if not is_remote(path):
+            return Path(path)
+        return self._submit(str(path)).result()
+
+    def _submit(self, url):
+        with self._lock:
+            if self._cancelled.is_set():
+                raise RuntimeError("Remote input fetching was cancelled")
+            if url not in self._fetches:
+                if self._scenes is None:
+                    self._scenes = ThreadPoolExecutor(max_workers=self.prefetch_scenes,
+                                                      thread_name_prefix="prefetch")
+                    self._ranges = ThreadPoolExecutor(max_workers=self.workers,
+                                                      thread_name_prefix="ranged-read")
+                self._fetches[url] = self._scenes.submit(self._fetch, url)
+            return self._fetches[url]
+
+    def cancel(self):
+        """Stop queued and running fetches (the run failed or was interrupted)"""
+        self._cancelled.set()
+        with self._lock:
+            for pool in (self._scenes, self._ranges):
+                if pool is not None:
+                    pool.shutdown(wait=False, cancel_futures=True)
+
+    # ---------- fetching ----------
+
+    def _filesystem(self, url):
+        import fsspec
+
+        protocol = url.partition("://")[0]
+        return fsspec.core.url_to_fs(url, **self.storage_options.get(protocol, {}))
+
+    def _fetch(self, url):
+        key, name = self.key(url), self.product_name(url)
+        with self._lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            manifest = self._load()
+            entry = manifest["entries"].get(key)
+            if entry is not None:
+                local = self.local_path(url)
+                if self._is_intact(local, entry, hash_files=self.verify_on_hit):
+                    entry["last_used"] = datetime.now().isoformat(timespec='seconds')
+                    self._save(manifest)
+                    self._session.add(key)
+                    self.hits += 1
+                    print(f"✓ Cached input: {name}")
+                    return local
+                print(f"  ⚠ Cached input {name} is incomplete, fetching again")
+                self._remove(key, manifest)
+                self._save(manifest)
+            self._session.add(key)
+
+        fs, root = self._filesystem(url)
+        files = self._list(fs, root, name)
+        size = sum(info["size"] for _, _, info in files)
+        print(f"▶ Fetching {name}: {len(files)} file(s), {size / 1024**2:.0f} MB")
+
+        partial = self.root / f"{key}.partial"
+        shutil.rmtree(partial, ignore_errors=True)
+        t0 = time.perf_counter()
+        try:
+            fetched = self._download(fs, files, partial)
+            checked = self._validate(files, partial, name)
+        except BaseException:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        elapsed = time.perf_counter() - t0
+
+        final = self.root / key
+        shutil.rmtree(final, ignore_errors=True)
+        os.replace(partial, final)
+
+        now = datetime.now().isoformat(timespec='seconds')
+        with self._lock:
+            manifest = self._load()
+            manifest["entries"][key] = {
+                "url": url,
+                "path": f"{key}/{name}",
+                "files": checked,
+                "size": size,
+                "fetched": now,
+                "last_used": now,
+            }
+            self._evict(manifest)
+            self._save(manifest)
+            self.misses += 1
+            self.bytes_fetched += fetched
+            self.fetch_seconds += elapsed
+
+        print(f"✓ Fetched {name} ({size / 1024**2:.0f} MB in {elapsed:.0f} s, "
+              f"{size / 1024**2 / max(elapsed, 1e-3):.0f} MB/s)")
+        return final / name
+
+    def _list(self, fs, root, name):
+        """(remote path, path under the cache entry, info) of every file of a product"""
+        root = root.rstrip("/")
+        if fs.info(root)["type"] != "directory":
+            return [(root, name, fs.info(root))]
+        return [(path, f"{name}/{posixpath.relpath(path, root)}", info)
+                for path, info in sorted(fs.find(root, detail=True).items())
+                if info["type"] != "directory"]
+
+    def _download(self, fs, files, target_root):
+        """Parallel ranged reads of every file; returns the bytes transferred"""
+        ranges = []
+        for path, rel, info in files:
+            local = target_root / rel
+            local.parent.mkdir(parents=True, exist_ok=True)
+            with open(local, 'wb') as f:
+                f.truncate(info["size"])
+            ranges.extend((path, local, start, min(start + self.block_size, info["size"]))
+                          for start in range(0, info["size"], self.block_size))
+
+        futures = [self._ranges.submit(self._read_range, fs, *r) for r in ranges]
+        return sum(future.result() for future in futures)
+
+    def _read_range(self, fs, path, local, start, end):
+        for attempt in range(1, RANGE_ATTEMPTS + 1):
+            if self._cancelled.is_set():
+                raise RuntimeError("Remote input fetching was cancelled")
+            try:
+                data = fs.cat_file(path, start=start, end=end)
+                if len(data) != end - start:
+                    raise OSError(f"short read of {path} [{start}:{end}]: {len(data)} bytes")
+                break
+            except OSError as e:
+                if attempt == RANGE_ATTEMPTS:
+                    raise
+                print(f"  ⚠ Retrying {posixpath.basename(path)} [{start}:{end}]: {e}")
+                time.sleep(attempt)
+        with open(local, 'r+b') as f:
+            f.seek(start)
+            f.write(data)
+        return len(data)
+
+    def _validate(self, files, target_root, name):
+        """Check sizes and MD5s of a download; returns {path: {size, md5}}"""
+        paths = [target_root / rel for _, rel, _ in files]
+        md5s = list(self._ranges.map(file_md5, paths))
+
+        checked = {}
+        for (_, rel, info), local, md5 in zip(files, paths, md5s):
+            if local.stat().st_size != info["size"]:
+                raise OSError(f"{rel}: {local.stat().st_size} bytes fetched, expected {info['size']}")
+            expected = remote_md5(info)
+            if expected is not None and md5 != expected:
+                raise OSError(f"Checksum mismatch for {rel} (store MD5 {expected}, fetched {md5})")
+            checked[rel] = {"size": info["size"], "md5": md5}
+
+        product = target_root / name
+        if product.is_dir():
+            for rel, expected in safe_checksums(product).items():
+                got = checked.get(f"{name}/{rel}")
+                if got is None:
+                    raise OSError(f"{name}: {rel} listed in manifest.safe but not in the store")
+                if got["md5"] != expected:
+                    raise OSError(f"Checksum mismatch for {name}/{rel} (manifest.safe {expected}, "
+                                  f"fetched {got['md5']})")
+        return checked
+
+    # ---------- integrity / eviction ----------
+
+    def _is_intact(self, local, entry, hash_files):
+        entry_dir = self.root / entry["path"].split("/", 1)[0]
+        for rel, expected in entry.get("files", {}).items():
+            f = entry_dir / rel
+            if not f.is_file() or f.stat().st_size != expected["size"]:
+                return False
+            if hash_files and file_md5(f) != expected["md5"]:
+                return False
+        return local.exists()
+
+    def _remove(self, key, manifest):
+        manifest["entries"].pop(key, None)
+        shutil.rmtree(self.root / key, ignore_errors=True)
+
+    def _evict(self, manifest):
+        # Partial downloads of crashed runs
+        for partial in self.root.glob("*.partial"):
+            if partial.stem not in self._session:
+                shutil.rmtree(partial, ignore_errors=True)
+
+        if self.max_bytes is None:
+            return
+
+        entries = manifest["entries"]
+        total = sum(e["size"] for e in entries.values())
+
+        # Least recently used first; inputs of the current run are kept
+        for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key in self._session:
+                continue
+            total -= entries[key]["size"]
+            print(f"  Evicting cached input {self.product_name(entries[key]['url'])} "
+                  f"({entries[key]['size'] / 1024**3:.1f} GB)")
+            self._remove(key, manifest)
+
+    # ---------- reporting ----------
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            "inputs": requests,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else None,
+            "bytes_fetched": self.bytes_fetched,
+            "fetch_s": round(self.fetch_seconds, 1),
+        }
+
+    def report(self, profiler=None):
+        """Print (and add to the run's profile) cache hit rate and bytes transferred"""
+        requests = self.hits + self.misses
+        if requests == 0:
+            return
+        transfer = f" in {self.fetch_seconds:.0f} s of fetching" if self.misses else ""
+        fetched = (f"{self.bytes_fetched / 1024**3:.1f} GB" if self.bytes_fetched >= 1024**3
+                   else f"{self.bytes_fetched / 1024**2:.0f} MB")
+        print(f"\n  Remote inputs: {self.hits}/{requests} cached ({100 * self.hits / requests:.0f}% hit rate), "
+              f"{fetched} transferred{transfer}")
+        if profiler is not None:
+            profiler.extra["remote_inputs"] = self.stats()
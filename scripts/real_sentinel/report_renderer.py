@@ -0,0 +1,325 @@
+"""
+Parallel report rendering: every map of every site into one PDF
+
+The report set is subsidence, coherence, VV, change date, canal risk and
+canal overlays for each site, plus subsidence and coherence for each pair
+date in the site's pair index. Rendering them one by one in the main
+process outlasts the numpy stages, so figures are fanned out over a
+process pool using matplotlib's Agg canvas (no pyplot, no GUI backend).
+
+Layers are decoded once, in the pool, into an on-disk cache under
+output.temp/report_cache: each raster at figure resolution as a .npy that
+workers memory-map (the page cache shares it between them), each canal
+shapefile reprojected onto the raster CRS as flat line coordinates. Entries
+are keyed by source path, size and mtime, so reruns only redo what changed.
+Each worker writes a PNG; the pages are assembled into report.pdf at the end.
+"""
+
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+# Figure layers: key → (file, resampling, colormap config key or colormap, colorbar label)
+RASTERS = {
+    "subsidence": ("subsidence_velocity.tif", "average", "cmap_subsidence", "Subsidence Velocity (mm/yr)"),
+    "coherence": ("coherence_median.tif", "average", "cmap_coherence", "Coherence"),
+    "vv": ("vv_median.tif", "average", "gray", "VV backscatter (dB)"),
+    "change": ("vv_change_date.tif", "nearest", "viridis", "VV change date (YYYYMMDD)"),
+    "risk": ("canal_risk_score.tif", "average", "cmap_risk", "Canal Risk Score"),
+}
+VECTORS = {
+    "confirmed": ("canal_confirmed.shp", "red"),
+    "potential": ("canal_potential.shp", "orange"),
+}
+
+
+def cache_key(path, *extra):
+    """Cache entry name for a source file in its current version"""
+    stat = Path(path).stat()
+    text = "|".join(str(v) for v in (Path(path).resolve(), stat.st_size, stat.st_mtime_ns, *extra))
+    return hashlib.sha1(text.encode()).hexdigest()[:20]
+
+
+def cache_raster(path, entry, max_shape, resampling, percentiles=(5, 95)):
+    """Decode band 1 at figure resolution into <entry>.npy + <entry>.json (extent, stretch, crs)"""
+    import rasterio
+    from rasterio.enums import Resampling
+
+    entry = Path(entry)
+    if entry.with_suffix(".json").exists():
+        return str(entry)
+
+    max_rows, max_cols = max_shape
+    with rasterio.open(path) as src:
+        factor = max(1, int(np.ceil(max(src.height / max_rows, src.width / max_cols))))
+        out_shape = (int(np.ceil(src.height / factor)), int(np.ceil(src.width / factor)))
+        data = src.read(1, out_shape=out_shape, resampling=Resampling[resampling], masked=True)
+        meta = {
+            "extent": [src.bounds.left, src.bounds.right, src.bounds.bottom, src.bounds.top],
+            "crs": src.crs.to_wkt() if src.crs else None,
+        }
+
+    if np.issubdtype(data.dtype, np.floating):
+        data = data.filled(np.nan).astype('float32')
+        valid = data[np.isfinite(data)]
+    else:
+        data = data.filled(0)
+        valid = data[data != 0]
+    meta["stretch"] = [float(v) for v in np.percentile(valid, percentiles)] if valid.size else None
+
+    tmp = entry.with_name(entry.name + ".tmp.npy")
+    np.save(tmp, data)
+    os.replace(tmp, entry.with_suffix(".npy"))
+    entry.with_suffix(".json").write_text(json.dumps(meta))  # written last: marks the entry complete
+    return str(entry)
+
+
+def cache_vector(path, entry, crs_wkt):
+    """Reproject a line/polygon file onto crs_wkt as <entry>.npz (xy coordinates + line index)"""
+    import geopandas as gpd
+    import shapely
+
+    entry = Path(entry)
+    if entry.with_suffix(".npz").exists():
+        return str(entry)
+
+    gdf = gpd.read_file(path)
+    if crs_wkt and gdf.crs is not None:
+        gdf = gdf.to_crs(crs_wkt)
+    geoms = gdf.geometry.values
+    polygons = np.isin(shapely.get_type_id(geoms), [3, 6])
+    geoms = shapely.get_parts(np.where(polygons, shapely.boundary(geoms), geoms))
+    geoms = shapely.get_parts(geoms)  # multi-part polygon boundaries
+    xy, index = shapely.get_coordinates(geoms, return_index=True)
+
+    tmp = entry.with_name(entry.name + ".tmp.npz")
+    np.savez(tmp, xy=xy, index=index)
+    os.replace(tmp, entry.with_suffix(".npz"))
+    return str(entry)
+
+
+def load_raster(entry):
+    """Memory-mapped cached raster and its metadata"""
+    entry = Path(entry)
+    return np.load(entry.with_suffix(".npy"), mmap_mode='r'), json.loads(entry.with_suffix(".json").read_text())
+
+
+def load_lines(entry):
+    """Cached vector as a list of (n, 2) coordinate arrays"""
+    with np.load(Path(entry).with_suffix(".npz")) as npz:
+        xy, index = npz["xy"], npz["index"]
+    if len(index) == 0:
+        return []
+    return np.split(xy, np.flatnonzero(np.diff(index)) + 1)
+
+
+def render_figure(spec):
+    """Draw one figure spec to its PNG with the Agg canvas (runs in a pool worker)"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import LineCollection
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=spec["figsize"])
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    data, meta = load_raster(spec["raster"])
+    vmin, vmax = meta["stretch"] or (None, None)
+    if spec.get("range"):
+        vmin, vmax = spec["range"]
+    shown = np.ma.masked_equal(data, 0) if not np.issubdtype(data.dtype, np.floating) else data
+    im = ax.imshow(shown, extent=meta["extent"], cmap=spec["cmap"], vmin=vmin, vmax=vmax,
+                   interpolation='nearest')
+
+    if spec.get("mask"):
+        # low-coherence pixels shaded grey
+        mask, _ = load_raster(spec["mask"])
+        low = np.asarray(mask) < spec["mask_below"]
+        ax.imshow(np.ma.masked_where(~low, low), extent=meta["extent"], cmap='gray', alpha=0.3)
+
+    for entry, color, label in spec.get("lines", []):
+        lines = load_lines(entry)
+        if lines:
+            ax.add_collection(LineCollection(lines, colors=color, linewidths=0.6, label=label))
+    if spec.get("lines"):
+        ax.set_xlim(meta["extent"][:2])
+        ax.set_ylim(meta["extent"][2:])
+        if ax.collections:
+            ax.legend(loc='lower right', fontsize=9)
+
+    cbar = fig.colorbar(im, ax=ax, fraction=0.046, pad=0.04)
+    cbar.set_label(spec["label"], fontsize=12)
+    ax.set_xlabel('Easting / Longitude', fontsize=12)
+    ax.set_ylabel('Northing / Latitude', fontsize=12)
+    ax.set_title(spec["title"], fontsize=14)
+
+    fig.savefig(spec["output"], dpi=spec["dpi"], bbox_inches='tight')
+    return spec["output"]
+
+
+def _init_worker():
+    os.environ["MPLBACKEND"] = "Agg"
+
+
+class ReportRenderer:
+    def __init__(self, reports_dir, cache_dir, figsize=(12, 10), dpi=300, viz=None, workers=None):
+        """Multi-site report renderer; viz is the `viz` section (colormaps)"""
+        self.reports_dir = Path(reports_dir)
+        self.cache_dir = Path(cache_dir)
+        self.figsize = tuple(figsize)
+        self.dpi = dpi
+        self.viz = viz or {}
+        self.workers = workers or os.cpu_count() or 1
+        # Largest raster a figure can show: figure size × dpi
+        self.max_shape = (int(self.figsize[1] * self.dpi), int(self.figsize[0] * self.dpi))
+
+    @classmethod
+    def from_config(cls, config):
+        """Build from the `viz` and `report` sections of config.yaml"""
+        viz_cfg = config['viz']
+        report_cfg = config.get('report', {})
+        return cls(
+            config['output']['reports'],
+            report_cfg.get('cache_dir') or Path(config['output']['temp']) / "report_cache",
+            figsize=viz_cfg.get('figsize', (12, 10)),
+            dpi=report_cfg.get('dpi') or viz_cfg['dpi'],
+            viz=viz_cfg,
+            workers=report_cfg.get('workers'),
+        )
+
+    def cmap(self, name):
+        return self.viz.get(name, name)
+
+    def site_figures(self, site, config):
+        """Figure specs of one site, with the raster/vector sources they need"""
+        products_dir = Path(config['output']['products'])
+        threshold = config['processing']['coherence_threshold']
+        rasters, vectors, figures = {}, {}, []
+
+        def raster(path, resampling):
+            if not Path(path).exists():
+                return None
+            entry = str(self.cache_dir / cache_key(path, self.max_shape, resampling))
+            rasters[entry] = (str(path), resampling)
+            return entry
+
+        layers = {key: raster(products_dir / filename, resampling)
+                  for key, (filename, resampling, _, _) in RASTERS.items()}
+        reference = layers["subsidence"] or next((e for e in layers.values() if e), None)
+        lines = []
+        for key, (filename, color) in VECTORS.items():
+            path = products_dir / filename
+            if path.exists() and reference is not None:
+                entry = str(self.cache_dir / cache_key(path, "vector", Path(reference).name))
+                vectors[entry] = (str(path), reference)
+                lines.append((entry, color, f"{key.capitalize()} canals"))
+
+        def figure(name, entry, key, title, **extra):
+            _, _, cmap, label = RASTERS[key]
+            figures.append({
+                "title": f"{site}: {title}", "raster": entry, "cmap": self.cmap(cmap), "label": label,
+                "figsize": self.figsize, "dpi": self.dpi,
+                "output": str(self.reports_dir / "figures" / site / f"{name}.png"), **extra,
+            })
+
+        if layers["subsidence"]:
+            figure("subsidence", layers["subsidence"], "subsidence", "Subsidence velocity",
+                   mask=layers["coherence"], mask_below=threshold)
+        if layers["coherence"]:
+            figure("coherence", layers["coherence"], "coherence", "Median coherence", range=(0, 1))
+        if layers["vv"]:
+            figure("vv", layers["vv"], "vv", "VV median backscatter")
+            if lines:
+                figure("canals", layers["vv"], "vv", "Detected canals", lines=lines)
+        if layers["change"]:
+            figure("change", layers["change"], "change", "Strongest VV change")
+        if layers["risk"]:
+            figure("risk", layers["risk"], "risk", "Canal risk", lines=lines)
+
+        # every pair date from the stack index
+        for index_path in sorted((products_dir / "pairs").glob("index*.json")):
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+            for pair in index["pairs"]:
+                dates = f"{pair['master_date']} – {pair['slave_date']}"
+                aoi = f" [{index['aoi']}]" if index.get("aoi") else ""
+                velocity = raster(index_path.parent / pair["products"]["subsidence_velocity"], "average")
+                coherence = raster(index_path.parent / pair["products"]["coherence"], "average")
+                name = f"{pair['name']}{'_' + index['aoi'] if index.get('aoi') else ''}"
+                if velocity:
+                    figure(f"{name}_subsidence", velocity, "subsidence",
+                           f"Subsidence velocity {dates}{aoi}", mask=coherence, mask_below=threshold)
+                if coherence:
+                    figure(f"{name}_coherence", coherence, "coherence",
+                           f"Coherence {dates}{aoi}", range=(0, 1))
+
+        return rasters, vectors, figures
+
+    def run(self, sites, output_pdf=None):
+        """Render {site id: config} into one multi-page PDF (ids from config_check.site_names)"""
+        print("\n▶ Rendering report...")
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        for site in sites:
+            (self.reports_dir / "figures" / site).mkdir(parents=True, exist_ok=True)
+        output_pdf = Path(output_pdf or self.reports_dir / "report.pdf")
+
+        rasters, vectors, figures = {}, {}, []
+        for site, config in sites.items():
+            site_rasters, site_vectors, site_figures = self.site_figures(site, config)
+            rasters.update(site_rasters)
+            vectors.update(site_vectors)
+            figures += site_figures
+        if not figures:
+            raise RuntimeError("No products to report on")
+
+        todo = [e for e in rasters if not Path(e).with_suffix(".json").exists()]
+        print(f"  {len(figures)} figures from {len(sites)} site(s), "
+              f"{len(rasters) - len(todo)}/{len(rasters)} layers cached, {self.workers} workers")
+
+        # spawn: the pipeline may have live threads (subprocess loop, schedulers)
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context("spawn"),
+                                 initializer=_init_worker) as pool:
+            # 1. decode each raster once; vectors need their reference raster's CRS
+            list(pool.map(cache_raster, [rasters[e][0] for e in todo], todo,
+                          [self.max_shape] * len(todo), [rasters[e][1] for e in todo]))
+            crs = {ref: load_raster(ref)[1]["crs"] for _, ref in vectors.values()}
+            list(pool.map(cache_vector, [path for path, _ in vectors.values()], list(vectors),
+                          [crs[ref] for _, ref in vectors.values()]))
+
+            # 2. figures in parallel, page order kept
+            pages = list(pool.map(render_figure, figures))
+
+        self.assemble(pages, output_pdf)
+        print(f"✓ Report: {output_pdf} ({len(pages)} pages)")
+        return output_pdf
+
+    def assemble(self, pages, output_pdf):
+        """PNG pages into one PDF, one page at a time"""
+        import matplotlib.image as mpimg
+        from matplotlib.backends.backend_pdf import PdfPages
+        from matplotlib.figure import Figure
+
+        with PdfPages(output_pdf) as pdf:
+            for page in pages:
+                image = mpimg.imread(page)
+                fig = Figure(figsize=(image.shape[1] / self.dpi, image.shape[0] / self.dpi))
+                fig.figimage(image)
+                pdf.savefig(fig, dpi=self.dpi)
+
+
+if __name__ == "__main__":
+    # python report_renderer.py [site.yaml ...]: one report over all sites
+    from config_check import site_names
+
+    configs = {}
+    for config_path, site in site_names(sys.argv[1:] or ["config.yaml"]).items():
+        with open(config_path, 'r') as f:
+            configs[site] = yaml.safe_load(f)
+    ReportRenderer.from_config(next(iter(configs.values()))).run(configs)
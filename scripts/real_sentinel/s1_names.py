@@ -0,0 +1,29 @@
+"""
+Helpers for Sentinel-1 product names
+"""
+
+import re
+from datetime import datetime
+from pathlib import Path
+
+# S1A_IW_GRDH_1SDV_20251026T215956_20251026T220021_061602_07B1DF_99ED_COG.SAFE
+SAFE_NAME = re.compile(r"^(S1[A-D])_\w{2}_\w{4}_\w{4}_(\d{8}T\d{6})_(\d{8}T\d{6})_(\d{6})_")
+
+
+def scene_id(path):
+    """SAFE product name without extension, used as a stable scene identifier"""
+    name = Path(str(path).rstrip("/\\")).name
+    return name[:-5] if name.endswith(".SAFE") else name
+
+
+def acquisition_time(path):
+    """Sensing start time parsed from a Sentinel-1 SAFE name"""
+    match = SAFE_NAME.match(scene_id(path))
+    if match is None:
+        raise ValueError(f"Not a Sentinel-1 product name: {path}")
+    return datetime.strptime(match.group(2), "%Y%m%dT%H%M%S")
+
+
+def acquisition_date(path):
+    """Sensing date parsed from a Sentinel-1 SAFE name"""
+    return acquisition_time(path).date()
@@ -0,0 +1,174 @@
+"""
+Tiled, parallel SNAPHU unwrapping
+
+Rewrites the SnaphuExport-generated .conf with tile rows/cols, overlap and
+process count from config.yaml, runs SNAPHU while streaming its log for
+per-tile progress, and retries with smaller tiles when a run fails or a
+tile stalls past its timeout.
+"""
+
+import os
+import re
+import shutil
+import sys
+import time
+from pathlib import Path
+
+from async_runner import AsyncRunner
+
+TILE_KEYS = ("NTILEROW", "NTILECOL", "ROWOVRLP", "COLOVRLP", "NPROC")
+TILE_START = re.compile(r"Unwrapping tile at row (\d+), column (\d+)")
+
+
+def find_snaphu(config):
+    """Locate the SNAPHU binary: snaphu.path, SNAP's auxdata, then PATH"""
+    explicit = config.get('snaphu', {}).get('path')
+    if explicit:
+        exe = Path(explicit)
+        if not exe.exists():
+            raise RuntimeError(f"Snaphu not found: {exe} (snaphu.path in config)")
+        return exe
+
+    auxdata = Path.home() / ".snap" / "auxdata"
+    exe_name = "snaphu.exe" if sys.platform == "win32" else "snaphu"
+    candidates = [
+        auxdata / "snaphu" / "win64" / "snaphu.exe",
+        *sorted(auxdata.glob(f"snaphu*/bin/{exe_name}"), reverse=True),
+        *sorted(auxdata.glob(f"snaphu*/*/{exe_name}"), reverse=True),
+    ]
+    for exe in candidates:
+        if exe.is_file() and (sys.platform == "win32" or os.access(exe, os.X_OK)):
+            return exe
+
+    on_path = shutil.which("snaphu")
+    if on_path:
+        return Path(on_path)
+
+    raise RuntimeError(
+        f"Snaphu not found under {auxdata} or on PATH\n"
+        "Install via SNAP: Tools → Plugins → SNAPHU Unwrapping, or set snaphu.path"
+    )
+
+
+def snaphu_args(conf_path):
+    """Command-line arguments SnaphuExport recorded in the .conf header"""
+    # e.g. "#   snaphu -f snaphu.conf Phase_ifg_VV_26Oct2025_07Nov2025.snaphu.img 18112"
+    for line in Path(conf_path).read_text().splitlines():
+        stripped = line.lstrip("#").strip()
+        if stripped.startswith("snaphu ") and " -f " in f" {stripped} ":
+            return stripped.split()[1:]
+    return ["-f", Path(conf_path).name]
+
+
+def configure_tiles(conf_path, tile_rows, tile_cols, overlap, nproc):
+    """Rewrite tiling keys in a SNAPHU .conf"""
+    conf_path = Path(conf_path)
+    lines = [
+        line for line in conf_path.read_text().splitlines()
+        if not line.strip() or line.split()[0] not in TILE_KEYS
+    ]
+    lines += [
+        f"NTILEROW {tile_rows}",
+        f"NTILECOL {tile_cols}",
+        f"ROWOVRLP {overlap}",
+        f"COLOVRLP {overlap}",
+        f"NPROC {nproc}",
+    ]
+    conf_path.write_text("\n".join(lines) + "\n")
+
+
+class SnaphuRunner:
+    def __init__(self, exe, tile_rows=4, tile_cols=4, overlap=200, nproc=4,
+                 timeout_min=120, tile_timeout_min=30, retries=2, runner=None):
+        """SNAPHU with tiling, streamed progress, timeouts and tile-shrinking retries"""
+        self.exe = Path(exe)
+        self.tile_rows = tile_rows
+        self.tile_cols = tile_cols
+        self.overlap = overlap
+        self.nproc = nproc
+        self.timeout_s = timeout_min * 60
+        self.tile_timeout_s = tile_timeout_min * 60
+        self.retries = retries
+        self.runner = runner or AsyncRunner()
+
+    @classmethod
+    def from_config(cls, config, runner=None, locate=True):
+        """Build from the `snaphu` section of config.yaml (locate=False: don't look for the binary)"""
+        sn_cfg = config.get('snaphu', {})
+        return cls(
+            find_snaphu(config) if locate else Path(sn_cfg.get('path') or "snaphu"),
+            tile_rows=sn_cfg.get('tile_rows', 4),
+            tile_cols=sn_cfg.get('tile_cols', 4),
+            overlap=sn_cfg.get('overlap', 200),
+            nproc=sn_cfg.get('nproc') or os.cpu_count() or 1,
+            timeout_min=sn_cfg.get('timeout_min', 120),
+            tile_timeout_min=sn_cfg.get('tile_timeout_min', 30),
+            retries=sn_cfg.get('retries', 2),
+            runner=runner,
+        )
+
+    @property
+    def settings(self):
+        """Tiling parameters that change the result (part of the step cache key)"""
+        return f"{self.tile_rows}x{self.tile_cols}+{self.overlap}"
+
+    def run(self, conf_path, watch=None):
+        """Unwrap, shrinking tiles on failure; raises after the last retry
+
+        watch(proc) is called with each SNAPHU process as it starts (profiling).
+        """
+        conf_path = Path(conf_path)
+        rows, cols = self.tile_rows, self.tile_cols
+
+        for attempt in range(self.retries + 1):
+            configure_tiles(conf_path, rows, cols, self.overlap, self.nproc)
+            print(f"  Running SNAPHU: {rows}x{cols} tiles, overlap {self.overlap}, "
+                  f"{self.nproc} processes (attempt {attempt + 1}/{self.retries + 1})")
+
+            ok, reason = self._run_once(conf_path, rows * cols, watch)
+            if ok:
+                return
+            print(f"  ⚠ SNAPHU {reason}")
+
+            # smaller tiles: less memory per process, shorter per-tile runtimes
+            rows, cols = rows * 2, cols * 2
+
+        raise RuntimeError("SNAPHU unwrapping failed")
+
+    def _run_once(self, conf_path, n_tiles, watch=None):
+        start = time.monotonic()
+        tiles_started = 0
+
+        # SNAPHU can go quiet for a long time inside one tile: only a new
+        # tile counts as progress for the stall timeout
+        def on_line(stream, line):
+            nonlocal tiles_started
+            if TILE_START.search(line):
+                tiles_started += 1
+                print(f"  SNAPHU tile {tiles_started}/{n_tiles} "
+                      f"({time.monotonic() - start:.0f} s)")
+                return True
+            return False
+
+        result = self.runner.run(
+            [self.exe, *snaphu_args(conf_path)], "snaphu",
+            log_path=conf_path.parent / "snaphu.log",
+            cwd=str(conf_path.parent),
+            watch=watch,
+            on_line=on_line,
+            timeout_s=self.timeout_s,
+            stall_s=self.tile_timeout_s if n_tiles > 1 else 0,
+            progress=False,
+        )
+
+        if result.reason == "timeout":
+            return False, f"timed out after {self.timeout_s / 60:.0f} minutes"
+        if result.reason == "stalled":
+            return False, f"no tile progress for {self.tile_timeout_s / 60:.0f} minutes"
+        if result.returncode != 0:
+            tail = "\n".join([result.stdout, result.stderr]).strip().splitlines()[-20:]
+            print("  SNAPHU log tail:\n    " + "\n    ".join(tail))
+            return False, f"exited with code {result.returncode}"
+
+        print(f"  ✓ SNAPHU finished in {result.elapsed_s / 60:.1f} minutes")
+        return True, None
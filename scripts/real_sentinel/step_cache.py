@@ -0,0 +1,344 @@
+"""
+Content-addressed cache for SNAP GPT step outputs
+
+Each GPT step is keyed on the graph XML, its resolved -P parameters and the
+fingerprints of the input products it reads. Outputs live under
+<temp>/cache/<key>/ and are recorded in a JSON manifest, so a rerun of the
+pipeline skips every step whose BEAM-DIMAP output is already present and intact.
+
+An input that is itself a step output (<root>/<key>/<name>) is fingerprinted
+by the key in its path, whether or not it still exists: intermediates can be
+deleted once consumed without invalidating the steps downstream of them.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from pathlib import Path
+
+MANIFEST_NAME = "manifest.json"
+KEY_LENGTH = 24
+
+# BEAM-DIMAP band data types → bytes per sample
+DIMAP_DTYPE_BYTES = {
+    'int8': 1, 'uint8': 1,
+    'int16': 2, 'uint16': 2,
+    'int32': 4, 'uint32': 4,
+    'float32': 4, 'float64': 8,
+}
+
+
+def producer_key(path):
+    """Step key a cached output's path encodes (<root>/<key>/<name>), None for other paths"""
+    name = Path(path).parent.name
+    if len(name) == KEY_LENGTH and all(c in "0123456789abcdef" for c in name):
+        return name
+    return None
+
+
+def product_files(path):
+    """List the files making up a product (.dim + .data/, SAFE folder, or single file)"""
+    path = Path(path)
+    files = []
+    if path.is_file():
+        files.append(path)
+    elif path.is_dir():
+        files.extend(p for p in sorted(path.rglob("*")) if p.is_file())
+
+    if path.suffix == ".dim":
+        data_dir = path.parent / (path.stem + ".data")
+        if data_dir.is_dir():
+            files.extend(p for p in sorted(data_dir.rglob("*")) if p.is_file())
+    return files
+
+
+def product_size(path):
+    """Total bytes on disk of a product"""
+    return sum(f.stat().st_size for f in product_files(path))
+
+
+def dimap_is_complete(dim_path):
+    """Check a BEAM-DIMAP product for truncated or missing band files"""
+    dim_path = Path(dim_path)
+    data_dir = dim_path.parent / (dim_path.stem + ".data")
+    if not dim_path.is_file() or not data_dir.is_dir():
+        return False
+
+    try:
+        root = ET.parse(dim_path).getroot()
+    except ET.ParseError:
+        return False
+
+    ncols = root.findtext(".//Raster_Dimensions/NCOLS")
+    nrows = root.findtext(".//Raster_Dimensions/NROWS")
+    if ncols is None or nrows is None:
+        return False
+    n_pixels = int(ncols) * int(nrows)
+
+    band_types = {}
+    for band in root.iter("Spectral_Band_Info"):
+        band_types[band.findtext("BAND_INDEX")] = band.findtext("DATA_TYPE")
+
+    for data_file in root.iter("Data_File"):
+        href = data_file.find("DATA_FILE_PATH").get("href")
+        hdr = dim_path.parent / href
+        img = hdr.with_suffix(".img")
+        if not hdr.is_file() or not img.is_file():
+            return False
+
+        nbytes = DIMAP_DTYPE_BYTES.get(band_types.get(data_file.findtext("BAND_INDEX")))
+        if nbytes and img.stat().st_size != n_pixels * nbytes:
+            return False
+
+    return True
+
+
+class StepCache:
+    def __init__(self, temp_dir, max_size_gb=None, enabled=True, stale_hours=12):
+        """Open the step cache under the temp directory (created by the first step stored)"""
+        self.temp_dir = Path(temp_dir)
+        self.root = self.temp_dir / "cache"
+        self.manifest_path = self.root / MANIFEST_NAME
+        self.enabled = enabled
+        self.max_bytes = int(max_size_gb * 1024**3) if max_size_gb else None
+        self.stale_seconds = stale_hours * 3600
+
+        self._lock = threading.RLock()
+        self._session = set()  # keys used by this run, never evicted mid-run
+        self._graphs = {}  # graph path → XML bytes kept in memory by a dry run
+
+    @classmethod
+    def from_config(cls, config):
+        """Build the cache from the `cache` section of config.yaml"""
+        cache_cfg = config.get('cache', {})
+        return cls(
+            config['output']['temp'],
+            max_size_gb=cache_cfg.get('max_size_gb'),
+            enabled=cache_cfg.get('enabled', True),
+        )
+
+    # ---------- manifest ----------
+
+    def _load(self):
+        if not self.manifest_path.exists():
+            return {"version": 1, "entries": {}}
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError):
+            print(f"  ⚠ Step cache manifest unreadable, starting fresh")
+            return {"version": 1, "entries": {}}
+
+    def _save(self, manifest):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, self.manifest_path)
+
+    # ---------- keys ----------
+
+    def fingerprint(self, path):
+        """Fingerprint an input product: its cache key if we produced it, else file stats"""
+        path = Path(path)
+        key = producer_key(path)
+        if key is not None:
+            return f"step:{key}"
+
+        h = hashlib.sha256()
+        for f in product_files(path):
+            st = f.stat()
+            h.update(f"{f.relative_to(path.parent)}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+        return f"stat:{h.hexdigest()}"
+
+    def key(self, graphs, params):
+        """Hash graph XML(s), -P parameters and input fingerprints into a step key"""
+        if not self.enabled:
+            return None
+
+        if not isinstance(graphs, (list, tuple)):
+            graphs = [graphs]
+
+        h = hashlib.sha256()
+        for graph in graphs:
+            data = self._graphs.get(Path(graph))
+            h.update(data if data is not None else Path(graph).read_bytes())
+
+        for name in sorted(params):
+            val = str(params[name])
+            h.update(f"{name}={val}\n".encode())
+            if val and (producer_key(val) is not None or Path(val).exists()):
+                h.update(self.fingerprint(val).encode())
+
+        return h.hexdigest()[:KEY_LENGTH]
+
+    def hold_graph(self, path, graph_xml):
+        """Key path as if graph_xml had been written to it (dry runs write nothing)"""
+        # write_text translates newlines, so hash the bytes a real run would read back
+        with self._lock:
+            self._graphs[Path(path)] = graph_xml.replace("\n", os.linesep).encode('utf-8')
+
+    # ---------- lookup / store ----------
+
+    def lookup(self, key, output_name, touch=True):
+        """Return the cached output for a key if it exists and passes integrity checks
+
+        touch=False only reads (dry runs): no use is recorded and a broken
+        entry is left for the real run to clear.
+        """
+        if key is None:
+            return None
+
+        with self._lock:
+            manifest = self._load()
+            entry = manifest["entries"].get(key)
+            if entry is None:
+                return None
+
+            output_path = self.root / entry["output"]
+            if not self._is_intact(output_path, entry):
+                print(f"  ⚠ Cached {output_name} is incomplete, recomputing")
+                if not touch:
+                    return None
+                self._remove(key, manifest)
+                self._save(manifest)
+                return None
+
+            if not touch:
+                return output_path
+            entry["last_used"] = datetime.now().isoformat(timespec='seconds')
+            self._save(manifest)
+            self._session.add(key)
+
+        return output_path
+
+    def prepare(self, key, output_name, work_dir=None, root=None):
+        """Reserve a clean output location for a step (wipes partial leftovers)
+
+        With the cache disabled the output goes to work_dir (default: temp dir).
+        root places the step folder elsewhere (e.g. a RAM disk) instead of the cache root.
+        """
+        output_path = self.planned_path(key, output_name, work_dir, root)
+        if key is None:
+            return output_path
+
+        step_dir = output_path.parent
+        if step_dir.exists():
+            shutil.rmtree(step_dir)
+        step_dir.mkdir(parents=True)
+
+        with self._lock:
+            self._session.add(key)
+        return output_path
+
+    def planned_path(self, key, output_name, work_dir=None, root=None):
+        """Where prepare() would put a step's output, without touching the disk"""
+        if key is None:
+            return Path(root or work_dir or self.temp_dir) / output_name
+        return Path(root or self.root) / key / output_name
+
+    def commit(self, key, output_path, step, params):
+        """Record a finished step in the manifest and enforce the size bound"""
+        if key is None:
+            return
+
+        output_path = Path(output_path)
+        files = {
+            str(f.relative_to(output_path.parent)): f.stat().st_size
+            for f in product_files(output_path)
+        }
+        now = datetime.now().isoformat(timespec='seconds')
+        # relative under the cache root, absolute when prepared elsewhere
+        if output_path.is_relative_to(self.root):
+            output = str(output_path.relative_to(self.root))
+        else:
+            output = str(output_path)
+
+        with self._lock:
+            manifest = self._load()
+            manifest["entries"][key] = {
+                "step": step,
+                "output": output,
+                "params": {k: str(v) for k, v in params.items()},
+                "files": files,
+                "size": sum(files.values()),
+                "created": now,
+                "last_used": now,
+            }
+            self._evict(manifest)
+            self._save(manifest)
+
+    # ---------- integrity / eviction ----------
+
+    def _is_intact(self, output_path, entry):
+        for rel, size in entry.get("files", {}).items():
+            f = output_path.parent / rel
+            if not f.is_file() or f.stat().st_size != size:
+                return False
+
+        if output_path.suffix == ".dim":
+            return dimap_is_complete(output_path)
+        return output_path.exists()
+
+    def _remove(self, key, manifest):
+        entry = manifest["entries"].pop(key, None)
+        shutil.rmtree(self.root / key, ignore_errors=True)
+        if entry is not None:
+            shutil.rmtree((self.root / entry["output"]).parent, ignore_errors=True)
+
+    def discard(self, path):
+        """Delete a cached output and its entry; False if path is not a cached output"""
+        path = Path(path)
+        with self._lock:
+            manifest = self._load()
+            for key, entry in manifest["entries"].items():
+                if self.root / entry["output"] == path:
+                    self._session.discard(key)
+                    self._remove(key, manifest)
+                    self._save(manifest)
+                    return True
+        return False
+
+    def _evict(self, manifest):
+        # Partial step folders from crashed runs that were never committed
+        now = time.time()
+        for step_dir in (self.root.iterdir() if self.root.exists() else []):
+            if (step_dir.is_dir() and step_dir.name not in manifest["entries"]
+                    and step_dir.name not in self._session
+                    and now - step_dir.stat().st_mtime > self.stale_seconds):
+                print(f"  Removing stale partial output: {step_dir.name}")
+                shutil.rmtree(step_dir, ignore_errors=True)
+
+        if self.max_bytes is None:
+            return
+
+        entries = manifest["entries"]
+        total = sum(e["size"] for e in entries.values())
+
+        # Least recently used first; outputs of the current run are kept
+        for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key in self._session:
+                continue
+            total -= entries[key]["size"]
+            print(f"  Evicting cached {entries[key]['step']} ({entries[key]['size'] / 1024**3:.1f} GB)")
+            self._remove(key, manifest)
+
+    def total_size(self):
+        """Bytes currently held by cached steps"""
+        with self._lock:
+            return sum(e["size"] for e in self._load()["entries"].values())
+
+    def typical_size(self, step):
+        """Median recorded output size of a step (by graph name), None if never run"""
+        if not self.manifest_path.exists():
+            return None
+        with self._lock:
+            sizes = sorted(e["size"] for e in self._load()["entries"].values() if e["step"] == step)
+        return sizes[len(sizes) // 2] if sizes else None
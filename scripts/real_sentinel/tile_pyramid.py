@@ -0,0 +1,328 @@
+"""
+XYZ tile pyramid for the dashboard
+
+Renders product rasters into colormapped web-mercator (EPSG:3857) PNG or
+WebP tiles at products/tiles/<layer>/{z}/{x}/{y}.<ext>, using the viz
+colormaps from config.yaml. Tiles are rendered on a process pool; each tile
+reads only its own source window, decimated to tile resolution (served from
+the COG overviews). A manifest per layer records, for every tile, a hash of
+the source pixels and render settings plus the checksum of the written file,
+so refreshing a product re-renders only the tiles whose pixels changed.
+"""
+
+import hashlib
+import io
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+from rasterio.warp import reproject, transform_bounds
+from rasterio.windows import from_bounds as window_from_bounds
+
+TILE_SIZE = 256
+WEB_MERCATOR_HALF = 20037508.342789244
+MANIFEST_NAME = "manifest.json"
+FORMATS = {"png": "PNG", "webp": "WEBP"}
+
+
+def tile_bounds(z, x, y):
+    """EPSG:3857 bounds (left, bottom, right, top) of an XYZ tile"""
+    size = 2 * WEB_MERCATOR_HALF / 2**z
+    left = -WEB_MERCATOR_HALF + x * size
+    top = WEB_MERCATOR_HALF - y * size
+    return left, top - size, left + size, top
+
+
+def lonlat_to_tile(lon, lat, z):
+    lat = max(min(lat, 85.0511), -85.0511)
+    n = 2**z
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tiles_covering(bounds_lonlat, z):
+    """All (z, x, y) tiles intersecting lon/lat bounds"""
+    west, south, east, north = bounds_lonlat
+    x0, y0 = lonlat_to_tile(west, north, z)
+    x1, y1 = lonlat_to_tile(east, south, z)
+    return [(z, x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def native_zoom(src):
+    """Deepest zoom whose tile pixels are not finer than the source pixels"""
+    west, south, east, north = transform_bounds(src.crs, "EPSG:4326", *src.bounds)
+    lat = math.radians((south + north) / 2)
+    # source pixel size in metres on the ground
+    if src.crs.is_geographic:
+        px_m = abs(src.transform.a) * 111320 * math.cos(lat)
+    else:
+        px_m = abs(src.transform.a)
+    z0_m = 2 * WEB_MERCATOR_HALF / TILE_SIZE * math.cos(lat)
+    return max(0, math.ceil(math.log2(z0_m / px_m)))
+
+
+def colormap_lut(name):
+    """256-entry RGBA lookup table of a matplotlib colormap"""
+    import matplotlib
+    cmap = matplotlib.colormaps[name]
+    return (cmap(np.linspace(0, 1, 256)) * 255).astype('uint8')
+
+
+def read_tile_source(src, z, x, y, resampling):
+    """Source pixels of one tile, warped onto its 256x256 web-mercator grid"""
+    bounds = tile_bounds(z, x, y)
+    src_bounds = transform_bounds("EPSG:3857", src.crs, *bounds)
+    window = window_from_bounds(*src_bounds, transform=src.transform)
+    window = window.round_offsets().round_lengths()
+
+    # clip to the raster; tiles straddling the edge keep their outside part empty
+    col0, row0 = max(0, window.col_off), max(0, window.row_off)
+    col1 = min(src.width, window.col_off + window.width)
+    row1 = min(src.height, window.row_off + window.height)
+    if col1 <= col0 or row1 <= row0:
+        return None
+    window = rasterio.windows.Window(col0, row0, col1 - col0, row1 - row0)
+
+    # decimate to ~2x tile resolution (GDAL picks the matching overview)
+    scale = max(1.0, max(window.width, window.height) / (2 * TILE_SIZE))
+    out_shape = (max(1, int(window.height / scale)), max(1, int(window.width / scale)))
+    data = src.read(1, window=window, out_shape=out_shape, resampling=resampling, masked=True)
+    data = data.astype('float32').filled(np.nan)
+
+    win_transform = src.window_transform(window) * rasterio.Affine.scale(
+        window.width / out_shape[1], window.height / out_shape[0])
+
+    tile = np.full((TILE_SIZE, TILE_SIZE), np.nan, dtype='float32')
+    reproject(
+        data, tile,
+        src_transform=win_transform, src_crs=src.crs, src_nodata=np.nan,
+        dst_transform=from_bounds(*bounds, TILE_SIZE, TILE_SIZE), dst_crs="EPSG:3857",
+        dst_nodata=np.nan,
+        resampling=Resampling.nearest if resampling == Resampling.mode else Resampling.bilinear,
+    )
+    return tile
+
+
+def colorize(tile, lut, vmin, vmax):
+    """float tile → RGBA, NaN transparent"""
+    valid = np.isfinite(tile)
+    idx = np.zeros(tile.shape, dtype='uint8')
+    idx[valid] = np.clip((tile[valid] - vmin) / (vmax - vmin) * 255, 0, 255).astype('uint8')
+    rgba = lut[idx]
+    rgba[~valid, 3] = 0
+    return rgba
+
+
+def encode(rgba, fmt, quality):
+    from PIL import Image
+    buf = io.BytesIO()
+    options = {"quality": quality, "method": 4} if fmt == "webp" else {"optimize": False}
+    Image.fromarray(rgba, "RGBA").save(buf, FORMATS[fmt], **options)
+    return buf.getvalue()
+
+
+def render_batch(job):
+    """Worker: render a batch of tiles of one layer, skipping unchanged ones"""
+    lut = colormap_lut(job["cmap"])
+    resampling = Resampling[job["resampling"]]
+    out_dir = Path(job["out_dir"])
+    results = []
+
+    with rasterio.open(job["source"]) as src:
+        for z, x, y in job["tiles"]:
+            key = f"{z}/{x}/{y}"
+            tile = read_tile_source(src, z, x, y, resampling)
+            if tile is None or not np.isfinite(tile).any():
+                results.append((key, None, None, "empty"))
+                continue
+
+            source_hash = hashlib.sha256(job["settings"].encode() + tile.tobytes()).hexdigest()[:20]
+            path = out_dir / str(z) / str(x) / f"{y}.{job['format']}"
+            previous = job["previous"].get(key)
+            if previous and previous["source"] == source_hash and path.exists():
+                results.append((key, source_hash, previous["sha256"], "unchanged"))
+                continue
+
+            data = encode(colorize(tile, lut, job["vmin"], job["vmax"]), job["format"], job["quality"])
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(path.suffix + ".tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+            results.append((key, source_hash, hashlib.sha256(data).hexdigest()[:20], "rendered"))
+
+    return results
+
+
+class TilePyramid:
+    def __init__(self, layers, out_dir, min_zoom=8, max_zoom=None, tile_format="png",
+                 quality=85, workers=None, batch_size=64):
+        """layers: {name: {"source", "cmap", "range" (or None), "resampling"}}"""
+        if tile_format not in FORMATS:
+            raise ValueError(f"Unknown tile format {tile_format!r} (png or webp)")
+        self.layers = layers
+        self.out_dir = Path(out_dir)
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.format = tile_format
+        self.quality = quality
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+
+    @classmethod
+    def from_config(cls, config):
+        """Build from the `tiles` and `viz` sections of config.yaml"""
+        viz = config['viz']
+        tiles_cfg = config.get('tiles', {})
+        products = Path(config['output']['products'])
+        ranges = tiles_cfg.get('ranges', {})
+        layers = {
+            "subsidence": {
+                "source": products / "subsidence_velocity.tif",
+                "cmap": viz['cmap_subsidence'],
+                "range": ranges.get('subsidence'),
+                "resampling": "average",
+            },
+            "coherence": {
+                "source": products / "coherence_median.tif",
+                "cmap": viz.get('cmap_coherence', 'gray'),
+                "range": ranges.get('coherence', [0.0, 1.0]),
+                "resampling": "average",
+            },
+            "risk": {
+                "source": products / "canal_risk_score.tif",
+                "cmap": viz['cmap_risk'],
+                "range": ranges.get('risk', [0.0, 1.0]),
+                "resampling": "average",
+            },
+        }
+        wanted = tiles_cfg.get('layers')
+        if wanted:
+            layers = {name: layers[name] for name in wanted}
+        return cls(
+            layers,
+            tiles_cfg.get('output_dir') or products / "tiles",
+            min_zoom=tiles_cfg.get('min_zoom', 8),
+            max_zoom=tiles_cfg.get('max_zoom'),
+            tile_format=tiles_cfg.get('format', 'png'),
+            quality=tiles_cfg.get('quality', 85),
+            workers=tiles_cfg.get('workers'),
+        )
+
+    def stretch(self, src, layer):
+        """Fixed range from config, else a 2-98 % stretch from an overview read"""
+        if layer.get("range"):
+            return tuple(float(v) for v in layer["range"])
+        scale = max(1.0, max(src.width, src.height) / 1024)
+        sample = src.read(1, out_shape=(int(src.height / scale), int(src.width / scale)),
+                          resampling=Resampling.average, masked=True)
+        lo, hi = np.nanpercentile(sample.astype('float32').filled(np.nan), [2, 98])
+        # rounded so small refreshes don't shift the colours of every tile
+        step = 10 ** math.floor(math.log10(max(hi - lo, 1e-6))) / 10
+        return round(math.floor(lo / step) * step, 6), round(math.ceil(hi / step) * step, 6)
+
+    def load_manifest(self, layer_dir):
+        path = layer_dir / MANIFEST_NAME
+        if not path.exists():
+            return {"tiles": {}}
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def render_layer(self, name, layer, pool):
+        source = Path(layer["source"])
+        if not source.exists():
+            print(f"  ⚠ {name}: {source.name} not found, skipped")
+            return None
+
+        layer_dir = self.out_dir / name
+        layer_dir.mkdir(parents=True, exist_ok=True)
+        manifest = self.load_manifest(layer_dir)
+
+        with rasterio.open(source) as src:
+            vmin, vmax = self.stretch(src, layer)
+            max_zoom = self.max_zoom if self.max_zoom is not None else native_zoom(src)
+            bounds_ll = transform_bounds(src.crs, "EPSG:4326", *src.bounds)
+
+        min_zoom = min(self.min_zoom, max_zoom)
+        tiles = [t for z in range(min_zoom, max_zoom + 1) for t in tiles_covering(bounds_ll, z)]
+        settings = json.dumps([layer["cmap"], vmin, vmax, self.format, self.quality])
+
+        # batches of neighbouring tiles: each worker opens the source once per batch
+        jobs = []
+        for i in range(0, len(tiles), self.batch_size):
+            batch = tiles[i:i + self.batch_size]
+            jobs.append({
+                "source": str(source),
+                "out_dir": str(layer_dir),
+                "tiles": batch,
+                "cmap": layer["cmap"],
+                "resampling": layer["resampling"],
+                "vmin": vmin,
+                "vmax": vmax,
+                "format": self.format,
+                "quality": self.quality,
+                "settings": settings,
+                "previous": {f"{z}/{x}/{y}": manifest["tiles"][f"{z}/{x}/{y}"]
+                             for z, x, y in batch if f"{z}/{x}/{y}" in manifest["tiles"]},
+            })
+
+        entries = {}
+        counts = {"rendered": 0, "unchanged": 0, "empty": 0}
+        for future in as_completed([pool.submit(render_batch, job) for job in jobs]):
+            for key, source_hash, checksum, status in future.result():
+                counts[status] += 1
+                if status != "empty":
+                    entries[key] = {"source": source_hash, "sha256": checksum}
+
+        # tiles that no longer exist in the pyramid (empty now, zoom range or format changed)
+        old_format = manifest.get('format', self.format)
+        stale_keys = set(manifest["tiles"]) - (set(entries) if old_format == self.format else set())
+        removed = 0
+        for key in stale_keys:
+            stale = layer_dir / f"{key}.{old_format}"
+            if stale.exists():
+                stale.unlink()
+                removed += 1
+
+        manifest = {
+            "layer": name,
+            "source": str(source),
+            "updated": datetime.now().isoformat(timespec='seconds'),
+            "format": self.format,
+            "tile_size": TILE_SIZE,
+            "cmap": layer["cmap"],
+            "range": [vmin, vmax],
+            "bounds": list(bounds_ll),
+            "minzoom": min_zoom,
+            "maxzoom": max_zoom,
+            "url": f"{name}/{{z}}/{{x}}/{{y}}.{self.format}",
+            "tiles": dict(sorted(entries.items())),
+        }
+        tmp = layer_dir / (MANIFEST_NAME + ".tmp")
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp, layer_dir / MANIFEST_NAME)
+
+        print(f"✓ {name}: z{min_zoom}-{max_zoom}, {counts['rendered']} rendered, "
+              f"{counts['unchanged']} unchanged, {counts['empty']} empty"
+              + (f", {removed} removed" if removed else ""))
+        return layer_dir / MANIFEST_NAME
+
+    def run(self):
+        """Render (or refresh) every layer; returns {layer: manifest path}"""
+        print("\n▶ Rendering tile pyramid...")
+        manifests = {}
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            for name, layer in self.layers.items():
+                manifest = self.render_layer(name, layer, pool)
+                if manifest is not None:
+                    manifests[name] = manifest
+        print(f"  Tiles: {self.out_dir}")
+        return manifests
@@ -0,0 +1,160 @@
+"""
+Per-pixel velocity inversion over a stack of interferometric pairs
+
+Each pair k contributes a vertical displacement d_k over its temporal
+baseline dt_k (acquisition dates parsed from the SAFE names). For every
+pixel the coherence-weighted least-squares velocity
+
+    v = Σ w_k d_k dt_k / Σ w_k dt_k²,   w_k = γ_k² / (1 - γ_k²)
+
+is solved in closed form, vectorized over row strips of millions of pixels,
+together with its standard error and the temporal coherence of the
+residuals.
+"""
+
+import json
+import os
+import warnings
+from contextlib import ExitStack
+from pathlib import Path
+
+import numpy as np
+
+from raster_blocks import AlignedReaders, block_windows, rows_per_block, read_masked, process_blocks
+from s1_names import acquisition_date
+from product_writer import ProductWriter
+
+WAVELENGTH_M = 0.056  # Sentinel-1 C-band
+
+
+class VelocityInversion:
+    def __init__(self, incidence_angle=37, min_pairs=2, block_budget_mb=512, workers=None, writer=None):
+        """Coherence-weighted LS velocity solver"""
+        self.incidence_rad = np.deg2rad(incidence_angle)
+        self.min_pairs = min_pairs
+        self.budget_bytes = block_budget_mb * 1024**2
+        self.workers = workers or os.cpu_count() or 1
+        self.writer = writer or ProductWriter()
+
+    @classmethod
+    def from_config(cls, config):
+        """Build from the `timeseries` section of config.yaml"""
+        ts_cfg = config.get('timeseries', {})
+        return cls(
+            incidence_angle=config['processing'].get('incidence_angle', 37),
+            min_pairs=ts_cfg.get('min_pairs', 2),
+            block_budget_mb=ts_cfg.get('block_budget_mb', 512),
+            workers=ts_cfg.get('workers'),
+            writer=ProductWriter.from_config(config),
+        )
+
+    def load_pairs(self, index_path):
+        """Pair rasters and temporal baselines (days) from a stack index.json"""
+        index_path = Path(index_path)
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+
+        pairs = []
+        for pair in index["pairs"]:
+            dt_days = (acquisition_date(pair["slave"]) - acquisition_date(pair["master"])).days
+            pairs.append({
+                "name": pair["name"],
+                "dt_days": dt_days,
+                "velocity": index_path.parent / pair["products"]["subsidence_velocity"],
+                "coherence": index_path.parent / pair["products"]["coherence"],
+            })
+        return pairs
+
+    def solve_block(self, disp_mm, coh, dt_years):
+        """Vectorized solve for a (pairs, rows, cols) block
+
+        Returns velocity (mm/yr), its standard error and temporal coherence.
+        """
+        dt = dt_years[:, None, None].astype('float32')
+
+        coh = np.clip(np.nan_to_num(coh, nan=0.0), 0.0, 0.999)
+        weight = coh * coh / (1 - coh * coh)
+        valid = np.isfinite(disp_mm) & (weight > 0)
+        weight = np.where(valid, weight, 0.0).astype('float32')
+        disp = np.where(valid, disp_mm, 0.0).astype('float32')
+
+        n_valid = valid.sum(axis=0)
+        swdt2 = (weight * dt * dt).sum(axis=0)
+        velocity = (weight * disp * dt).sum(axis=0) / swdt2
+
+        residual = np.where(valid, disp - velocity[None] * dt, 0.0)
+        dof = np.maximum(n_valid - 1, 1)
+        sigma2 = (weight * residual * residual).sum(axis=0) / dof
+        stderr = np.sqrt(sigma2 / swdt2)
+
+        # residual vertical mm → LOS phase, coherence of the phase residuals
+        phase = residual * (4 * np.pi / (WAVELENGTH_M * 1000)) * np.cos(self.incidence_rad)
+        temporal_coh = np.abs(np.where(valid, np.exp(1j * phase), 0).sum(axis=0)) / np.maximum(n_valid, 1)
+
+        enough = n_valid >= self.min_pairs
+        velocity = np.where(enough, velocity, np.nan)
+        stderr = np.where(enough & (n_valid > 1), stderr, np.nan)
+        temporal_coh = np.where(enough, temporal_coh, np.nan)
+
+        return (velocity.astype('float32'), stderr.astype('float32'), temporal_coh.astype('float32'))
+
+    def run(self, index_path, output_dir):
+        """Invert the stack; writes velocity, stderr and temporal coherence GeoTIFFs"""
+        print("\n▶ Inverting velocity over the pair stack...")
+
+        pairs = self.load_pairs(index_path)
+        if len(pairs) < self.min_pairs:
+            raise ValueError(f"Need at least {self.min_pairs} pairs, index has {len(pairs)}")
+
+        dt_days = np.array([p["dt_days"] for p in pairs], dtype='float64')
+        dt_years = dt_days / 365.25
+        n = len(pairs)
+
+        output_dir = Path(output_dir)
+        outputs = {
+            "velocity": output_dir / "velocity_ts.tif",
+            "stderr": output_dir / "velocity_ts_stderr.tif",
+            "temporal_coherence": output_dir / "temporal_coherence.tif",
+        }
+
+        paths = [p["velocity"] for p in pairs] + [p["coherence"] for p in pairs]
+        with AlignedReaders(paths) as readers:
+            # 2 float32 inputs per pair + ~8 float32/complex temporaries per pair
+            block_rows = rows_per_block(readers.width, n * 4 * 10, self.budget_bytes, 2 * self.workers)
+            print(f"  {n} pairs, {readers.width}x{readers.height} px, {block_rows}-row blocks")
+
+            profile = readers.profile
+            profile.update(count=1, dtype='float32', nodata=np.nan)
+
+            def invert_block(window):
+                srcs = readers.datasets()
+                disp = np.empty((n, window.height, window.width), dtype='float32')
+                coh = np.empty_like(disp)
+                for k in range(n):
+                    # per-pair velocity back to displacement over its own baseline
+                    disp[k] = read_masked(srcs[k], window) * np.float32(dt_years[k])
+                    coh[k] = read_masked(srcs[n + k], window)
+                return self.solve_block(disp, coh, dt_years)
+
+            with ExitStack() as stack:
+                dsts = {name: stack.enter_context(self.writer.open(path, profile))
+                        for name, path in outputs.items()}
+
+                def write_block(window, result):
+                    for name, data in zip(("velocity", "stderr", "temporal_coherence"), result):
+                        dsts[name].write(data, 1, window=window)
+
+                with warnings.catch_warnings():
+                    # pixels with no usable pair divide by zero → NaN
+                    warnings.simplefilter('ignore', RuntimeWarning)
+                    process_blocks(
+                        block_windows(readers.height, readers.width, block_rows),
+                        invert_block,
+                        write_block,
+                        workers=self.workers,
+                    )
+
+        print(f"✓ Velocity (LS): {outputs['velocity']}")
+        print(f"✓ Velocity std. error: {outputs['stderr']}")
+        print(f"✓ Temporal coherence: {outputs['temporal_coherence']}")
+        return outputs